@@ -0,0 +1,102 @@
+# Progressive accumulation while the inputs don't change
+#
+# When iMouse/iTime (the ones the shaders actually use) stay the same the
+# frame comes out the same too. Instead of drawing it again every frame the
+# renderer either keeps showing the last one ('pause'), or spends the frames on
+# extra samples with the pixel center jittered ('accumulate'): iJitter (in
+# pixels) is added to fragCoord and the results are averaged in a float
+# feedback buffer, which anti-aliases the edges. After 'max_samples' it stops
+# drawing as well.
+#
+# Usage:
+#       python raymarch_setup.py --idle accumulate --samples 64
+#
+# Note: The scene shader has to add iJitter to its pixel coordinate, the
+#       raymarch setups do ('#define fragCoord (gl_FragCoord.xy + iJitter)')
+
+
+from __future__ import division
+
+from OpenGL.GL import glGetUniformLocation
+
+from renderer import Pass
+
+
+IDLE_MODES = ['pause', 'accumulate']
+
+
+VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec3 vPos;
+layout(location = 1) in vec2 texCoords;
+
+out vec2 texcoords;
+
+void main()
+{
+    gl_Position = vec4(vPos, 1.0);
+    texcoords = texCoords;
+}
+"""
+
+# iChannel0: new sample, iChannel1: average so far (previous frame of this pass)
+FRAGMENT_SHADER = """
+#version 330 core
+uniform sampler2D iChannel0;
+uniform sampler2D iChannel1;
+uniform float iSamples;
+in vec2 texcoords;
+out vec4 fragColor;
+void main()
+{
+    vec4 current = texture(iChannel0, texcoords);
+    vec4 average = texture(iChannel1, texcoords);
+    fragColor = mix(average, current, 1.0 / (iSamples + 1.0));
+}
+"""
+
+
+def halton(index, base):
+    result = 0.0
+    fraction = 1.0 / base
+    while index > 0:
+        result += fraction * (index % base)
+        index //= base
+        fraction /= base
+    return result
+
+
+def sample_offset(sample):
+    """
+        Sub pixel offset of 'sample' (-0.5..0.5), the first one is the pixel center
+
+        return -> x, y in pixels
+    """
+    if sample == 0:
+        return 0.0, 0.0
+    return halton(sample, 2) - 0.5, halton(sample, 3) - 0.5
+
+
+class AccumulatePass(Pass):
+    def __init__(self, scene):
+        """
+            Running average of the frames drawn by the pass 'scene'
+        """
+        Pass.__init__(self, VERTEX_SHADER, FRAGMENT_SHADER, inputs=[scene], format='rgba32f', feedback=True)
+        self.samples = 0           # Samples in the average (set by the renderer, 0 starts over)
+
+    def set_program(self, program):
+        Pass.set_program(self, program)
+        self.uni_samples = glGetUniformLocation(program, 'iSamples')
+
+    def draw(self, renderer, mouse, ticks):
+        # The first sample replaces whatever was accumulated before
+        renderer.state.use_program(self.program)
+        renderer.state.uniform1f(self.uni_samples, float(self.samples))
+        Pass.draw(self, renderer, mouse, ticks)
+
+    def jitter(self):
+        """
+            return -> iJitter for the scene while drawing sample number 'samples'
+        """
+        return sample_offset(self.samples)
@@ -0,0 +1,83 @@
+# Dynamic resolution: pick a render scale each frame to hold a frame time budget
+#
+# The raymarch cost grows with the number of pixels (scale squared), so the
+# scale is moved towards sqrt(target / measured) of the current one. Changes
+# are damped and quantized so the image doesn't pump from frame to frame.
+#
+# The measurement is the GPU time of the passes only, never the time between
+# frames (that includes vsync, pacing sleeps and event handling). Software
+# rasterizers leave the rasterization out of their timer queries, there the
+# passes are bracketed with glFinish and timed on the CPU instead.
+
+
+from __future__ import division
+import math
+
+# GL_RENDERER substrings of rasterizers running on the CPU
+SOFTWARE_RENDERERS = ('llvmpipe', 'softpipe', 'swrast', 'SWR')
+
+
+def software_renderer():
+    """
+        return -> True if the current context rasterizes on the CPU (see SOFTWARE_RENDERERS)
+    """
+    from OpenGL.GL import glGetString, GL_RENDERER
+    renderer = (glGetString(GL_RENDERER) or b'').decode(errors='replace')
+    return any(name in renderer for name in SOFTWARE_RENDERERS)
+
+
+def frame_clock():
+    """
+        return -> 'gpu' if the current context's timer queries can be used, else 'finish'
+    """
+    return 'finish' if software_renderer() else 'gpu'
+
+
+class DynamicResolution(object):
+    def __init__(self, target_ms=16.6, min_scale=0.25, max_scale=1.0, smoothing=0.5, step=1.0 / 32, clock=None):
+        """
+            target_ms -> Frame time budget on the GPU
+            min_scale, max_scale -> Limits for the render scale (fraction of the window size)
+            smoothing -> How much of the way towards the ideal scale to move per update (0..1)
+            step -> Scale is quantized to multiples of this
+            clock -> 'gpu' (timer queries) or 'finish' (CPU time between glFinish calls around
+                     the passes) (Default: frame_clock(), picked by the Renderer)
+        """
+        self.target_ms = target_ms
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.smoothing = smoothing
+        self.step = step
+        self.clock = clock
+
+        self.scale = max_scale
+        self.gpu_ms = None
+
+    def update(self, gpu_ms):
+        """
+            Feed a measured frame time
+
+            return -> new scale
+        """
+        self.gpu_ms = gpu_ms
+        if gpu_ms <= 0.0:
+            return self.scale
+
+        # Pixel count grows with scale squared
+        ideal = self.scale * math.sqrt(self.target_ms / gpu_ms)
+        ideal = min(max(ideal, self.min_scale), self.max_scale)
+
+        scale = self.scale + (ideal - self.scale) * self.smoothing
+        scale = min(max(round(scale / self.step) * self.step, self.min_scale), self.max_scale)
+
+        # Ignore changes smaller than a step (noise)
+        if abs(scale - self.scale) >= self.step:
+            self.scale = scale
+        return self.scale
+
+    def size(self, resolution):
+        """
+            return -> render size for the window 'resolution' at the current scale
+        """
+        w, h = resolution
+        return max(1, int(w * self.scale)), max(1, int(h * self.scale))
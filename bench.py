@@ -0,0 +1,251 @@
+# Headless throughput benchmark for the setups
+#
+# Renders a fixed number of frames at fixed iTime values into an offscreen
+# framebuffer (EGL or OSMesa, llvmpipe works without a GPU) and reports
+# frames/sec, ms/frame percentiles and GPU time from GL_TIME_ELAPSED queries.
+#
+# Usage:
+#       python bench.py                                     (all setups)
+#       python bench.py raymarch_setup --frames 50
+#       python bench.py --json bench.json                   (for CI)
+#       python bench.py --baseline bench.json --tolerance 0.1
+#       python bench.py --lean                              (lean render loop)
+#       python bench.py raymarch_setup --adaptive 16.6      (dynamic resolution)
+#       python bench.py multipass_setup --profile           (per pass GPU/CPU times)
+#       python bench.py --gl-mode default                   (PyOpenGL's error checking, see fastgl.py)
+#       python bench.py raymarch_setup --geometry quad      (GL_QUADS instead of the fullscreen triangle)
+#       python bench.py --async-compile --no-cache          (time to first frame with asynchronous compiles)
+#       python bench.py raymarch_setup --define COMPUTE     (compute shader backend, see compute.py)
+
+
+from __future__ import division
+import argparse
+import ctypes as ct
+import importlib
+import json
+import os
+import sys
+import time
+
+import headless
+from adaptive import DynamicResolution
+
+
+SETUPS = ['minimal_setup', 'raymarch_setup', 'raymarch_setup_mod', 'multipass_setup', 'feedback_setup']
+
+# Fixed time values so the results are comparable between runs
+TIMES = [0.0, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0]
+
+PERCENTILES = [50, 90, 99]
+
+
+def percentiles(samples):
+    from numpy import percentile
+    return dict(('p{}'.format(p), float(percentile(samples, p))) for p in PERCENTILES)
+
+
+def bench_setup(name, frames, warmup, times, mouse, lean=False, **options):
+    """
+        Render 'frames' frames of setup 'name' and time them
+
+        options -> Passed to the setup's renderer
+
+        return -> dict of results
+    """
+    import fastgl
+    from OpenGL.GL import (glGenQueries, glDeleteQueries, glBeginQuery, glEndQuery, glFinish,
+                           glGetString, GL_TIME_ELAPSED, GL_QUERY_RESULT, GL_RENDERER)
+    # The wrapped version fails to convert 64 bit results, use the raw one
+    from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+    module = importlib.import_module(name)
+    startup = time.perf_counter()
+    main = module.Main(headless=True, **options)
+    startup_ms = (time.perf_counter() - startup) * 1000.0
+    main.state.cache = lean
+
+    # Placeholder frames while the programs compile (async compile), until the first real one
+    placeholders = 0
+    while 1:
+        main.render(mouse, times[0])
+        glFinish()
+        if not main.loading:
+            break
+        placeholders += 1
+    first_frame_ms = (time.perf_counter() - startup) * 1000.0
+
+    # Only one GL_TIME_ELAPSED query can be active. With dynamic resolution or
+    # the profiler the renderer is already timing the frames, use its measurements instead
+    scaler = main.dynamic_resolution
+    profiler = main.profiler
+    timed = scaler is None and profiler is None
+    query = glGenQueries(1)[0]
+    result_ns = ct.c_uint64()
+
+    cpu_ms, gpu_ms, gl_calls, scales = [], [], [], []
+    for i in range(warmup + frames):
+        if i == warmup:
+            start = time.perf_counter()
+        frame_start = time.perf_counter()
+
+        if timed:
+            glBeginQuery(GL_TIME_ELAPSED, query)
+        main.render(mouse, times[i % len(times)])
+        if timed:
+            glEndQuery(GL_TIME_ELAPSED)
+
+        # Wait for the frame so the wall time includes the GPU work
+        glFinish()
+        frame_ms = (time.perf_counter() - frame_start) * 1000.0
+        if timed:
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ct.byref(result_ns))
+            frame_gpu_ms = result_ns.value / 1e6
+        elif scaler is not None:
+            frame_gpu_ms = scaler.gpu_ms or 0.0
+        else:
+            frame_gpu_ms = profiler.gpu_frame_ms() or 0.0
+        if scaler is not None:
+            scales.append(scaler.scale)
+
+        # Warmup frames also run through the query since some drivers
+        # report garbage for the first one
+        if i >= warmup:
+            cpu_ms.append(frame_ms)
+            gpu_ms.append(frame_gpu_ms)
+            gl_calls.append(main.state.calls)
+
+    total = time.perf_counter() - start
+
+    result = {'setup': name,
+              'renderer': glGetString(GL_RENDERER).decode(),
+              'resolution': list(main.resolution),
+              'frames': frames,
+              'startup_ms': startup_ms,
+              'first_frame_ms': first_frame_ms,
+              'placeholder_frames': placeholders,
+              'lean': lean,
+              'geometry': main.geometry,
+              'defines': main.defines,
+              'gl_mode': fastgl.MODE,
+              'gl_calls': sum(gl_calls) / len(gl_calls),
+              'fps': frames / total,
+              'ms': percentiles(cpu_ms),
+              'gpu_ms': percentiles(gpu_ms)}
+    result['gpu_ms']['mean'] = sum(gpu_ms) / len(gpu_ms)
+    if scales:
+        result['scale'] = {'mean': sum(scales) / len(scales), 'last': scales[-1]}
+    if profiler is not None:
+        result['passes'] = profiler.stats()
+        result['profile'] = profiler.report()
+        profiler.destroy()
+
+    glDeleteQueries(1, [query])
+    main.context.destroy()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+        Compare fps against a previous run
+
+        return -> list of regression messages (empty if everything is fine)
+    """
+    previous = dict((r['setup'], r) for r in baseline)
+    regressions = []
+    for r in results:
+        if r['setup'] not in previous:
+            continue
+        old_fps = previous[r['setup']]['fps']
+        if r['fps'] < old_fps * (1.0 - tolerance):
+            regressions.append("{}: {:.1f} fps -> {:.1f} fps".format(r['setup'], old_fps, r['fps']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmark for the GLSL setups")
+    parser.add_argument('setups', nargs='*', default=SETUPS, help="Setups to run (Default: all)")
+    parser.add_argument('--frames', type=int, default=120, help="Frames to time per setup")
+    parser.add_argument('--warmup', type=int, default=10, help="Untimed frames before measuring")
+    parser.add_argument('--times', type=lambda s: [float(t) for t in s.split(',')], default=TIMES,
+                        help="Comma separated iTime values cycled through")
+    parser.add_argument('--mouse', type=lambda s: [float(m) for m in s.split(',')], default=[400.0, 300.0],
+                        help="Fixed mouse position in pixels (x,y)")
+    parser.add_argument('--lean', action='store_true', help="Skip redundant GL calls (lean render loop)")
+    parser.add_argument('--no-cache', action='store_true', help="Always compile shaders (no program cache)")
+    parser.add_argument('--no-ubo', action='store_true', help="glUniform per pass instead of the uniform buffer")
+    parser.add_argument('--async-compile', action='store_true',
+                        help="Compile without waiting (placeholder frames until the programs are ready)")
+    parser.add_argument('--geometry', choices=['triangle', 'quad'], default='triangle',
+                        help="Fullscreen triangle (core profile) or GL_QUADS quad")
+    parser.add_argument('--adaptive', type=float, metavar='MS', help="Dynamic resolution with this GPU budget")
+    parser.add_argument('--profile', action='store_true', help="Per pass GPU/CPU times")
+    parser.add_argument('--define', action='append', default=[], metavar='NAME[=VALUE]',
+                        help="#define for the shader templates (e.g. COMPUTE, ACCELERATE), can be repeated")
+    parser.add_argument('--gl-mode', choices=['fast', 'debug', 'default'],
+                        help="PyOpenGL checks (Default: $GLSL_PYTHON_GL, else raw per frame calls with "
+                             "PyOpenGL's checks everywhere else, see fastgl.py)")
+    parser.add_argument('--platform', choices=['egl', 'osmesa'], default='egl')
+    parser.add_argument('--json', help="Write results to this file")
+    parser.add_argument('--baseline', help="Previous --json output to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed fps drop against baseline")
+    args = parser.parse_args(argv)
+
+    # Has to happen before the setups import OpenGL
+    headless.use_platform(args.platform)
+    if args.gl_mode:
+        os.environ['GLSL_PYTHON_GL'] = args.gl_mode     # Read by fastgl on import
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    import fastgl
+    fastgl.prefer('fast')
+    from profiler import FrameProfiler
+
+    results = []
+    for name in args.setups:
+        options = {}
+        if args.no_cache:
+            options['program_cache'] = False
+        if args.no_ubo:
+            options['uniform_block'] = False
+        if args.geometry != 'triangle':
+            options['geometry'] = args.geometry
+        if args.async_compile:
+            options['async_compile'] = True
+        if args.adaptive:
+            options['dynamic_resolution'] = DynamicResolution(args.adaptive)
+        if args.profile:
+            options['profiler'] = FrameProfiler(history=args.frames)
+        if args.define:
+            options['defines'] = {}
+            for define in args.define:
+                define_name, _, value = define.partition('=')
+                options['defines'][define_name] = value or 1
+
+        r = bench_setup(name, args.frames, args.warmup, args.times, args.mouse, args.lean, **options)
+        results.append(r)
+        print("{:<20} {:8.1f} fps   ms p50 {:7.2f} p90 {:7.2f} p99 {:7.2f}   "
+              "gpu ms p50 {:7.2f} mean {:7.2f}   gl calls {:5.1f}   startup ms {:7.1f}   "
+              "first frame ms {:7.1f}".format(
+              name, r['fps'], r['ms']['p50'], r['ms']['p90'], r['ms']['p99'],
+              r['gpu_ms']['p50'], r['gpu_ms']['mean'], r['gl_calls'], r['startup_ms'], r['first_frame_ms']))
+        if 'scale' in r:
+            print("{:<20} scale mean {:.2f} last {:.2f}".format('', r['scale']['mean'], r['scale']['last']))
+        if 'profile' in r:
+            print(r.pop('profile'))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print("REGRESSION " + message)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# Asynchronous framebuffer capture (pixel buffer objects + fences)
+#
+# glReadPixels into client memory waits for the GPU to finish the frame. Here
+# the read goes into a pixel buffer object instead and returns right away, a
+# fence tells when the copy is done. With a ring of buffers the readback of
+# frame N overlaps rendering of frame N+1.
+#
+# Finished buffers are mapped and handed to a writer thread as zero-copy NumPy
+# views. The writer gives them back when done, and only then are they unmapped
+# (GL calls stay on the render thread). When the writer falls behind and every
+# buffer is in use, capture() either waits (block) or skips the frame (drop).
+#
+# Usage:
+#       capture = FrameCapture(resolution, open_sink('frames/'))
+#       ... render ...
+#       capture.capture()       (reads the bound GL_READ_FRAMEBUFFER)
+#       capture.close()
+
+
+from __future__ import division
+import ctypes as ct
+import os
+import shlex
+import subprocess
+import threading
+import time
+from collections import deque
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+import numpy as np
+
+from OpenGL.GL import (glGenBuffers, glDeleteBuffers, glBindBuffer, glBufferData, glReadPixels,
+                       glFenceSync, glClientWaitSync, glDeleteSync, glMapBufferRange, glUnmapBuffer,
+                       GL_PIXEL_PACK_BUFFER, GL_STREAM_READ, GL_RGBA, GL_UNSIGNED_BYTE,
+                       GL_SYNC_GPU_COMMANDS_COMPLETE, GL_SYNC_FLUSH_COMMANDS_BIT, GL_TIMEOUT_EXPIRED,
+                       GL_WAIT_FAILED, GL_MAP_READ_BIT)
+
+import imagefile
+
+
+class PngSink(object):
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, index, image):
+        imagefile.write_png(os.path.join(self.directory, 'frame_{:05d}.png'.format(index)), image)
+
+    def close(self):
+        pass
+
+
+class RawSink(object):
+    def __init__(self, path):
+        """
+            All frames appended into one file (RGBA, bottom row first)
+        """
+        self.file = open(path, 'wb')
+
+    def write(self, index, image):
+        self.file.write(image.data)
+
+    def close(self):
+        self.file.close()
+
+
+class PipeSink(object):
+    def __init__(self, command):
+        """
+            Raw RGBA frames piped into 'command' (an encoder like ffmpeg)
+        """
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE)
+
+    def write(self, index, image):
+        self.process.stdin.write(image.data)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def open_sink(spec, resolution):
+    """
+        Sink from a command line spec
+
+        'dir/'          -> PNG per frame
+        'file.raw'      -> raw frames into one file
+        '|command'      -> raw frames piped to command, {w} and {h} are replaced with the size
+                           (e.g. "|ffmpeg -y -f rawvideo -pix_fmt rgba -s {w}x{h} -i - -vf vflip out.mp4")
+    """
+    if spec.startswith('|'):
+        w, h = resolution
+        return PipeSink(spec[1:].format(w=w, h=h))
+    if spec.endswith('.raw'):
+        return RawSink(spec)
+    return PngSink(spec)
+
+
+class FrameCapture(object):
+    def __init__(self, resolution, sink, depth=3, backlog=2, block=True):
+        """
+            resolution -> Size of the captured framebuffer
+            sink -> Object with write(index, image) and close(), called on the writer thread
+            depth -> Number of pixel buffers in the ring
+            backlog -> Mapped frames allowed to wait for the writer
+            block -> When everything is in use wait for the writer (else drop the frame)
+        """
+        self.resolution = resolution
+        self.sink = sink
+        self.block = block
+        self.size = resolution[0] * resolution[1] * 4
+
+        self.buffers = [int(b) for b in np.atleast_1d(glGenBuffers(depth))]
+        for buffer in self.buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        self.free = list(self.buffers)
+        self.pending = deque()          # (buffer, fence, index) waiting for the GPU
+        self.mapped = set()             # Buffers the writer is holding
+
+        # Writer thread: frames in, finished buffers out
+        self.frames = Queue(backlog)
+        self.returned = Queue()
+        self.writer = threading.Thread(target=self._write, name='FrameCapture writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+        self.index = 0
+        self.captured = 0
+        self.dropped = 0
+        self.stall_s = 0.0              # Time the render thread waited (backpressure)
+
+    def _write(self):
+        while 1:
+            item = self.frames.get()
+            if item is None:
+                break
+            buffer, index, image = item
+            try:
+                self.sink.write(index, image)
+            finally:
+                self.returned.put(buffer)
+
+    def _reclaim(self, wait=False):
+        """
+            Unmap buffers the writer is done with
+        """
+        while self.mapped:
+            try:
+                buffer = self.returned.get(wait)
+            except Empty:
+                break
+            wait = False
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+            self.mapped.discard(buffer)
+            self.free.append(buffer)
+        # Unbound on every way out, read_pixels would read into a mapped buffer otherwise
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def _hand_off(self, wait=False):
+        """
+            Map buffers whose copy finished and queue them for the writer
+
+            wait -> Wait for the oldest copy if it isn't done yet
+        """
+        while self.pending:
+            buffer, fence, index = self.pending[0]
+            status = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000 if wait else 0)
+            if status == GL_TIMEOUT_EXPIRED:
+                break
+            if status == GL_WAIT_FAILED:
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+                raise RuntimeError("glClientWaitSync failed")
+
+            # Writer backlog full: it is falling behind
+            if self.frames.full() and not wait:
+                break
+
+            self.pending.popleft()
+            glDeleteSync(fence)
+
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            pointer = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.size, GL_MAP_READ_BIT)
+            w, h = self.resolution
+            image = np.ctypeslib.as_array(ct.cast(pointer, ct.POINTER(ct.c_ubyte)), shape=(h, w, 4))
+
+            self.mapped.add(buffer)
+            self.frames.put((buffer, index, image))
+            wait = False
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def capture(self):
+        """
+            Start reading the currently bound GL_READ_FRAMEBUFFER
+
+            return -> True if the frame was captured, False if it was dropped
+        """
+        self._reclaim()
+        self._hand_off()
+
+        if not self.free:
+            if not self.block:
+                self.dropped += 1
+                return False
+
+            start = time.perf_counter()
+            while not self.free:
+                if self.pending:
+                    self._hand_off(wait=True)
+                self._reclaim(wait=not self.pending)
+            self.stall_s += time.perf_counter() - start
+
+        buffer = self.free.pop()
+        w, h = self.resolution
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        glReadPixels(0, 0, w, h, GL_RGBA, GL_UNSIGNED_BYTE, ct.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        self.pending.append((buffer, glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0), self.index))
+        self.index += 1
+        self.captured += 1
+        return True
+
+    def flush(self):
+        """
+            Wait until every captured frame has been written
+        """
+        while self.pending:
+            self._hand_off(wait=True)
+            self._reclaim()
+        while self.mapped:
+            self._reclaim(wait=True)
+
+    def close(self):
+        self.flush()
+        self.frames.put(None)
+        self.writer.join()
+        self.sink.close()
+        glDeleteBuffers(len(self.buffers), self.buffers)
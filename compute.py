@@ -0,0 +1,263 @@
+# Compute shader backend for the ray marcher
+#
+# A fragment shader marches every pixel on its own, in whatever order the
+# rasterizer hands them out. The compute backend runs the same template (with
+# COMPUTE defined) as a GL 4.3 compute shader writing an rgba8 image texture,
+# one work group per 8x8 pixel tile:
+#
+#       - Every invocation of the group cone marches its pixel (like the
+#         CONE_MARCH prepass does for a tile), atomicMin on the float bits in
+#         shared memory keeps the smallest depth, every ray of the tile starts
+#         at it. Tiles the cones show to miss write black without a step
+#       - With 'groups' set a fixed number of work groups stay resident and take
+#         tiles from an atomic counter (persistent threads) instead of one group
+#         per tile, so groups done with a cheap tile pick up the next one
+#
+# The image is blitted to the screen, or read by the following passes like the
+# texture of an offscreen pass.
+#
+# Usage:
+#       python raymarch_setup.py --define COMPUTE              (a work group per tile)
+#       python raymarch_setup.py --define COMPUTE=2            (persistent work groups)
+#       F1-F4 while running                                    (fragment, fragment+cone, compute, persistent)
+#       python compute.py                                      (fragment vs compute benchmark)
+#
+# Note: Needs a GL 4.3 context. Only the current variant is compiled at build,
+#       the others when first selected (on the spot, no async compile), the
+#       shader can't be hot reloaded. Software rasterizers
+#       get a work group per tile even with 'groups' set: llvmpipe runs the
+#       persistent groups one after the other and cuts their loop off after a
+#       fixed number of iterations, the tile taken just then would stay black.
+
+
+from __future__ import division
+import re
+import sys
+
+import numpy as np
+
+if __name__ == '__main__':
+    # The benchmark runs headless, the platform has to be picked before OpenGL is imported
+    import headless
+    headless.use_platform()
+    import fastgl
+
+from OpenGL.GL import (glGetIntegerv, glGenBuffers, glBindBuffer, glBufferData,
+                       GL_MAJOR_VERSION, GL_MINOR_VERSION, GL_COMPUTE_SHADER, GL_SHADER_STORAGE_BUFFER,
+                       GL_DYNAMIC_DRAW, GL_WRITE_ONLY, GL_RGBA8, GL_NEAREST, GL_FRAMEBUFFER_BARRIER_BIT,
+                       GL_TEXTURE_FETCH_BARRIER_BIT, GL_BUFFER_UPDATE_BARRIER_BIT)
+from OpenGL.GL import shaders
+
+from renderer import Pass, link_program
+from adaptive import software_renderer
+from uniforms import used
+from variants import specialize
+
+
+VERSION = re.compile(r'^[ \t]*#version[^\n]*\n', re.MULTILINE)
+
+# Work group size (the template's CONE_TILE unless it is defined)
+TILE = 8
+
+# Resident work groups in persistent mode
+GROUPS = 64
+
+def rewrite(source):
+    """
+        return -> 'source' with its #version raised to what compute shaders need
+    """
+    version = VERSION.search(source)
+    end = version.end() if version else 0
+    return "#version 430 core\n" + source[end:]
+
+
+def compile_compute(source, cache=None):
+    """
+        Compile and link a compute shader source
+
+        cache -> ProgramCache to load the program binary from (and store it to on a miss)
+
+        return -> shader program
+    """
+    if cache is not None:
+        key = cache.key([source])
+        program = cache.load(key)
+        if program is not None:
+            return program
+
+    program = link_program(shaders.compileShader(source, GL_COMPUTE_SHADER))
+
+    if cache is not None:
+        cache.store(key, program)
+
+    return program
+
+
+class ComputePass(Pass):
+    def __init__(self, source, variants, variant=None, defines=None, groups=None, format='rgba8', **options):
+        """
+            source -> GLSL template with a compute main() under #if COMPUTE (compiled as #version 430)
+            variants -> list of (name, defines) selectable while running (see VariantPass)
+            variant -> Name of the variant to start with (Default: the first)
+            defines -> Defines of every variant (overridden by the variant's own)
+            groups -> Resident work groups taking tiles from a queue (Default: a work group per tile)
+            format -> Image format, 'rgba8' (what the template's image2D is declared as)
+            options -> Pass options (offscreen, inputs)
+        """
+        Pass.__init__(self, None, None, format=format, **options)
+        self.source = source
+        self.variants = list(variants)
+        self.common = dict(defines or {})
+        self.common['COMPUTE'] = 2 if groups else 1
+        self.common['PERSISTENT'] = 1 if groups else 0
+        self.groups = groups
+        self.variant = variant or self.variants[0][0]
+        if self.variant not in self.names():
+            raise ValueError("Unknown variant '{}'".format(self.variant))
+        self.wanted = self.variant
+
+        self.programs = {}          # Variant name -> program, compiled when first selected
+        self.cache = None
+        self.queue = None           # Tile counter of the persistent mode
+        self.present = False        # Blit the image to the screen after the dispatch
+
+    def names(self):
+        return [name for name, defines in self.variants]
+
+    def defines(self, variant=None):
+        defines = dict(self.common)
+        defines.update(dict(self.variants)[variant or self.variant])
+        return defines
+
+    def prepare(self, source, stage='compute', variant=None):
+        return rewrite(Pass.prepare(self, specialize(source, self.defines(variant)), stage))
+
+    def block_uses(self):
+        return used(self.prepare(self.source))
+
+    def compile(self, renderer):
+        # The current variant, select() compiles the others
+        self.cache = renderer.program_cache
+        self.programs[self.variant] = compile_compute(self.prepare(self.source), self.cache)
+        self.set_program(self.programs[self.variant])
+
+    def build(self, renderer):
+        version = int(glGetIntegerv(GL_MAJOR_VERSION)), int(glGetIntegerv(GL_MINOR_VERSION))
+        if version < (4, 3):
+            raise RuntimeError("Compute shaders need GL 4.3, the context has {}.{}".format(*version))
+
+        if self.groups and software_renderer():
+            sys.stderr.write("Persistent work groups lose tiles on software rasterizers, "
+                             "using a work group per tile\n")
+            self.groups = None
+            self.common['COMPUTE'], self.common['PERSISTENT'] = 1, 0
+
+        # The renderer's defines (ACCELERATE etc.) apply here too, the backend stays
+        backend = self.common['COMPUTE'], self.common['PERSISTENT']
+        self.common.update(renderer.defines)
+        self.common['COMPUTE'], self.common['PERSISTENT'] = backend
+        self.tile = int(self.common.get('CONE_TILE', TILE))
+
+        self.block = renderer.uniforms
+        self.size = renderer.resolution
+        self.compile(renderer)
+
+        # The image always lives in a framebuffer texture, drawn to the screen with a blit
+        self.present = not self.offscreen
+        self.frame, self.texture = renderer.genFrameBuffer(self.format)
+
+        if self.groups:
+            self.queue = int(glGenBuffers(1))
+            self.zero = np.zeros(1, dtype=np.uint32)
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.queue)
+            glBufferData(GL_SHADER_STORAGE_BUFFER, self.zero.nbytes, self.zero, GL_DYNAMIC_DRAW)
+
+    def resize(self, renderer):
+        # The image has its own texture even when it goes to the screen
+        self.size = renderer.resolution
+        self.frame, self.texture = renderer.targets.resize((self.frame, self.texture), self.size)
+
+    def select(self, variant):
+        """
+            Switch to 'variant' with the next frame, compiling it the first time (before build() the
+            variant to start with)
+        """
+        if variant not in self.names():
+            raise ValueError("Unknown variant '{}'".format(variant))
+        if self.frame is None:
+            self.variant = self.wanted = variant
+            return
+        if variant not in self.programs:
+            try:
+                self.programs[variant] = compile_compute(self.prepare(self.source, variant=variant), self.cache)
+            except RuntimeError as error:
+                # The current one keeps drawing
+                sys.stderr.write("Variant '{}': {}\n".format(variant, error.args[0] if error.args else error))
+                return
+        self.wanted = variant
+
+    def reload(self, stage, source):
+        raise RuntimeError("Compute passes can't be hot reloaded")
+
+    def draw(self, renderer, mouse, ticks):
+        state = renderer.state
+        if self.wanted != self.variant:
+            self.variant = self.wanted
+            self.set_program(self.programs[self.variant])
+            state.invalidate()
+
+        self.bind(renderer, mouse, ticks)
+        state.bind_image_texture(0, self.texture, GL_WRITE_ONLY, GL_RGBA8)
+
+        w, h = self.size
+        tiles = -(-w // self.tile), -(-h // self.tile)
+        if self.groups:
+            # Rewind the tile counter, the groups stop once it runs past the last tile
+            state.buffer_sub_data(GL_SHADER_STORAGE_BUFFER, self.queue, 0, self.zero)
+            state.bind_buffer_range(GL_SHADER_STORAGE_BUFFER, 0, self.queue, 0, self.zero.nbytes)
+            state.dispatch_compute(min(self.groups, tiles[0] * tiles[1]), 1)
+        else:
+            state.dispatch_compute(tiles[0], tiles[1])
+
+        # Image stores are incoherent: make them visible to the blit and texture
+        # reads, and the counter to the next rewind
+        state.memory_barrier(GL_FRAMEBUFFER_BARRIER_BIT | GL_TEXTURE_FETCH_BARRIER_BIT |
+                             GL_BUFFER_UPDATE_BARRIER_BIT)
+
+        if self.present:
+            state.blit(self.frame, renderer.screen, (0, 0, w, h), (0, 0, w, h), GL_NEAREST)
+
+
+def main(argv=None):
+    import argparse
+    import bench
+    from raymarch_setup import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Fragment vs compute shader backend of the ray marcher")
+    parser.add_argument('setups', nargs='*', default=['raymarch_setup', 'raymarch_setup_mod'])
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--resolution', type=int, nargs=2, default=[800, 600], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--define', action='append', default=[], metavar='NAME[=VALUE]',
+                        help="Extra defines for every backend, e.g. ACCELERATE")
+    args = parser.parse_args(argv)
+
+    defines = {}
+    for define in args.define:
+        name, _, value = define.partition('=')
+        defines[name] = value or 1
+
+    print("{:<20} {:<14} {:>8} {:>9} {:>9} {:>8}".format('setup', 'backend', 'fps', 'ms p50', 'gpu ms', 'speedup'))
+    for name in args.setups:
+        baseline = None
+        for backend, backend_defines in BACKENDS:
+            r = bench.bench_setup(name, args.frames, args.warmup, bench.TIMES, [400.0, 300.0],
+                                  resolution=tuple(args.resolution), defines=dict(defines, **backend_defines))
+            baseline = baseline or r['ms']['p50']
+            print("{:<20} {:<14} {:>8.1f} {:>9.2f} {:>9.2f} {:>7.2f}x".format(
+                  name, backend, r['fps'], r['ms']['p50'], r['gpu_ms']['mean'], baseline / r['ms']['p50']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# NumPy reference renderer for the raymarch scenes (no GL needed)
+#
+# Same algorithm as raymarch_setup.FRAGMENT_SHADER / raymarch_setup_mod.FRAGMENT_SHADER
+# but every pixel ray is marched at once as arrays. Rays that hit something or
+# went past the maximum distance are dropped from the working set each step
+# instead of looping per pixel.
+#
+# Images come out in the same layout as HeadlessContext.read_pixels() (RGBA,
+# bottom row first) so they can be compared against the GL output directly.
+# Each render also fills in a profile of the marching (timings, live rays per
+# step, SDF evaluations).
+#
+# Usage:
+#       python cpu_reference.py raymarch_setup_mod --time 1.0 --profile
+#       python cpu_reference.py raymarch_setup --compare     (against the headless GL render)
+#       python cpu_reference.py scene_setup                  (sdf.py scenes, same compiled graph as the GLSL)
+
+
+from __future__ import division
+import argparse
+import time
+
+import numpy as np
+
+
+# Constants from ray_march() in the shaders
+NUMBER_OF_STEPS = 128
+MINIMUM_HIT_DISTANCE = 0.001
+MAXIMUM_TRACE_DISTANCE = 512.0
+
+CAMERA_POSITION = (0.0, 0.0, -5.0)
+
+# Differences between the setups
+SCENES = {'raymarch_setup':     {'displacement': False, 'ambient': 0.0},
+          'raymarch_setup_mod': {'displacement': True,  'ambient': 0.2},
+          'scene_setup':        {'scene': 'scene_setup', 'ambient': 0.2}}
+
+
+def sd_sphere(p, r):
+    return np.sqrt(np.einsum('ij,ij->i', p, p)) - r
+
+
+def map_the_world(pos, ticks=0.0, displacement=False):
+    """
+        Distance to the scene for positions 'pos' (N, 3)
+    """
+    sphere_0 = sd_sphere(pos, 2.5)
+    if displacement:
+        t = np.float32(ticks)
+        frequency = np.array([abs(4.0 * np.cos(t)), abs(4.0 * np.sin(t)), 4.0], dtype=np.float32)
+        amplitude = 0.1 + abs(0.1 * np.sin(t * 2.0))
+        sphere_0 += (np.sin(frequency[0] * pos[:, 0]) *
+                     np.sin(frequency[1] * pos[:, 1]) *
+                     np.sin(frequency[2] * pos[:, 2]) * amplitude)
+        # Divided by the Lipschitz bound like the template does
+        sphere_0 /= 1.0 + amplitude * np.sqrt(np.dot(frequency, frequency))
+    return sphere_0
+
+
+def calculate_normal(pos, ticks=0.0, displacement=False):
+    """
+        Normalized central difference gradient of the scene at 'pos' (N, 3)
+    """
+    normal = np.empty_like(pos)
+    for axis in range(3):
+        small_step = np.zeros(3, dtype=pos.dtype)
+        small_step[axis] = 0.001
+        normal[:, axis] = (map_the_world(pos + small_step, ticks, displacement) -
+                           map_the_world(pos - small_step, ticks, displacement))
+    return normal / np.sqrt(np.einsum('ij,ij->i', normal, normal))[:, None]
+
+
+class MarchProfile(object):
+    def __init__(self):
+        self.march_s = 0.0
+        self.normal_s = 0.0
+        self.shade_s = 0.0
+        self.evaluations = 0        # map_the_world() evaluations per ray, summed
+        self.active = []            # Rays still marching at each step
+
+    def report(self):
+        rays = self.active[0] if self.active else 0
+        lines = ["march {:8.2f} ms   normal {:8.2f} ms   shade {:8.2f} ms".format(
+                 self.march_s * 1000.0, self.normal_s * 1000.0, self.shade_s * 1000.0),
+                 "rays {}   steps {}   sdf evaluations {} ({:.1f} per ray)".format(
+                 rays, len(self.active), self.evaluations, self.evaluations / max(rays, 1))]
+
+        # Live ray count at a few points of the march (how fast rays finish)
+        for step in (1, 2, 4, 8, 16, 32, 64, 127):
+            if step < len(self.active):
+                lines.append("  step {:3d}: {:7d} rays live".format(step, self.active[step]))
+        return "\n".join(lines)
+
+
+def ray_march(ro, rd, mouse, ticks=0.0, displacement=False, ambient=0.0, profile=None, scene=None):
+    """
+        March rays 'ro' + t * 'rd' (N, 3) and shade the hits
+
+        mouse -> light position input (-1..1 range like the shaders get it)
+        scene -> sdf.CompiledScene to march instead of the sphere
+
+        return -> colors (N, 3)
+    """
+    profile = profile if profile is not None else MarchProfile()
+    n = len(rd)
+    color = np.zeros((n, 3), dtype=np.float32)
+    total_distance_traveled = np.zeros(n, dtype=np.float32)
+
+    hit = np.zeros(n, dtype=bool)
+    active = np.arange(n)
+
+    start = time.perf_counter()
+    for i in range(NUMBER_OF_STEPS):
+        if not len(active):
+            break
+        profile.active.append(len(active))
+
+        current_position = ro[active] + total_distance_traveled[active, None] * rd[active]
+        if scene is not None:
+            distance_to_closest = scene.distance(current_position, ticks)
+        else:
+            distance_to_closest = map_the_world(current_position, ticks, displacement)
+        profile.evaluations += len(active)
+
+        hits = distance_to_closest < MINIMUM_HIT_DISTANCE
+        hit[active[hits]] = True
+
+        # Missed rays stop once they are far enough (hits take priority like in the shader)
+        done = hits | (total_distance_traveled[active] > MAXIMUM_TRACE_DISTANCE)
+        total_distance_traveled[active[~done]] += distance_to_closest[~done]
+        active = active[~done]
+    profile.march_s += time.perf_counter() - start
+
+    hit = np.flatnonzero(hit)
+    if not len(hit):
+        return color
+
+    current_position = ro[hit] + total_distance_traveled[hit, None] * rd[hit]
+
+    start = time.perf_counter()
+    if scene is not None:
+        normal = scene.normal(current_position, ticks)
+        profile.evaluations += 4 * len(hit)
+    else:
+        normal = calculate_normal(current_position, ticks, displacement)
+        profile.evaluations += 6 * len(hit)
+    profile.normal_s += time.perf_counter() - start
+
+    start = time.perf_counter()
+    light_position = np.array([-mouse[0], mouse[1], 4.0], dtype=np.float32)
+    direction_to_light = current_position - light_position
+    direction_to_light /= np.sqrt(np.einsum('ij,ij->i', direction_to_light, direction_to_light))[:, None]
+
+    # pow() of a negative base is undefined in GLSL, GPUs return NaN which max() drops
+    lambert = np.einsum('ij,ij->i', normal, direction_to_light)
+    diffuse_intensity = np.where(lambert < 0.0, ambient, np.maximum(ambient, lambert ** 16))
+    color[hit, 0] = diffuse_intensity
+    profile.shade_s += time.perf_counter() - start
+
+    return color
+
+
+def primary_rays(resolution):
+    """
+        Camera rays through every pixel center, bottom row first (like gl_FragCoord)
+
+        return -> ray origins, ray directions (N, 3)
+    """
+    w, h = resolution
+    x = (np.arange(w, dtype=np.float32) + 0.5) / w * 2.0 - 1.0
+    y = (np.arange(h, dtype=np.float32) + 0.5) / h * 2.0 - 1.0
+    x *= w / h
+
+    uv_x, uv_y = np.meshgrid(x, y)
+    rd = np.stack([uv_x.ravel(), uv_y.ravel(), np.ones(w * h, dtype=np.float32)], axis=1)
+    ro = np.broadcast_to(np.array(CAMERA_POSITION, dtype=np.float32), rd.shape)
+    return ro, rd
+
+
+class CpuRenderer(object):
+    def __init__(self, resolution=(800, 600), displacement=False, ambient=0.0, scene=None):
+        """
+            Drop-in for the GL setups when there is no GL at all
+            (Use SCENES[name] for the settings of a setup)
+
+            scene -> sdf scene, or the name of a module with a SCENE (compiled like its GL setup does)
+        """
+        if isinstance(scene, str):
+            import importlib
+            scene = importlib.import_module(scene).SCENE
+        if scene is not None:
+            from sdf import compile_scene
+            scene = compile_scene(scene)
+
+        self.resolution = resolution
+        self.displacement = displacement
+        self.scene = scene
+        self.ambient = ambient
+        self.ro, self.rd = primary_rays(resolution)
+        self.profile = None
+
+    def map_mouse(self, mouse):
+        # Map mouse coordinates between -1 and 1 range
+        mx, my = mouse
+        mx = (1.0 / self.resolution[0] * mx) * 2.0 - 1.0
+        my = (1.0 / self.resolution[1] * my) * 2.0 - 1.0
+        return mx, my
+
+    def render(self, mouse, ticks, rows=None):
+        """
+            Render a frame
+
+            mouse -> mouse position in pixels
+            ticks -> time in seconds
+            rows -> (first, last) row range to render only part of the frame
+
+            return -> uint8 RGBA image (height, width, 4), bottom row first
+        """
+        w, h = self.resolution
+        first, last = rows or (0, h)
+        ro, rd = self.ro[first * w:last * w], self.rd[first * w:last * w]
+
+        self.profile = MarchProfile()
+        color = ray_march(ro, rd, self.map_mouse(mouse), ticks, self.displacement, self.ambient, self.profile,
+                          self.scene)
+
+        image = np.empty((last - first, w, 4), dtype=np.uint8)
+        image[..., :3] = (np.clip(color, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8).reshape(last - first, w, 3)
+        image[..., 3] = 255
+        return image
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NumPy reference renderer for the raymarch scenes")
+    parser.add_argument('scene', choices=sorted(SCENES))
+    parser.add_argument('--time', type=float, default=1.0, help="iTime")
+    parser.add_argument('--mouse', type=lambda s: [float(m) for m in s.split(',')], default=[400.0, 300.0],
+                        help="Mouse position in pixels (x,y)")
+    parser.add_argument('--resolution', type=lambda s: tuple(int(v) for v in s.split('x')), default=(800, 600))
+    parser.add_argument('--profile', action='store_true', help="Print the marching profile")
+    parser.add_argument('--compare', action='store_true', help="Compare against the headless GL render")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        # Before OpenGL is imported (sdf scenes come from the setup module)
+        import headless
+        headless.use_platform()
+
+    renderer = CpuRenderer(args.resolution, **SCENES[args.scene])
+    start = time.perf_counter()
+    image = renderer.render(args.mouse, args.time)
+    print("{} {}x{}: {:.1f} ms".format(args.scene, args.resolution[0], args.resolution[1],
+                                       (time.perf_counter() - start) * 1000.0))
+    if args.profile:
+        print(renderer.profile.report())
+
+    if args.compare:
+        import importlib
+
+        main = importlib.import_module(args.scene).Main(headless=True, resolution=args.resolution)
+        main.render(args.mouse, args.time)
+        reference = main.context.read_pixels()
+        difference = np.abs(reference.astype(np.int16) - image)
+        print("max difference {}   pixels off by more than 2: {:.3f}%".format(
+              difference.max(), (difference.max(axis=2) > 2).mean() * 100.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# PyOpenGL call overhead modes
+#
+# By default PyOpenGL checks glGetError after every call, converts and size
+# checks array arguments and goes through a wrapper object per function. That
+# costs a few µs per call, which adds up to a good part of the Python side of a
+# frame for the short per frame calls (glUseProgram, glUniform*, glDrawArrays).
+#
+# Modes (selected with the GLSL_PYTHON_GL environment variable):
+#       fast    -> No error checking/logging/array size checks, the per frame
+#                  calls go straight to the ctypes function pointers
+#       debug   -> Error checking with every failing call logged (and array size checks)
+#       default -> Whatever PyOpenGL does on its own (Default)
+#
+# Importing this module only changes PyOpenGL's global flags when the variable
+# asks for it. The entry points (run(), bench.py) call prefer('fast') instead,
+# which only sends the per frame calls through the function pointers: setup
+# calls keep PyOpenGL's checks, and a GL error left by a per frame call raises
+# at the next checked call.
+#
+# Usage:
+#       GLSL_PYTHON_GL=debug python raymarch_setup.py
+#       GLSL_PYTHON_GL=fast python raymarch_setup.py    (no checks at all)
+#       python fastgl.py                                (µs per frame of each mode)
+#
+# Note: Like the platform, the flags are read when OpenGL is imported for the
+#       first time, so this has to be imported before any "from OpenGL.GL import *"
+#       (renderer.py does). Errors of GL calls only raise in debug/default mode.
+
+
+from __future__ import division
+import os
+import sys
+import warnings
+
+
+MODES = ['fast', 'debug', 'default']
+ENVIRONMENT = 'GLSL_PYTHON_GL'
+
+FLAGS = {'fast': {'ERROR_CHECKING': False, 'ERROR_LOGGING': False, 'ARRAY_SIZE_CHECKING': False,
+                  'CONTEXT_CHECKING': False},
+         'debug': {'ERROR_CHECKING': True, 'ERROR_LOGGING': True, 'ARRAY_SIZE_CHECKING': True},
+         'default': {}}
+
+# Calls issued every frame (through GLState) and the core version they come from
+HOT_CALLS = [('GL_1_0', ['glClearColor', 'glClear', 'glViewport']),
+             ('GL_1_1', ['glBindTexture', 'glDrawArrays']),
+             ('GL_1_3', ['glActiveTexture']),
+             ('GL_1_5', ['glBindBuffer', 'glBufferSubData']),
+             ('GL_2_0', ['glUseProgram', 'glUniform1f', 'glUniform2f']),
+             ('GL_3_0', ['glBindVertexArray', 'glBindFramebuffer', 'glBlitFramebuffer', 'glBindBufferRange']),
+             ('GL_3_1', ['glDrawArraysInstanced']),
+             ('GL_4_1', ['glViewportArrayv']),
+             ('GL_4_2', ['glBindImageTexture', 'glMemoryBarrier']),
+             ('GL_4_3', ['glDispatchCompute'])]
+
+MODE = None
+
+
+class HotCalls(object):
+    """
+        The per frame GL functions, hot.glDrawArrays(...) etc.
+    """
+    def __init__(self):
+        self.resolved = False
+
+
+hot = HotCalls()
+
+
+def configure(mode=None):
+    """
+        Set PyOpenGL's flags for 'mode' (Default: $GLSL_PYTHON_GL or 'default') and fill in 'hot'
+    """
+    global MODE
+    mode = mode or os.environ.get(ENVIRONMENT) or 'default'
+    if mode not in MODES:
+        raise ValueError("Unknown GL mode '{}' (one of {})".format(mode, ', '.join(MODES)))
+    if 'OpenGL.GL' in sys.modules and mode != 'default':
+        warnings.warn("OpenGL.GL was imported before fastgl, the '{}' mode only partially applies".format(mode))
+
+    import OpenGL
+    from OpenGL import platform
+    if mode == 'fast' and type(platform.PLATFORM).__name__ == 'EGLPlatform':
+        # PyOpenGL 3.1.10's EGL error module fails to import with ERROR_CHECKING off, load it first
+        import OpenGL.raw.EGL._errors
+    import OpenGL._configflags as configflags
+    for name, value in FLAGS[mode].items():
+        setattr(OpenGL, name, value)
+        setattr(configflags, name, value)
+    MODE = mode
+    _fill_hot(mode)
+
+
+def _fill_hot(mode):
+    hot.resolved = False
+    if mode == 'fast':
+        # The raw functions take the plain C arguments, no wrapper in between
+        import importlib
+        for version, names in HOT_CALLS:
+            module = importlib.import_module('OpenGL.raw.GL.VERSION.' + version)
+            for name in names:
+                setattr(hot, name, getattr(module, name))
+    else:
+        import OpenGL.GL
+        for version, names in HOT_CALLS:
+            for name in names:
+                setattr(hot, name, getattr(OpenGL.GL, name))
+
+
+def prefer(mode):
+    """
+        Send the per frame calls through 'mode' unless $GLSL_PYTHON_GL picked one already
+
+        PyOpenGL's global flags stay as they are. Call before the Renderer is created
+        (it resolves the function pointers).
+    """
+    global MODE
+    if mode not in MODES:
+        raise ValueError("Unknown GL mode '{}' (one of {})".format(mode, ', '.join(MODES)))
+    if os.environ.get(ENVIRONMENT) or mode == MODE:
+        return
+    _fill_hot(mode)
+    MODE = mode
+
+
+def resolve():
+    """
+        Replace the hot calls by their ctypes function pointers (fast mode, needs a current context)
+    """
+    if MODE != 'fast' or hot.resolved:
+        return
+    for version, names in HOT_CALLS:
+        for name in names:
+            function = getattr(hot, name).load()
+            if function is not None:
+                setattr(hot, name, function)
+    hot.resolved = True
+
+
+# Run as a script it only starts the benchmark processes, which import it again
+if __name__ != '__main__':
+    configure()
+
+
+def benchmark(setups, frames, resolution, lean):
+    """
+        Time the Python side of render() (tiny resolution, so the GPU part hardly counts)
+
+        return -> list of (setup, median µs per frame, GL calls per frame)
+    """
+    import time
+    import importlib
+
+    results = []
+    for name in setups:
+        main = importlib.import_module(name).Main(headless=True, resolution=resolution)
+        from OpenGL.GL import glFinish
+        main.state.cache = lean
+        for i in range(10):
+            main.render((8.0, 8.0), i * 0.1)
+        glFinish()
+
+        times, calls = [], 0
+        for i in range(frames):
+            start = time.perf_counter()
+            main.render((8.0, 8.0), i * 0.1)
+            times.append(time.perf_counter() - start)
+            calls += main.state.calls
+            glFinish()
+        # Median, a single core machine has the odd slow frame
+        results.append((name, sorted(times)[frames // 2] * 1e6, calls / frames))
+        main.context.destroy()
+    return results
+
+
+def main(argv=None):
+    import argparse
+    import json
+    import subprocess
+
+    parser = argparse.ArgumentParser(description="Python side cost per frame of each GL mode")
+    parser.add_argument('setups', nargs='*', default=['minimal_setup', 'raymarch_setup', 'multipass_setup'])
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--resolution', type=int, default=16, help="Width and height of the frames")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--lean', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        import headless
+        headless.use_platform()
+        print(json.dumps(benchmark(args.setups, args.frames, (args.resolution,) * 2, args.lean)))
+        return 0
+
+    # Each mode in a fresh process, the flags only apply to the first import of OpenGL
+    rows = {}
+    for mode in MODES:
+        for lean in (False, True):
+            environment = dict(os.environ, **{ENVIRONMENT: mode, 'PYGAME_HIDE_SUPPORT_PROMPT': '1'})
+            command = [sys.executable, os.path.abspath(__file__), '--child', '--frames', str(args.frames),
+                       '--resolution', str(args.resolution)] + (['--lean'] if lean else []) + args.setups
+            output = subprocess.check_output(command, env=environment, cwd=os.path.dirname(os.path.abspath(__file__)))
+            for name, us, calls in json.loads(output.decode().splitlines()[-1]):
+                rows[name, lean, mode] = us, calls
+
+    print("{:<20} {:<6} {:>7} {:>12} {:>12} {:>12} {:>8}".format(
+          'setup', 'loop', 'calls', 'default µs', 'debug µs', 'fast µs', 'speedup'))
+    for name in args.setups:
+        for lean in (False, True):
+            us = dict((mode, rows[name, lean, mode][0]) for mode in MODES)
+            print("{:<20} {:<6} {:>7.1f} {:>12.1f} {:>12.1f} {:>12.1f} {:>7.2f}x".format(
+                  name, 'lean' if lean else 'full', rows[name, lean, 'fast'][1],
+                  us['default'], us['debug'], us['fast'], us['default'] / us['fast']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
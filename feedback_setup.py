@@ -0,0 +1,77 @@
+# Feedback setup (ShaderToy style "Buffer A" reading its own previous frame)
+#
+# The first pass paints a glowing splat at the mouse position on top of its
+# previous frame, which slowly spreads out and fades. It runs on a pair of
+# half float framebuffers swapped every frame, so the values can go over 1.0
+# and the fade doesn't get stuck on 8 bit rounding. The second pass tone maps
+# it to the screen.
+
+
+from __future__ import division
+from renderer import Renderer, Pass, run
+
+
+VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec3 vPos;
+layout(location = 1) in vec2 texCoords;
+
+out vec2 texcoords;
+
+void main()
+{
+    gl_Position = vec4(vPos, 1.0);
+    texcoords = texCoords;
+}
+"""
+
+# iChannel0 is the previous frame of this same pass
+FRAGMENT_SHADER_BUFFER = """
+#version 330 core
+#define fragCoord gl_FragCoord.xy
+uniform vec2  iMouse;
+uniform float iTime;
+uniform vec2  iResolution;
+uniform sampler2D iChannel0;
+in vec2 texcoords;
+out vec4 fragColor;
+void main()
+{
+    // Spread a little (average of the neighbours) and fade
+    vec2 texel = 1.0 / iResolution.xy;
+    vec3 previous = 0.25 * (texture(iChannel0, texcoords + vec2(texel.x, 0.0)).rgb +
+                            texture(iChannel0, texcoords - vec2(texel.x, 0.0)).rgb +
+                            texture(iChannel0, texcoords + vec2(0.0, texel.y)).rgb +
+                            texture(iChannel0, texcoords - vec2(0.0, texel.y)).rgb);
+
+    // Splat at the mouse (pygame has y going down)
+    vec2 mouse = vec2(iMouse.x, iResolution.y - iMouse.y);
+    float splat = exp(-dot(fragCoord - mouse, fragCoord - mouse) / 200.0);
+    vec3 color = 0.5 + 0.5 * cos(iTime + vec3(0.0, 2.0, 4.0));
+
+    fragColor = vec4(previous * 0.985 + splat * color, 1.0);
+}
+"""
+
+FRAGMENT_SHADER_SCREEN = """
+#version 330 core
+uniform sampler2D iChannel0;
+in vec2 texcoords;
+out vec4 fragColor;
+void main()
+{
+    vec3 color = texture(iChannel0, texcoords).rgb;
+    fragColor = vec4(1.0 - exp(-2.0 * color), 1.0);
+}
+"""
+
+
+class Main(Renderer):
+    def __init__(self, **options):
+        buffer = Pass(VERTEX_SHADER, FRAGMENT_SHADER_BUFFER, format='rgba16f', feedback=True)
+        screen = Pass(VERTEX_SHADER, FRAGMENT_SHADER_SCREEN, inputs=[buffer])
+        Renderer.__init__(self, [buffer, screen], **options)
+
+
+if __name__ == '__main__':
+    run(Main)
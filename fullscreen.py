@@ -0,0 +1,103 @@
+# Attribute-less fullscreen geometry
+#
+# Instead of a GL_QUADS quad from a vertex buffer (not available in core
+# profiles, and split into two triangles whose shared diagonal gets shaded
+# twice in 2x2 pixel blocks) the vertex shader makes up one triangle covering
+# the whole screen from gl_VertexID. No vertex buffer, just an empty vao.
+#
+# Tiles (several small copies of the pass side by side) are drawn in one
+# instanced call: every instance is a quad (4 vertex triangle strip) placed in
+# its tile by gl_InstanceID, with texcoords 0..1 inside the tile.
+#
+# Viewports (multiview.py): instance i goes to viewport i of the viewport array
+# through gl_ViewportIndex, with tiles the instances of a viewport are its tiles.
+#
+# The setups' vertex shaders don't need to change, their vertex attributes
+# ('layout(location = 0) in vec3 vPos;', location 1 the texture coordinates)
+# are replaced by macros computing the same values.
+#
+# Usage:
+#       Renderer(passes, geometry='triangle')      (Default, 'quad' for the old path)
+#       Pass(VS, FS, tiles=(4, 4))                 (4x4 copies in one draw call)
+#       rewrite(VS, viewports=True)                (instance i draws into viewport i)
+
+
+from __future__ import division
+import re
+
+
+GEOMETRIES = ['triangle', 'quad']
+
+ATTRIBUTE = re.compile(r'^[ \t]*layout\s*\(\s*location\s*=\s*(\d+)\s*\)\s*in\s+(\w+)\s+(\w+)\s*;[ \t]*$',
+                       re.MULTILINE)
+VERSION = re.compile(r'^[ \t]*#version[^\n]*\n', re.MULTILINE)
+
+# Clip space xy and texture coordinates of the vertex (-1..1 and 0..1 on screen)
+FUNCTIONS = """
+const vec2 FULLSCREEN_TRIANGLE[3] = vec2[3](vec2(-1.0, -1.0), vec2(3.0, -1.0), vec2(-1.0, 3.0));
+const vec2 FULLSCREEN_CORNERS[4] = vec2[4](vec2(0.0, 0.0), vec2(1.0, 0.0), vec2(0.0, 1.0), vec2(1.0, 1.0));
+const ivec2 FULLSCREEN_TILES = ivec2({columns}, {rows});
+vec2 fullscreenCoords()
+{{
+    if (FULLSCREEN_TILES == ivec2(1, 1))
+        return 0.5 * FULLSCREEN_TRIANGLE[gl_VertexID] + 0.5;
+    return FULLSCREEN_CORNERS[gl_VertexID];
+}}
+vec2 fullscreenPosition()
+{{
+{viewport}    if (FULLSCREEN_TILES == ivec2(1, 1))
+        return FULLSCREEN_TRIANGLE[gl_VertexID];
+    int index = gl_InstanceID % (FULLSCREEN_TILES.x * FULLSCREEN_TILES.y);
+    vec2 tile = vec2(index % FULLSCREEN_TILES.x, index / FULLSCREEN_TILES.x);
+    return (tile + FULLSCREEN_CORNERS[gl_VertexID]) / vec2(FULLSCREEN_TILES) * 2.0 - 1.0;
+}}
+"""
+
+# Written by the vertex shader with viewports (needs GL_ARB_shader_viewport_layer_array)
+VIEWPORT = """    gl_ViewportIndex = gl_InstanceID / (FULLSCREEN_TILES.x * FULLSCREEN_TILES.y);
+"""
+VIEWPORT_EXTENSION = "#extension GL_ARB_shader_viewport_layer_array : require\n"
+
+# Attribute type -> value built from the vec2 'xy'
+CONSTRUCTORS = {'vec2': '{}', 'vec3': 'vec3({}, 0.0)', 'vec4': 'vec4({}, 0.0, 1.0)'}
+
+
+def rewrite(source, tiles=(1, 1), viewports=False):
+    """
+        Replace the position (location 0) and texture coordinate (location 1) attributes of the
+        vertex shader 'source' with values computed from gl_VertexID/gl_InstanceID
+
+        tiles -> Columns, rows of instances the screen is split into
+        viewports -> Draw instance i into viewport i (i / tile count with tiles)
+
+        return -> new source (Raises ValueError for other attributes, they'd need a vertex buffer)
+    """
+    values = {0: 'fullscreenPosition()', 1: 'fullscreenCoords()'}
+
+    def replace(match):
+        location, kind, name = int(match.group(1)), match.group(2), match.group(3)
+        if location not in values or kind not in CONSTRUCTORS:
+            raise ValueError("Vertex attribute '{}' at location {} can't be made up "
+                             "without a vertex buffer".format(name, location))
+        return "#define {} {}".format(name, CONSTRUCTORS[kind].format(values[location]))
+
+    source = ATTRIBUTE.sub(replace, source)
+
+    version = VERSION.search(source)
+    end = version.end() if version else 0
+    functions = FUNCTIONS.format(columns=tiles[0], rows=tiles[1], viewport=VIEWPORT if viewports else '')
+    return source[:end] + (VIEWPORT_EXTENSION if viewports else '') + functions + source[end:]
+
+
+def vertices(geometry, tiles=(1, 1)):
+    """
+        return -> primitive, vertex count and instance count of one draw
+    """
+    from OpenGL.GL import GL_QUADS, GL_TRIANGLES, GL_TRIANGLE_STRIP
+
+    columns, rows = tiles
+    if columns * rows > 1:
+        return GL_TRIANGLE_STRIP, 4, columns * rows
+    if geometry == 'quad':
+        return GL_QUADS, 4, 1
+    return GL_TRIANGLES, 3, 1
@@ -0,0 +1,206 @@
+# Tracks the GL state touched every frame by the setups
+#
+# Every call goes through GLState so they can be counted. With caching enabled
+# (lean mode) calls that wouldn't change anything are skipped: the program,
+# vao, framebuffer and textures usually stay the same from frame to frame and
+# the fullscreen quads overwrite every pixel so the clear is not needed either.
+#
+# The calls themselves go through fastgl.hot (raw function pointers in fast mode).
+
+
+from __future__ import division
+import time
+
+from fastgl import hot
+from OpenGL.GL import (GL_FRAMEBUFFER, GL_READ_FRAMEBUFFER, GL_DRAW_FRAMEBUFFER, GL_TEXTURE_2D, GL_TEXTURE0,
+                       GL_COLOR_BUFFER_BIT, GL_FALSE)
+
+
+class GLState(object):
+    def __init__(self, cache=False):
+        """
+            cache -> Skip calls which don't change the state (lean mode)
+        """
+        self.cache = cache
+
+        # Calls issued/skipped since begin_frame()
+        self.calls = 0
+        self.skipped = 0
+
+        self.invalidate()
+
+    def invalidate(self):
+        """
+            Forget the cached state (Call after touching GL state outside of this class)
+        """
+        self.program = None
+        self.vao = None
+        self.framebuffer = None
+        self.viewport_rect = None
+        self.viewport_rects = None
+        self.active_texture = None
+        self.textures = {}
+        self.color = None
+        self.uniforms = {}
+        self.ranges = {}
+        self.buffers = {}
+        self.images = {}
+
+    def begin_frame(self):
+        self.calls = self.skipped = 0
+
+    def _changed(self, current, new):
+        if self.cache and current == new:
+            self.skipped += 1
+            return False
+        self.calls += 1
+        return True
+
+    def use_program(self, program):
+        if self._changed(self.program, program):
+            hot.glUseProgram(program)
+            self.program = program
+
+    def bind_vertex_array(self, vao):
+        if self._changed(self.vao, vao):
+            hot.glBindVertexArray(vao)
+            self.vao = vao
+
+    def bind_framebuffer(self, frame):
+        if self._changed(self.framebuffer, frame):
+            hot.glBindFramebuffer(GL_FRAMEBUFFER, frame)
+            self.framebuffer = frame
+
+    def viewport(self, x, y, w, h):
+        # Only issued on change, it stays the same unless the render size changes
+        if self.viewport_rect != (x, y, w, h):
+            self.calls += 1
+            hot.glViewport(x, y, w, h)
+            self.viewport_rect = x, y, w, h
+            self.viewport_rects = None
+
+    def viewport_array(self, rects):
+        """
+            Set viewports 0..n-1 to the rows (x, y, w, h) of the float32 array 'rects'
+        """
+        key = rects.tobytes()
+        if self.viewport_rects != key:
+            self.calls += 1
+            hot.glViewportArrayv(0, len(rects), rects)
+            # Viewport 0 is one of them, glViewport sets all of them
+            self.viewport_rects = key
+            self.viewport_rect = None
+
+    def blit(self, read, draw, src, dst, filter):
+        """
+            Copy color from framebuffer 'read' rectangle 'src' to 'draw' rectangle 'dst' (x0, y0, x1, y1)
+        """
+        self.calls += 3
+        hot.glBindFramebuffer(GL_READ_FRAMEBUFFER, read)
+        hot.glBindFramebuffer(GL_DRAW_FRAMEBUFFER, draw)
+        hot.glBlitFramebuffer(*(tuple(src) + tuple(dst) + (GL_COLOR_BUFFER_BIT, filter)))
+
+        # Read and draw bindings differ now, next bind_framebuffer has to go through
+        self.framebuffer = None
+
+    def bind_read_framebuffer(self, frame):
+        """
+            Bind 'frame' for reading only (glReadPixels), drawing stays where it is
+        """
+        self.calls += 1
+        hot.glBindFramebuffer(GL_READ_FRAMEBUFFER, frame)
+
+        # Read and draw bindings differ now, next bind_framebuffer has to go through
+        self.framebuffer = None
+
+    def bind_texture(self, texture, unit=0):
+        # Only switch units when needed, the setups stay on unit 0
+        if self.active_texture != unit:
+            self.calls += 1
+            hot.glActiveTexture(GL_TEXTURE0 + unit)
+            self.active_texture = unit
+
+        if self._changed(self.textures.get(unit), texture):
+            hot.glBindTexture(GL_TEXTURE_2D, texture)
+            self.textures[unit] = texture
+
+    def clear_color(self, r, g, b, a):
+        if self._changed(self.color, (r, g, b, a)):
+            hot.glClearColor(r, g, b, a)
+            self.color = r, g, b, a
+
+    def clear(self, mask):
+        # Every pass draws a fullscreen quad which overwrites the whole target
+        if self.cache:
+            self.skipped += 1
+            return
+        self.calls += 1
+        hot.glClear(mask)
+
+    def uniform1f(self, location, x):
+        key = self.program, location
+        if self._changed(self.uniforms.get(key), x):
+            hot.glUniform1f(location, x)
+            self.uniforms[key] = x
+
+    def uniform2f(self, location, x, y):
+        key = self.program, location
+        if self._changed(self.uniforms.get(key), (x, y)):
+            hot.glUniform2f(location, x, y)
+            self.uniforms[key] = x, y
+
+    def bind_buffer_range(self, target, index, buffer, offset, size):
+        # Only issued on change like the viewport, nothing else touches the uniform buffer bindings
+        key = target, index
+        if self.ranges.get(key) != (buffer, offset, size):
+            self.calls += 1
+            hot.glBindBufferRange(target, index, buffer, offset, size)
+            self.ranges[key] = buffer, offset, size
+
+    def buffer_sub_data(self, target, buffer, offset, data):
+        # Leaves 'target' bound to 'buffer', nothing else relies on that binding
+        if self.buffers.get(target) != buffer:
+            self.calls += 1
+            hot.glBindBuffer(target, buffer)
+            self.buffers[target] = buffer
+        self.calls += 1
+        hot.glBufferSubData(target, offset, data.nbytes, data)
+
+    def draw_arrays(self, mode, first, count):
+        self.calls += 1
+        hot.glDrawArrays(mode, first, count)
+
+    def draw_arrays_instanced(self, mode, first, count, instances):
+        self.calls += 1
+        hot.glDrawArraysInstanced(mode, first, count, instances)
+
+    def bind_image_texture(self, unit, texture, access, format):
+        # Only issued on change, compute passes keep writing the same texture
+        if self.images.get(unit) != (texture, access, format):
+            self.calls += 1
+            hot.glBindImageTexture(unit, texture, 0, GL_FALSE, 0, access, format)
+            self.images[unit] = texture, access, format
+
+    def dispatch_compute(self, x, y, z=1):
+        self.calls += 1
+        hot.glDispatchCompute(x, y, z)
+
+    def memory_barrier(self, barriers):
+        self.calls += 1
+        hot.glMemoryBarrier(barriers)
+
+
+class Throttle(object):
+    def __init__(self, interval):
+        """
+            interval -> Minimum seconds between ready() returning True (0: always ready)
+        """
+        self.interval = interval
+        self.last = None
+
+    def ready(self):
+        now = time.perf_counter()
+        if self.last is None or now - self.last >= self.interval:
+            self.last = now
+            return True
+        return False
@@ -0,0 +1,72 @@
+# Non-blocking GPU timer (GL_TIME_ELAPSED queries)
+#
+# Query results arrive a few frames late. Waiting for them would stall the
+# pipeline, so the queries are kept in a small ring and only results which are
+# already available are read back.
+
+
+from __future__ import division
+import ctypes as ct
+from collections import deque
+
+from OpenGL.GL import (glGenQueries, glDeleteQueries, glBeginQuery, glEndQuery, glGetQueryObjectiv,
+                       GL_TIME_ELAPSED, GL_QUERY_RESULT, GL_QUERY_RESULT_AVAILABLE)
+# The wrapped version fails to convert 64 bit results, use the raw one
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+
+class GpuTimer(object):
+    def __init__(self, depth=4):
+        """
+            depth -> Number of queries in flight (frames of latency we can absorb)
+        """
+        self.queries = [int(q) for q in glGenQueries(depth)]
+        self.free = list(self.queries)
+        self.pending = deque()
+        self.active = None
+
+        # Some drivers report garbage for the very first query
+        self.skip = 1
+        self._result = ct.c_uint64()
+
+        # Latest result in milliseconds (None until the first one arrives)
+        self.last_ms = None
+
+    def begin(self):
+        # All queries still in flight, this frame goes untimed
+        if not self.free:
+            self.active = None
+            return
+        self.active = self.free.pop()
+        glBeginQuery(GL_TIME_ELAPSED, self.active)
+
+    def end(self):
+        if self.active is None:
+            return
+        glEndQuery(GL_TIME_ELAPSED)
+        self.pending.append(self.active)
+        self.active = None
+
+    def poll(self):
+        """
+            Collect finished queries without waiting
+
+            return -> list of new results in milliseconds (oldest first)
+        """
+        results = []
+        while self.pending and glGetQueryObjectiv(self.pending[0], GL_QUERY_RESULT_AVAILABLE):
+            query = self.pending.popleft()
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ct.byref(self._result))
+            self.free.append(query)
+
+            if self.skip:
+                self.skip -= 1
+                continue
+            results.append(self._result.value / 1e6)
+
+        if results:
+            self.last_ms = results[-1]
+        return results
+
+    def destroy(self):
+        glDeleteQueries(len(self.queries), self.queries)
@@ -0,0 +1,218 @@
+# Headless OpenGL context for machines without a display (render nodes, CI)
+#
+# Uses EGL (surfaceless) or OSMesa, both run fine on mesa's llvmpipe software
+# rasterizer without a GPU. Since there is no window, everything is drawn into
+# an offscreen framebuffer object which acts as the "screen".
+#
+# Note: PyOpenGL picks its platform when OpenGL is imported for the first time,
+#       so use_platform() has to be called before any "from OpenGL.GL import *"
+
+
+from __future__ import division
+import os
+
+
+def use_platform(platform='egl'):
+    """
+        Select the PyOpenGL platform ('egl' or 'osmesa')
+
+        Must be called before OpenGL is imported anywhere
+    """
+    os.environ['PYOPENGL_PLATFORM'] = platform
+    if platform == 'egl':
+        # No X11/Wayland on render nodes. Ask mesa for a surfaceless display
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+
+class HeadlessContext(object):
+    def __init__(self, resolution, platform=None, core=False):
+        """
+            Create offscreen GL context and the framebuffer we draw into
+
+            resolution -> (width, height) of the offscreen framebuffer
+            platform -> 'egl' or 'osmesa' (Default: whatever use_platform() selected)
+            core -> Core profile context (Default: compatibility profile, for GL_QUADS)
+        """
+        self.resolution = resolution
+        self.core = core
+        self.platform = platform or os.environ.get('PYOPENGL_PLATFORM', 'egl')
+
+        if self.platform == 'egl':
+            self._create_egl()
+        elif self.platform == 'osmesa':
+            self._create_osmesa()
+        else:
+            raise ValueError("Unknown headless platform: {}".format(self.platform))
+
+        self.frame, self.color = self.genFrameBuffer()
+
+    def _create_egl(self):
+        import ctypes as ct
+        from OpenGL import EGL
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        EGL.eglInitialize(self.display, ct.pointer(major), ct.pointer(minor))
+
+        # We never present anything, but the default surface type (window) has no configs
+        # on a surfaceless display
+        config_attribs = (EGL.EGLint * 5)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                          EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+        config = EGL.EGLConfig()
+        num_configs = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, config_attribs, ct.pointer(config), 1, ct.pointer(num_configs))
+        if num_configs.value < 1:
+            raise RuntimeError("No EGL config with desktop OpenGL support")
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+        # Compatibility profile unless asked otherwise, the quad geometry draws with GL_QUADS
+        profile = (EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT if self.core else
+                   EGL.EGL_CONTEXT_OPENGL_COMPATIBILITY_PROFILE_BIT)
+        context_attribs = (EGL.EGLint * 7)(EGL.EGL_CONTEXT_MAJOR_VERSION, 3,
+                                           EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                                           EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, profile,
+                                           EGL.EGL_NONE)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, context_attribs)
+        if not self.context:
+            raise RuntimeError("Failed to create EGL context")
+
+        self.config = config
+        self.context_attribs = context_attribs
+        self.make_current()
+
+    def _create_osmesa(self):
+        from OpenGL import osmesa, arrays
+        from OpenGL.GL import GL_UNSIGNED_BYTE
+
+        w, h = self.resolution
+        attribs = arrays.GLintArray.asArray([osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+                                             osmesa.OSMESA_PROFILE,
+                                             osmesa.OSMESA_CORE_PROFILE if self.core else osmesa.OSMESA_COMPAT_PROFILE,
+                                             osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3,
+                                             osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3,
+                                             0])
+        self.context = osmesa.OSMesaCreateContextAttribs(attribs, None)
+        if not self.context:
+            raise RuntimeError("Failed to create OSMesa context")
+
+        # OSMesa wants a buffer even though we draw into our own framebuffer
+        self.buffer = arrays.GLubyteArray.zeros((h, w, 4))
+        self._osmesa_type = GL_UNSIGNED_BYTE
+        self.make_current()
+
+    def make_current(self):
+        if self.platform == 'egl':
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+        else:
+            from OpenGL import osmesa
+            w, h = self.resolution
+            osmesa.OSMesaMakeCurrent(self.context, self.buffer, self._osmesa_type, w, h)
+
+    def share(self):
+        """
+            Create another context sharing programs, buffers and textures with this one (for a worker thread)
+
+            return -> SharedContext, None on OSMesa
+        """
+        if self.platform != 'egl':
+            return None
+        return SharedContext(self)
+
+    def genFrameBuffer(self):
+        """
+            Generate the offscreen "screen" framebuffer (RGBA8 color renderbuffer)
+
+            return -> framebuffer and renderbuffer
+        """
+        from OpenGL.GL import (glGenFramebuffers, glBindFramebuffer, glGenRenderbuffers,
+                               glBindRenderbuffer, glRenderbufferStorage, glFramebufferRenderbuffer,
+                               glCheckFramebufferStatus, glViewport, GL_FRAMEBUFFER, GL_RENDERBUFFER,
+                               GL_RGBA8, GL_COLOR_ATTACHMENT0, GL_FRAMEBUFFER_COMPLETE)
+
+        w, h = self.resolution
+        frame = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, frame)
+
+        color = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, w, h)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, color)
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Headless framebuffer is not complete")
+
+        # Without a surface the default viewport is empty
+        glViewport(0, 0, w, h)
+
+        # Leave it bound, this is our screen now
+        return frame, color
+
+    def resize(self, resolution):
+        """
+            New storage of the new size for the "screen" renderbuffer (the framebuffer stays the same)
+        """
+        from OpenGL.GL import (glBindRenderbuffer, glRenderbufferStorage, glClearColor, glClear, glBindFramebuffer,
+                               GL_RENDERBUFFER, GL_RGBA8, GL_FRAMEBUFFER, GL_COLOR_BUFFER_BIT)
+
+        self.resolution = tuple(resolution)
+        w, h = self.resolution
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, w, h)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.frame)
+        glClearColor(0.0, 0.0, 0.0, 0.0)
+        glClear(GL_COLOR_BUFFER_BIT)
+
+    def read_pixels(self):
+        """
+            Read the rendered image back
+
+            return -> numpy uint8 array (height, width, 4), bottom row first
+        """
+        from numpy import frombuffer, uint8
+        from OpenGL.GL import glBindFramebuffer, glReadPixels, GL_FRAMEBUFFER, GL_RGBA, GL_UNSIGNED_BYTE
+
+        w, h = self.resolution
+        glBindFramebuffer(GL_FRAMEBUFFER, self.frame)
+        data = glReadPixels(0, 0, w, h, GL_RGBA, GL_UNSIGNED_BYTE)
+        return frombuffer(data, dtype=uint8).reshape(h, w, 4)
+
+    def destroy(self):
+        from OpenGL.GL import glDeleteFramebuffers, glDeleteRenderbuffers
+
+        glDeleteRenderbuffers(1, [self.color])
+        glDeleteFramebuffers(1, [self.frame])
+
+        if self.platform == 'egl':
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+        else:
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.context)
+
+
+class SharedContext(object):
+    def __init__(self, parent):
+        """
+            EGL context sharing objects with the HeadlessContext 'parent', current on no thread yet
+        """
+        from OpenGL import EGL
+
+        self.display = parent.display
+        self.context = EGL.eglCreateContext(self.display, parent.config, parent.context, parent.context_attribs)
+        if not self.context:
+            raise RuntimeError("Failed to create shared EGL context")
+
+    def make_current(self):
+        from OpenGL import EGL
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+
+    def release(self):
+        from OpenGL import EGL
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+
+    def destroy(self):
+        from OpenGL import EGL
+        EGL.eglDestroyContext(self.display, self.context)
@@ -0,0 +1,134 @@
+# Shader hot reload (.glsl files watched for changes)
+#
+# The passes of a setup can load their GLSL from files instead of the string
+# constants: DIR/pass<N>.vert.glsl and DIR/pass<N>.frag.glsl. Missing files are
+# written out from the built-in sources first, so any setup can be edited live.
+#
+# A watcher thread polls the files and reads the new source when one changes.
+# The render thread picks the changes up between frames (GL calls have to stay
+# on the thread owning the context). With async compile (windows) the new
+# program goes to the renderer's CompileScheduler and the old one keeps drawing
+# until it is linked, otherwise only the changed stage is recompiled right
+# away. Either way the program is swapped and the caption shows how long it
+# took. If the new source doesn't compile the old program keeps running (the
+# log goes to stderr).
+#
+# Usage:
+#       python raymarch_setup.py --shaders shaders/
+
+
+from __future__ import division
+import io
+import os
+import threading
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+# Pass attribute -> file suffix
+STAGES = {'vertex': 'vert', 'fragment': 'frag'}
+
+
+def shader_path(directory, index, stage):
+    return os.path.join(directory, 'pass{}.{}.glsl'.format(index, STAGES[stage]))
+
+
+def _read(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def _stamp(path):
+    """
+        return -> what tells if the file changed (None if it is missing)
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class ShaderWatcher(object):
+    def __init__(self, interval=0.25):
+        """
+            interval -> Seconds between polls of the watched files
+        """
+        self.interval = interval
+        self.files = {}             # path -> [key, stamp]
+        self.lock = threading.Lock()
+        self.queue = Queue()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._poll, name='ShaderWatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def watch(self, path, key):
+        """
+            Report changes of 'path' as 'key' from changes()
+        """
+        with self.lock:
+            self.files[path] = [key, _stamp(path)]
+
+    def _poll(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                files = list(self.files.items())
+
+            for path, entry in files:
+                stamp = _stamp(path)
+                if stamp is None or stamp == entry[1]:
+                    continue
+                entry[1] = stamp
+                try:
+                    source = _read(path)
+                except (IOError, OSError, UnicodeDecodeError):
+                    continue
+                self.queue.put((entry[0], path, source))
+
+    def changes(self):
+        """
+            Changed files since the last call, doesn't block
+
+            return -> list of (key, path, source), only the latest source per file
+        """
+        latest = {}
+        while 1:
+            try:
+                key, path, source = self.queue.get_nowait()
+            except Empty:
+                break
+            latest[path] = key, path, source
+        return list(latest.values())
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def watch_passes(watcher, passes, directory):
+    """
+        Load the sources of 'passes' from 'directory' (writing out missing files
+        from the current sources) and watch the files
+
+        Changes are reported with (pass, stage) keys
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for index, p in enumerate(passes):
+        for stage in STAGES:
+            if getattr(p, stage) is None:
+                # Compute passes have neither
+                continue
+            path = shader_path(directory, index, stage)
+            if os.path.exists(path):
+                setattr(p, stage, _read(path))
+            else:
+                with io.open(path, 'w', encoding='utf-8') as f:
+                    f.write(getattr(p, stage).lstrip('\n'))
+            watcher.watch(path, (p, stage))
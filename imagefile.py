@@ -0,0 +1,54 @@
+# Minimal image writers (no extra dependencies, zlib is enough for PNG)
+#
+# Images are numpy uint8 arrays (height, width, channels) in GL order, bottom
+# row first, like HeadlessContext.read_pixels() returns them.
+
+
+from __future__ import division
+import struct
+import zlib
+
+import numpy as np
+
+
+def _chunk(kind, data):
+    chunk = kind + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+
+def encode_png(image, level=1):
+    """
+        Encode 'image' (RGB or RGBA) as PNG
+
+        level -> zlib level, low levels are much faster for image sequences
+
+        return -> bytes
+    """
+    height, width, channels = image.shape
+    color_type = {3: 2, 4: 6}[channels]
+
+    # PNG is top row first. Every row starts with filter type 0 (None)
+    rows = np.empty((height, 1 + width * channels), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = image[::-1].reshape(height, width * channels)
+
+    return b''.join([b'\x89PNG\r\n\x1a\n',
+                     _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)),
+                     _chunk(b'IDAT', zlib.compress(rows.tobytes(), level)),
+                     _chunk(b'IEND', b'')])
+
+
+def write_png(path, image, level=1):
+    with open(path, 'wb') as f:
+        f.write(encode_png(image, level))
+
+
+def write_raw(path, image):
+    """
+        Raw pixels as they are (bottom row first), size/format has to be known by the reader
+    """
+    with open(path, 'wb') as f:
+        f.write(np.ascontiguousarray(image).data)
+
+
+WRITERS = {'png': write_png, 'raw': write_raw}
@@ -0,0 +1,130 @@
+# March step statistics of the raymarch setups
+#
+# Renders a frame headless with STEP_HEATMAP (the fragment alpha holds the
+# number of march steps) plain, with ACCELERATE (bounding sphere and
+# over-relaxed steps), with CONE_MARCH (rays start at the depth of a low
+# resolution cone march prepass) and with both. Prints the step counts of each
+# (the prepass steps spread over the pixels of their tiles) and how far the
+# images are from the plain one, at several times (the displacement changes
+# with time, one frame can look better than the rest).
+#
+# Usage:
+#       python marchstats.py                                  (both raymarch setups)
+#       python marchstats.py raymarch_setup_mod --heatmap out (writes out_plain.png, out_cone.png...)
+#       python marchstats.py --define NUMBER_OF_STEPS=256 --define CONE_TILE=16
+#       python marchstats.py --time 1.5                       (one frame)
+
+
+from __future__ import division
+import argparse
+import importlib
+import sys
+
+import numpy as np
+
+import imagefile
+
+
+MODES = [('plain',            {'ACCELERATE': 0, 'CONE_MARCH': 0}),
+         ('accelerated',      {'ACCELERATE': 1, 'CONE_MARCH': 0}),
+         ('cone',             {'ACCELERATE': 0, 'CONE_MARCH': 1}),
+         ('cone+accelerated', {'ACCELERATE': 1, 'CONE_MARCH': 1})]
+
+
+def render(setup, defines, resolution, mouse, time):
+    """
+        return -> RGBA frame of 'setup' (bottom row first, like imagefile expects) with 'defines' added,
+                  number of steps the cone march prepass took (0 without it)
+    """
+    main = importlib.import_module(setup).Main(headless=True, resolution=resolution, defines=defines,
+                                               program_cache=False)
+    # After the setup, fastgl has to configure OpenGL first
+    from OpenGL.GL import glBindFramebuffer, glReadPixels, GL_READ_FRAMEBUFFER, GL_RGBA, GL_FLOAT
+
+    main.render(mouse, time)
+    image = main.context.read_pixels().copy()
+
+    prepass_steps = 0
+    if main.passes[0].format == 'rg32f':
+        # Steps per tile in green, the rest of the framebuffer is cleared to 0
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, main.passes[0].frame)
+        pixels = np.asarray(glReadPixels(0, 0, resolution[0], resolution[1], GL_RGBA, GL_FLOAT))
+        prepass_steps = int(pixels[..., 1].sum())
+    main.context.destroy()
+    return image, prepass_steps
+
+
+def statistics(steps):
+    """
+        return -> dict of the mean, median, 99th percentile and maximum of 'steps'
+    """
+    steps = steps.astype(np.float64)
+    return {'mean': steps.mean(), 'p50': np.percentile(steps, 50), 'p99': np.percentile(steps, 99),
+            'max': steps.max()}
+
+
+def measure(setup, resolution, mouse, time, defines=None):
+    """
+        return -> dict mode -> (step statistics, heat map image, max and mean color difference to 'plain',
+                  number of pixels more than 2/255 off)
+    """
+    results, plain = {}, None
+    for mode, mode_defines in MODES:
+        extra = dict(defines or {}, **mode_defines)
+        heatmap, prepass_steps = render(setup, dict(extra, STEP_HEATMAP=1), resolution, mouse, time)
+        stats = statistics(heatmap[..., 3])
+        stats['prepass'] = prepass_steps / (resolution[0] * resolution[1])
+
+        color = render(setup, dict(extra, STEP_HEATMAP=0), resolution, mouse, time)[0].astype(np.int32)
+        if plain is None:
+            plain = color
+        difference = np.abs(color - plain)[..., :3]
+        results[mode] = (stats, heatmap, int(difference.max()), float(difference.mean()),
+                         int((difference.max(axis=-1) > 2).sum()))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="March steps per pixel, plain vs accelerated and cone marched")
+    parser.add_argument('setups', nargs='*', default=['raymarch_setup', 'raymarch_setup_mod'])
+    parser.add_argument('--resolution', type=int, nargs=2, default=[640, 480], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--mouse', type=float, nargs=2, default=[320.0, 240.0], metavar=('X', 'Y'))
+    parser.add_argument('--time', type=float, nargs='+', default=[0.5, 1.0, 1.5, 2.5, 4.0])
+    parser.add_argument('--define', action='append', default=[], metavar='NAME[=VALUE]')
+    parser.add_argument('--heatmap', metavar='PREFIX', help="Write the heat maps as PREFIX_<mode>.png")
+    args = parser.parse_args(argv)
+
+    import headless
+    headless.use_platform()
+
+    defines = {}
+    for define in args.define:
+        name, _, value = define.partition('=')
+        defines[name] = value or 1
+
+    # Color difference: max, mean and pixels more than 2/255 off
+    print("{:<20} {:>5} {:<17} {:>7} {:>5} {:>5} {:>5} {:>8} {:>9} {:>17}".format(
+          'setup', 'time', 'mode', 'mean', 'p50', 'p99', 'max', 'prepass', 'reduction', 'color diff'))
+    for setup in args.setups:
+        for time in args.time:
+            results = measure(setup, tuple(args.resolution), tuple(args.mouse), time, defines)
+            plain = results['plain'][0]['mean']
+            for mode, mode_defines in MODES:
+                stats, heatmap, max_difference, mean_difference, off = results[mode]
+                # Total SDF evaluations per pixel (ignoring the normals), prepass included
+                total = stats['mean'] + stats['prepass']
+                print("{:<20} {:>5.2f} {:<17} {:>7.2f} {:>5.0f} {:>5.0f} {:>5.0f} {:>8.2f} {:>8.2f}x {:>4} {:.4f} {:>5}".format(
+                      setup, time, mode, stats['mean'], stats['p50'], stats['p99'], stats['max'], stats['prepass'],
+                      plain / total if total else float('inf'), max_difference, mean_difference, off))
+                if args.heatmap:
+                    suffix = '_{}'.format(mode)
+                    if len(args.setups) > 1:
+                        suffix = '_{}{}'.format(setup, suffix)
+                    if len(args.time) > 1:
+                        suffix += '_{:g}'.format(time)
+                    imagefile.write_png(args.heatmap + suffix + '.png', heatmap[..., :3])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,16 +7,7 @@
 
 
 from __future__ import division
-import pygame
-from pygame.locals import *
-
-from OpenGL.GL import * 
-from OpenGL.GL import shaders
-#from OpenGL.GLU import *
-
-from sys import exit as exitsystem
-
-from numpy import array
+from renderer import Renderer, Pass, run
 
 
 VERTEX_SHADER = """
@@ -48,74 +39,10 @@ void main()
 """
 
 
-class Main(object):
-    def __init__(self):
-        pygame.init()
-        self.resolution = 800, 600  
-        pygame.display.set_mode(self.resolution, DOUBLEBUF | OPENGL)
-        pygame.display.set_caption('PyShadeToy')        
-
-        # Shaders
-        self.vertex_shader = shaders.compileShader(VERTEX_SHADER, GL_VERTEX_SHADER)
-        self.fragment_shader = shaders.compileShader(FRAGMENT_SHADER, GL_FRAGMENT_SHADER)
-
-        # Shader program which hosts the vertex and fragment shader
-        self.shader = shaders.compileProgram(self.vertex_shader, self.fragment_shader)
-
-        # Get the uniform locations
-        self.uni_mouse = glGetUniformLocation(self.shader, 'iMouse')
-        self.uni_ticks = glGetUniformLocation(self.shader, 'iTime')
-
-        glUseProgram(self.shader)   # Need to be enabled before sending uniform variables
-        # Resolution doesn't change. Send it once
-        glUniform2f(glGetUniformLocation(self.shader, 'iResolution'), *self.resolution)
-        
-        # Create the fullscreen quad for drawing
-        self.vertices = array([-1.0, -1.0, 0.0,
-                                1.0, -1.0, 0.0,
-                                1.0,  1.0, 0.0,
-                               -1.0,  1.0, 0.0], dtype='float32')
-
-        # Generate VAO
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
-
-        # Generate VBO which is stored in the VAO state
-        self.vbo = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, self.vertices, GL_STATIC_DRAW)
-
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
-
-        
-        self.clock = pygame.time.Clock()
-
-    def mainloop(self):
-        while 1:
-            delta = self.clock.tick(8192)
-
-            glClearColor(0.0, 0.0, 0.0, 1.0)
-            glClear(GL_COLOR_BUFFER_BIT)
-
-            for event in pygame.event.get():
-                if (event.type == QUIT) or (event.type == KEYUP and event.key == K_ESCAPE):
-                    pygame.quit()
-                    exitsystem()
-                    
-            glUseProgram(self.shader)
-
-            # Send uniform values
-            glUniform2f(self.uni_mouse, *pygame.mouse.get_pos())
-            glUniform1f(self.uni_ticks, pygame.time.get_ticks() / 1000.0)
-
-            # Bind the vao (which stores the VBO with all the vertices)
-            glBindVertexArray(self.vao)
-            glDrawArrays(GL_QUADS, 0, 4)
-
-            pygame.display.set_caption("FPS: {}".format(self.clock.get_fps()))
-            pygame.display.flip()
+class Main(Renderer):
+    def __init__(self, **options):
+        Renderer.__init__(self, [Pass(VERTEX_SHADER, FRAGMENT_SHADER)], **options)
 
 
 if __name__ == '__main__':
-    Main().mainloop()
+    run(Main)
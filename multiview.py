@@ -0,0 +1,409 @@
+# Multi-view rendering: several views of a pass in one draw call
+#
+# A MultiViewPass draws its shader once per view in one instanced draw: instance
+# i is a fullscreen triangle going to viewport i of a viewport array (written to
+# gl_ViewportIndex by the vertex shader, the instances of a view are its tiles
+# with tiles), the viewports split the framebuffer into a contact sheet. Every view has its own iMouse and iTime, the fragment
+# shader's declarations of them are replaced by the values of its view in a
+# uniform buffer (uploaded when a view changes). iResolution is the view size and
+# gl_FragCoord is made relative to the view, the shaders stay as they are.
+#
+# The contact sheet is drawn to the screen (or the pass' texture with offscreen),
+# read_views() reads the views back as separate images.
+#
+# multiview() turns the passes the last one reads into multi-view passes with the
+# same contact sheet layout, so every view has inputs drawn with its own uniforms.
+# Their texture(), texelFetch() and textureSize() calls are redirected to the
+# view's rectangle of the input (texture() filters and wraps inside it like the
+# GL_LINEAR, GL_REPEAT textures of the passes).
+#
+# The views cost the same pixels as separate renders, one draw saves the per
+# render overhead only. On llvmpipe (one core shading every pixel) that's less
+# than what the redirected texture reads cost: separate renders are faster there,
+# the benchmark prints both.
+#
+# Usage:
+#       MultiViewPass(VS, FS, views=[{'iMouse': (100, 100)}, {'iMouse': (300, 200), 'iTime': 2.0}])
+#       multiview(Main(), views)                           (last pass of a setup with views)
+#       python multiview.py raymarch_setup_mod             (4 light positions, one draw vs one render each)
+#       python multiview.py multipass_setup                (the 4x4 tiles of its second pass in every view)
+#       python multiview.py raymarch_setup --view 100,100 --view 300,200,2.0 --sheet sheet.png --window
+#
+# Note: Needs GL_ARB_shader_viewport_layer_array and GL_ARB_fragment_layer_viewport.
+#       Inputs are sampler2D only, no feedback, compute passes, dynamic resolution or accumulation.
+
+
+from __future__ import division
+import argparse
+import importlib
+import math
+import re
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__':
+    # The benchmark runs headless unless --window, the platform has to be picked before OpenGL is imported
+    if '--window' not in sys.argv:
+        import headless
+        headless.use_platform()
+    import fastgl
+
+from OpenGL.GL import (glGenBuffers, glBindBuffer, glBufferData, glGetUniformBlockIndex, glUniformBlockBinding,
+                       glGetIntegerv, glGetStringi, glDeleteProgram, glReadPixels, glFinish, GL_UNIFORM_BUFFER,
+                       GL_DYNAMIC_DRAW, GL_INVALID_INDEX, GL_NUM_EXTENSIONS, GL_EXTENSIONS,
+                       GL_COLOR_BUFFER_BIT, GL_RGBA, GL_UNSIGNED_BYTE)
+
+import fullscreen
+from uniforms import DECLARATION, VERSION
+from variants import VariantPass
+
+
+BLOCK_NAME = 'Views'
+
+# The frame uniforms are bound at 0
+BINDING = 1
+
+# Per view uniform -> type, components of the view's first vec4 (the second has the view's origin and size)
+FIELDS = {'iMouse': ('vec2', 'xy'), 'iTime': ('float', 'z')}
+
+EXTENSIONS = ['GL_ARB_shader_viewport_layer_array', 'GL_ARB_fragment_layer_viewport']
+FRAGMENT_EXTENSION = "#extension GL_ARB_fragment_layer_viewport : require\n"
+
+BLOCK = "layout(std140) uniform {}\n{{\n    vec4 viewData[{}];\n}};\n"
+FRAGCOORD = re.compile(r'\bgl_FragCoord\b')
+MAIN = re.compile(r'\bvoid\s+main\s*\(')
+
+# The view's data is read once into globals, not by gl_ViewportIndex at every use (the
+# ray marchers read iTime in their inner loop)
+GLOBALS = """vec4 viewUniforms;
+vec4 viewRect;
+#define viewFragCoord (gl_FragCoord - vec4(viewRect.xy, 0.0, 0.0))
+"""
+VIEW_MAIN = """
+void main()
+{
+    viewUniforms = viewData[2 * gl_ViewportIndex];
+    viewRect = viewData[2 * gl_ViewportIndex + 1];
+    viewMain();
+}
+"""
+
+# Inputs are contact sheets of the same layout, read the view's rectangle of them
+SAMPLING = """vec4 viewTexelFetch(sampler2D s, ivec2 texel, int lod)
+{
+    return texelFetch(s, texel + ivec2(viewRect.xy), lod);
+}
+ivec2 viewTextureSize(sampler2D s, int lod)
+{
+    return ivec2(viewRect.zw);
+}
+vec4 viewTexture(sampler2D s, vec2 uv)
+{
+    vec2 position = uv * viewRect.zw - 0.5;
+    vec2 low = floor(position), f = position - low;
+    if (all(greaterThanEqual(low, vec2(0.0))) && all(lessThan(low + 1.0, viewRect.zw)))
+        return texture(s, (viewRect.xy + uv * viewRect.zw) / vec2(textureSize(s, 0)));
+
+    // Across the edge: bilinear by hand, wrapping around the view's rectangle instead of the texture
+    ivec2 origin = ivec2(viewRect.xy);
+    vec4 a = texelFetch(s, origin + ivec2(mod(low, viewRect.zw)), 0);
+    vec4 b = texelFetch(s, origin + ivec2(mod(low + vec2(1.0, 0.0), viewRect.zw)), 0);
+    vec4 c = texelFetch(s, origin + ivec2(mod(low + vec2(0.0, 1.0), viewRect.zw)), 0);
+    vec4 d = texelFetch(s, origin + ivec2(mod(low + 1.0, viewRect.zw)), 0);
+    return mix(mix(a, b, f.x), mix(c, d, f.x), f.y);
+}
+#define texelFetch(s, texel, lod) viewTexelFetch(s, texel, lod)
+#define textureSize(s, lod) viewTextureSize(s, lod)
+#define texture(s, uv) viewTexture(s, uv)
+"""
+
+# Light positions of the benchmark, fractions of the view size
+LIGHTS = [(0.2, 0.8), (0.8, 0.8), (0.2, 0.2), (0.8, 0.2)]
+
+
+def rewrite(source, views, inputs=False):
+    """
+        Make the fragment shader 'source' draw the view of gl_ViewportIndex: iMouse/iTime are
+        read from the view block instead of their declarations, gl_FragCoord is relative to the view
+        (main() becomes viewMain(), called by a main() reading the view's data)
+
+        views -> Number of views
+        inputs -> The textures read are contact sheets of the views too, read the view's part of them
+
+        return -> new source
+    """
+    replaced = []
+
+    def replace(match):
+        kind, name = match.group(1), match.group(2)
+        if name not in FIELDS or FIELDS[name][0] != kind:
+            return match.group(0)
+        replaced.append(name)
+        return ''
+
+    source = MAIN.sub('void viewMain(', FRAGCOORD.sub('viewFragCoord', DECLARATION.sub(replace, source)))
+    lines = BLOCK.format(BLOCK_NAME, 2 * views) + GLOBALS + ''.join(
+            "#define {} (viewUniforms.{})\n".format(name, FIELDS[name][1]) for name in sorted(replaced))
+    return _insert(source, lines + (SAMPLING if inputs else '')) + VIEW_MAIN
+
+
+def _insert(source, lines):
+    # After #version
+    version = VERSION.search(source)
+    end = version.end() if version else 0
+    return source[:end] + lines + source[end:]
+
+
+def extensions():
+    """
+        return -> set of the context's extension names
+    """
+    return set(glGetStringi(GL_EXTENSIONS, i).decode() for i in range(int(glGetIntegerv(GL_NUM_EXTENSIONS))))
+
+
+class MultiViewPass(VariantPass):
+    def __init__(self, vertex, fragment, views, columns=None, variants=(('default', {}),), variant=None,
+                 defines=None, **options):
+        """
+            views -> list of dicts with the 'iMouse' (pixels in the view) and 'iTime' of each view,
+                     the frame's values for the ones left out
+            columns -> Views per row of the contact sheet (Default: about as many as rows)
+            variants, variant, defines -> see VariantPass
+            options -> Pass options (offscreen: the contact sheet goes to the pass' texture,
+                       inputs: MultiViewPasses with the same views and columns)
+        """
+        VariantPass.__init__(self, vertex, fragment, variants, variant, defines, **options)
+        if self.feedback:
+            raise ValueError("Multi-view passes can't have feedback")
+        self.views = [dict(view) for view in views]
+        self.columns = columns or int(math.ceil(math.sqrt(len(self.views))))
+        self.rows = -(-len(self.views) // self.columns)
+        self.viewports = True
+
+        # Two vec4 per view: iMouse, iTime and the rectangle of the view in the contact sheet
+        self.data = np.zeros((len(self.views), 8), dtype=np.float32)
+        self.uploaded = None        # View data in the buffer
+        self.buffer = None
+        self.rects = None           # Viewport of every view
+
+    @classmethod
+    def from_pass(cls, other, views, columns=None, inputs=None):
+        """
+            inputs -> Passes read instead of the ones of 'other' (Default: the same)
+
+            return -> MultiViewPass with the sources, variants and options of the Pass 'other'
+        """
+        variants = getattr(other, 'variants', [('default', {})])
+        return cls(other.vertex, other.fragment, views, columns, variants, getattr(other, 'variant', None),
+                   getattr(other, 'common', None), offscreen=other.offscreen,
+                   inputs=other.inputs if inputs is None else inputs,
+                   format=other.format, feedback=other.feedback, tiles=other.tiles)
+
+    def prepare(self, source, stage='fragment', variant=None):
+        if stage == 'vertex':
+            return VariantPass.prepare(self, source, stage, variant)
+        source = VariantPass.prepare(self, rewrite(source, len(self.views), bool(self.inputs)), stage, variant)
+        # Before everything the rewrites put in
+        return _insert(source, FRAGMENT_EXTENSION)
+
+    def set_program(self, program):
+        VariantPass.set_program(self, program)
+        index = glGetUniformBlockIndex(self.program, BLOCK_NAME)
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(self.program, index, BINDING)
+
+    def build(self, renderer):
+        missing = [name for name in EXTENSIONS if name not in extensions()]
+        if missing:
+            raise RuntimeError("Multi-view rendering needs {}".format(', '.join(missing)))
+
+        VariantPass.build(self, renderer)
+        self.layout(renderer)
+
+        self.buffer = int(glGenBuffers(1))
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+        self.uploaded = None
+
+    def layout(self, renderer):
+        """
+            Split the framebuffer into the views, the first one top left
+        """
+        w, h = renderer.resolution
+        self.size = w // self.columns, h // self.rows
+        self.rects = np.zeros((len(self.views), 4), dtype=np.float32)
+        for index, rect in enumerate(self.rects):
+            x, y = index % self.columns * self.size[0], (self.rows - 1 - index // self.columns) * self.size[1]
+            rect[:] = x, y, self.size[0], self.size[1]
+            self.data[index, 4:8] = rect
+
+    def resize(self, renderer):
+        VariantPass.resize(self, renderer)
+        self.layout(renderer)
+
+    def draw(self, renderer, mouse, ticks):
+        if self.wanted != self.variant:
+            self._swap(renderer)
+        state = renderer.state
+
+        # 'mouse' is mapped already, the views' own positions are in view pixels
+        for view, data in zip(self.views, self.data):
+            data[:2] = renderer.map_mouse(view['iMouse'], self.size) if 'iMouse' in view else mouse
+            data[2] = view.get('iTime', ticks)
+        if self.uploaded is None or (self.uploaded != self.data).any():
+            state.buffer_sub_data(GL_UNIFORM_BUFFER, self.buffer, 0, self.data)
+            self.uploaded = self.data.copy()
+        state.bind_buffer_range(GL_UNIFORM_BUFFER, BINDING, self.buffer, 0, self.data.nbytes)
+
+        state.bind_framebuffer(self.frame)
+        state.clear_color(0.0, 0.0, 0.0, 1.0)
+        state.clear(GL_COLOR_BUFFER_BIT)
+        state.viewport_array(self.rects)
+        self.bind(renderer, mouse, ticks)
+
+        # The tiles (or a fullscreen triangle) of every view
+        state.bind_vertex_array(renderer.vao)
+        mode, count, instances = fullscreen.vertices('triangle', self.tiles)
+        state.draw_arrays_instanced(mode, 0, count, instances * len(self.views))
+
+    def read_views(self, renderer):
+        """
+            Read the views back
+
+            return -> list of numpy uint8 arrays (height, width, 4), bottom row first
+        """
+        renderer.state.bind_read_framebuffer(self.frame)
+        images = []
+        for x, y, w, h in self.rects.astype(int):
+            data = glReadPixels(x, y, w, h, GL_RGBA, GL_UNSIGNED_BYTE)
+            images.append(np.frombuffer(data, dtype=np.uint8).reshape(h, w, 4).copy())
+        return images
+
+
+def multiview(renderer, views, columns=None):
+    """
+        Replace the last pass of the (built) 'renderer', e.g. a setup's Main, and the passes it
+        reads with MultiViewPasses of them
+
+        views, columns -> see MultiViewPass
+
+        return -> the MultiViewPass of the last pass
+    """
+    if renderer.accumulator is not None or renderer.dynamic_resolution is not None:
+        raise ValueError("Multi-view passes can't be used with accumulation or dynamic resolution")
+
+    # The last pass and everything it reads
+    needed, stack = set(), [renderer.passes[-1]]
+    while stack:
+        current = stack.pop()
+        if current.vertex is None:
+            raise ValueError("Multi-view passes need a vertex and fragment shader")
+        if current.feedback:
+            raise ValueError("Multi-view passes can't have feedback")
+        needed.add(current)
+        stack.extend(p for p in current.inputs if p not in needed)
+
+    # In drawing order, inputs are replaced before their readers
+    replaced = {}
+    for index, old in enumerate(renderer.passes):
+        if old not in needed:
+            continue
+        new = replaced[old] = MultiViewPass.from_pass(old, views, columns, [replaced[p] for p in old.inputs])
+        new.build(renderer)
+        renderer.passes[index] = new
+        if old.program is not None:
+            glDeleteProgram(old.program)
+            if renderer.compiler is not None and hasattr(renderer.compiler, 'forget'):
+                renderer.compiler.forget(old.program)
+
+    # The alternative pass lists (F1-F9) don't have the views
+    renderer.alternatives, renderer.built, renderer.switching = [], {}, None
+
+    # Compiled in the background with a window, bindings were changed outside of GLState
+    renderer.loading = renderer.scheduler is not None
+    renderer.state.invalidate()
+    return renderer.passes[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Views of a setup in one draw vs one render per view")
+    parser.add_argument('setup', nargs='?', default='raymarch_setup_mod')
+    parser.add_argument('--view', action='append', default=[], metavar='X,Y[,TIME]',
+                        help="Mouse position (pixels in the view) and time of a view, can be repeated "
+                             "(Default: 4 light positions)")
+    parser.add_argument('--columns', type=int, help="Views per row of the contact sheet")
+    parser.add_argument('--resolution', type=int, nargs=2, default=[800, 600], metavar=('WIDTH', 'HEIGHT'),
+                        help="Contact sheet size, split into the views")
+    parser.add_argument('--time', type=float, default=1.5, help="iTime of views without their own")
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--sheet', metavar='PATH', help="Write the contact sheet PNG")
+    parser.add_argument('--separate', metavar='PREFIX', help="Write every view as PREFIX<n>.png")
+    parser.add_argument('--window', action='store_true', help="Show the contact sheet in a window instead")
+    args = parser.parse_args(argv)
+
+    resolution = tuple(args.resolution)
+    views = []
+    for view in args.view:
+        values = [float(v) for v in view.split(',')]
+        views.append(dict([('iMouse', tuple(values[:2]))] + ([('iTime', values[2])] if len(values) > 2 else [])))
+
+    setup = importlib.import_module(args.setup)
+    if args.window:
+        main = setup.Main(resolution=resolution)
+        multiview(main, views or [{'iMouse': (x * 400.0, y * 300.0)} for x, y in LIGHTS], args.columns)
+        main.mainloop()
+        return 0
+
+    import imagefile
+
+    sheet = setup.Main(headless=True, resolution=resolution)
+    columns = args.columns or int(math.ceil(math.sqrt(len(views) or len(LIGHTS))))
+    rows = -(-(len(views) or len(LIGHTS)) // columns)
+    size = resolution[0] // columns, resolution[1] // rows
+    views = views or [{'iMouse': (x * size[0], y * size[1])} for x, y in LIGHTS]
+    views_pass = multiview(sheet, views, columns)
+
+    def timed(render):
+        render()
+        glFinish()
+        start = time.perf_counter()
+        for frame in range(args.frames):
+            render()
+        glFinish()
+        return (time.perf_counter() - start) * 1000.0 / args.frames
+
+    multi_ms = timed(lambda: sheet.render((0.0, 0.0), args.time))
+    images = views_pass.read_views(sheet)
+    if args.sheet:
+        imagefile.write_png(args.sheet, sheet.context.read_pixels()[..., :3])
+    if args.separate:
+        for index, image in enumerate(images):
+            imagefile.write_png('{}{}.png'.format(args.separate, index), image[..., :3])
+    sheet.context.destroy()
+
+    # The same views one render each, at the view size
+    single = setup.Main(headless=True, resolution=size)
+
+    def separately():
+        for view in views:
+            single.render(view['iMouse'], view.get('iTime', args.time))
+
+    separate_ms = timed(separately)
+    difference = 0
+    for view, image in zip(views, images):
+        single.render(view['iMouse'], view.get('iTime', args.time))
+        difference = max(difference, int(np.abs(single.context.read_pixels().astype(np.int16) - image).max()))
+    single.context.destroy()
+
+    print("{} views of {}x{} ({})".format(len(views), size[0], size[1], args.setup))
+    print("{:<12} {:>9} {:>9} {:>9}".format('mode', 'ms', 'ms/view', 'views/s'))
+    for mode, ms in (('multi-view', multi_ms), ('separate', separate_ms)):
+        print("{:<12} {:>9.2f} {:>9.2f} {:>9.1f}".format(mode, ms, ms / len(views), 1000.0 * len(views) / ms))
+    print("max difference between the views and separate renders: {}".format(difference))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# Offline image sequence renderer (multi-process, tiled)
+#
+# Renders the frames of a time range to PNG/raw files. Every frame is split into
+# bands of rows (tiles) which a pool of worker processes render. Each worker has
+# its own headless GL context, or uses the NumPy reference path when there is
+# no GL. Work is distributed with work stealing: every worker owns a deque of
+# tiles and takes from its front, idle workers steal from the back of the
+# others' deques, so slow tiles (lots of hits in the raymarcher) don't leave
+# cores idle at the end.
+#
+# Usage:
+#       python offline.py raymarch_setup_mod --start 0 --end 4 --fps 30 --out frames
+#       python offline.py raymarch_setup_mod --backend cpu --workers 8 --format raw
+#       python offline.py raymarch_setup --scaling             (fps for 1, 2, 4... workers)
+#
+# Note: Tiles are drawn with a scissor rectangle, which only works for setups
+#       where every pass draws its own pixels straight to the screen. Setups with
+#       offscreen passes (multipass_setup, the CONE_MARCH prepass), compute passes
+#       or tiled draws are rendered as whole frames instead, shown as 'gl whole
+#       frames'. A process probes the setup before the workers start, their
+#       frames aren't split into bands then (one job per frame), so each frame
+#       is rendered exactly once.
+
+
+from __future__ import division
+import argparse
+import importlib
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import imagefile
+
+
+class WorkQueue(object):
+    def __init__(self, context, jobs, workers):
+        """
+            Work stealing queue of job indices 0..jobs-1 shared between processes
+
+            Every worker owns a contiguous range (a deque) [low, high) in shared memory
+        """
+        self.workers = workers
+        self.bounds = context.Array('l', 2 * workers, lock=False)
+        self.locks = [context.Lock() for _ in range(workers)]
+
+        for w in range(workers):
+            self.bounds[2 * w] = jobs * w // workers
+            self.bounds[2 * w + 1] = jobs * (w + 1) // workers
+
+    def take(self, worker):
+        """
+            Next job for 'worker'
+
+            return -> (job, stolen) or None when all work is gone
+        """
+        # Own deque first, from the front (neighbouring tiles of the same frame)
+        with self.locks[worker]:
+            low, high = self.bounds[2 * worker], self.bounds[2 * worker + 1]
+            if low < high:
+                self.bounds[2 * worker] = low + 1
+                return low, False
+
+        # Steal from the back of the others
+        for i in range(1, self.workers):
+            victim = (worker + i) % self.workers
+            with self.locks[victim]:
+                low, high = self.bounds[2 * victim], self.bounds[2 * victim + 1]
+                if low < high:
+                    self.bounds[2 * victim + 1] = high - 1
+                    return high - 1, True
+
+        return None
+
+
+def tileable(main):
+    """
+        return -> True if a scissor rectangle cuts a band out of the frame of the Renderer 'main':
+                  every pass draws its own pixels straight to the screen (no offscreen inputs
+                  drawn elsewhere, no compute dispatches or tiled draws, which ignore the scissor
+                  or read other pixels)
+    """
+    from compute import ComputePass
+    if main.dynamic_resolution is not None or main.accumulator is not None:
+        return False
+    return all(not p.offscreen and not p.inputs and p.tiles == (1, 1) and not isinstance(p, ComputePass)
+               for p in main.passes)
+
+
+class GLBackend(object):
+    def __init__(self, setup, resolution, mouse, platform):
+        import headless
+        headless.use_platform(platform)
+
+        self.main = importlib.import_module(setup).Main(headless=True, resolution=resolution)
+        self.mouse = mouse
+
+        # Otherwise whole frames, the last one is kept for the other bands of it
+        self.tileable = tileable(self.main)
+        self.frame = None
+        self.frame_ticks = None
+
+        if self.tileable:
+            from OpenGL.GL import glEnable, GL_SCISSOR_TEST
+            glEnable(GL_SCISSOR_TEST)
+
+    def render(self, ticks, rows):
+        from OpenGL.GL import glScissor, glBindFramebuffer, glReadPixels, GL_FRAMEBUFFER, GL_RGBA, GL_UNSIGNED_BYTE
+
+        w, h = self.main.resolution
+        first, last = rows
+        if not self.tileable:
+            if ticks != self.frame_ticks:
+                self.main.render(self.mouse, ticks)
+                self.main.state.invalidate()
+                self.frame = self.main.context.read_pixels()
+                self.frame_ticks = ticks
+            return self.frame[first:last]
+
+        glScissor(0, first, w, last - first)
+        self.main.render(self.mouse, ticks)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.main.screen)
+        self.main.state.invalidate()
+        data = glReadPixels(0, first, w, last - first, GL_RGBA, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, dtype=np.uint8).reshape(last - first, w, 4)
+
+
+class CpuBackend(object):
+    def __init__(self, setup, resolution, mouse):
+        from cpu_reference import CpuRenderer, SCENES
+        if setup not in SCENES:
+            raise ValueError("No CPU reference path for {}".format(setup))
+
+        self.renderer = CpuRenderer(resolution, **SCENES[setup])
+        self.mouse = mouse
+
+    def render(self, ticks, rows):
+        return self.renderer.render(self.mouse, ticks, rows)
+
+
+def make_backend(options):
+    """
+        return -> backend, name
+    """
+    if options['backend'] in ('gl', 'auto'):
+        try:
+            return GLBackend(options['setup'], options['resolution'], options['mouse'], options['platform']), 'gl'
+        except Exception:
+            if options['backend'] == 'gl':
+                raise
+    return CpuBackend(options['setup'], options['resolution'], options['mouse']), 'cpu'
+
+
+def _probe(options):
+    backend, name = make_backend(options)
+    return name != 'gl' or backend.tileable
+
+
+def probe(context, options):
+    """
+        return -> True if the workers can render the setup's frames in bands (see tileable(),
+                  the CPU backend renders any rows), checked in a process of 'context'
+    """
+    pool = context.Pool(1)
+    try:
+        return pool.apply(_probe, (options,))
+    except Exception:
+        # The workers fail the same way and report it
+        return True
+    finally:
+        pool.terminate()
+
+
+def band_rows(band, options):
+    h = options['resolution'][1]
+    rows = options['tile_rows'] or h
+    return band * rows, min(h, (band + 1) * rows)
+
+
+def worker(index, queue, results, options):
+    try:
+        backend, name = make_backend(options)
+        if name == 'gl' and not backend.tileable:
+            name = 'gl whole frames'
+        results.put(('backend', index, name))
+
+        bands = options['bands']
+        while 1:
+            job = queue.take(index)
+            if job is None:
+                break
+
+            job, stolen = job
+            frame, band = divmod(job, bands)
+            rows = band_rows(band, options)
+            pixels = backend.render(options['times'][frame], rows)
+            results.put(('tile', index, (frame, rows[0], pixels, stolen)))
+    finally:
+        # Always report back, the parent waits for every worker
+        results.put(('done', index, None))
+
+
+def render_sequence(options, workers, out=None, file_format='png'):
+    """
+        Render all frames of options['times'] with 'workers' processes
+
+        out -> Directory for the frames (None: render only, for benchmarking)
+
+        return -> dict of stats
+    """
+    w, h = options['resolution']
+    options = dict(options)
+    options['bands'] = -(-h // (options['tile_rows'] or h))
+
+    # GL contexts don't survive fork, every worker starts fresh
+    context = multiprocessing.get_context('spawn')
+
+    # Every band of a setup a scissor can't cut would render the whole frame again
+    if options['bands'] > 1 and options['backend'] != 'cpu' and not probe(context, options):
+        options['bands'] = 1
+    jobs = len(options['times']) * options['bands']
+    queue = WorkQueue(context, jobs, workers)
+    results = context.Queue()
+
+    if out is not None and not os.path.isdir(out):
+        os.makedirs(out)
+
+    start = time.perf_counter()
+    processes = [context.Process(target=worker, args=(i, queue, results, options)) for i in range(workers)]
+    for p in processes:
+        p.start()
+
+    frames = {}
+    remaining = {}
+    backends = {}
+    tiles = [0] * workers
+    stolen = [0] * workers
+    running = workers
+    written = 0
+    first_tile = None
+
+    while running:
+        kind, index, payload = results.get()
+        if kind == 'backend':
+            backends[index] = payload
+            continue
+        if kind == 'done':
+            running -= 1
+            continue
+
+        if first_tile is None:
+            # Don't count worker startup (context creation, shader compile) in the throughput
+            first_tile = time.perf_counter()
+
+        frame, first_row, pixels, was_stolen = payload
+        tiles[index] += 1
+        stolen[index] += was_stolen
+
+        if frame not in frames:
+            frames[frame] = np.empty((h, w, 4), dtype=np.uint8)
+            remaining[frame] = options['bands']
+        frames[frame][first_row:first_row + len(pixels)] = pixels
+        remaining[frame] -= 1
+
+        # Write finished frames right away so memory stays bounded
+        if not remaining[frame]:
+            image = frames.pop(frame)
+            del remaining[frame]
+            if out is not None:
+                path = os.path.join(out, 'frame_{:05d}.{}'.format(frame, file_format))
+                imagefile.WRITERS[file_format](path, image)
+            written += 1
+
+    for p in processes:
+        p.join()
+
+    end = time.perf_counter()
+    return {'frames': written,
+            'workers': workers,
+            'backends': sorted(set(backends.values())),
+            'seconds': end - start,
+            'fps': written / (end - (first_tile or start)),
+            'tiles': tiles,
+            'stolen': stolen}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render an image sequence of a setup")
+    parser.add_argument('setup', nargs='?', default='raymarch_setup_mod')
+    parser.add_argument('--start', type=float, default=0.0, help="First iTime")
+    parser.add_argument('--end', type=float, default=2.0, help="Last iTime (exclusive)")
+    parser.add_argument('--fps', type=float, default=30.0, help="Frames per second of animation")
+    parser.add_argument('--mouse', type=lambda s: [float(m) for m in s.split(',')], default=[400.0, 300.0],
+                        help="Fixed mouse position in pixels (x,y)")
+    parser.add_argument('--resolution', type=lambda s: tuple(int(v) for v in s.split('x')), default=(800, 600))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--tile-rows', type=int, default=64, help="Rows per tile (0: whole frames)")
+    parser.add_argument('--backend', choices=['auto', 'gl', 'cpu'], default='auto')
+    parser.add_argument('--platform', choices=['egl', 'osmesa'], default='egl')
+    parser.add_argument('--out', default='frames', help="Output directory")
+    parser.add_argument('--format', choices=sorted(imagefile.WRITERS), default='png')
+    parser.add_argument('--scaling', action='store_true', help="Measure fps for 1, 2, 4... workers (no output)")
+    args = parser.parse_args(argv)
+
+    count = int(round((args.end - args.start) * args.fps))
+    options = {'setup': args.setup,
+               'resolution': args.resolution,
+               'mouse': args.mouse,
+               'times': [args.start + i / args.fps for i in range(count)],
+               'tile_rows': args.tile_rows,
+               'backend': args.backend,
+               'platform': args.platform}
+
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+    # Processes already give the parallelism. Keep llvmpipe from oversubscribing the cores
+    if args.workers > 1 or args.scaling:
+        os.environ.setdefault('LP_NUM_THREADS', '1')
+
+    if args.scaling:
+        counts = [1]
+        while counts[-1] * 2 <= args.workers:
+            counts.append(counts[-1] * 2)
+        if counts[-1] != args.workers:
+            counts.append(args.workers)
+
+        base = None
+        for workers in counts:
+            stats = render_sequence(options, workers)
+            base = base or stats['fps']
+            print("{:3d} workers {:8.2f} fps   speedup {:5.2f}   efficiency {:4.0f}%".format(
+                  workers, stats['fps'], stats['fps'] / base, stats['fps'] / base / workers * 100.0))
+        return
+
+    stats = render_sequence(options, args.workers, args.out, args.format)
+    print("{} frames in {:.2f} s ({:.2f} fps) with {} workers [{}]".format(
+          stats['frames'], stats['seconds'], stats['fps'], stats['workers'], ', '.join(stats['backends'])))
+    for i, (tiles, stolen) in enumerate(zip(stats['tiles'], stats['stolen'])):
+        print("  worker {:2d}: {:5d} tiles ({} stolen)".format(i, tiles, stolen))
+
+
+if __name__ == '__main__':
+    main()
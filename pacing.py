@@ -0,0 +1,295 @@
+# Frame pacing and input latency
+#
+# Replaces the mainloop's clock.tick(8192), which spins a core at 100% and
+# samples the mouse long before the frame gets on screen. Modes:
+#       vsync    -> Swap interval 1. After the last frame was presented sleep
+#                   until just before the next vblank (minus the expected render
+#                   time and a safety margin), then sample the input. The frame
+#                   is drawn right before it is shown, one frame in flight
+#       fixed    -> A fixed frame rate, sleeping until each frame is due
+#                   (no vsync, saves power compared to spinning)
+#       uncapped -> Draw as fast as possible (benchmarking), only the frames
+#                   in flight are capped
+#
+# Every frame gets a GL_TIMESTAMP query before the swap and a fence after it.
+# The timestamp is the GPU clock when the frame was drawn, converted to the CPU
+# clock (calibrated every CALIBRATE_S): input sample to it is the render time,
+# whatever the swap does after (blocking until vblank doesn't count). The fence
+# tells when the swap went through: input sample to that point is the
+# input-to-photon latency as far as the application can see it (scanout comes
+# on top). Fences are only waited on when the frames in flight cap is reached
+# or while sleeping anyway, otherwise they are polled, so the latencies are
+# upper bounds by at most the time between two polls. Timestamps are read once
+# available, never waited for.
+#
+# Usage:
+#       pacer = FramePacer('fixed', rate=30)
+#       while 1:
+#           pacer.wait()
+#           pacer.sample()          (right before reading the inputs)
+#           render(...)
+#           pacer.rendered()
+#           pygame.display.flip()
+#           pacer.presented()
+#       print(pacer.report())
+
+
+from __future__ import division
+import time
+import ctypes as ct
+from collections import deque
+
+from OpenGL.GL import (glFenceSync, glClientWaitSync, glDeleteSync, glGenQueries, glDeleteQueries,
+                       glGetQueryObjectiv, GL_SYNC_GPU_COMMANDS_COMPLETE, GL_SYNC_FLUSH_COMMANDS_BIT,
+                       GL_TIMEOUT_EXPIRED, GL_WAIT_FAILED, GL_TIMESTAMP, GL_QUERY_RESULT, GL_QUERY_RESULT_AVAILABLE)
+# The wrapped versions fail to convert 64 bit results, use the raw ones
+from OpenGL.raw.GL.VERSION.GL_3_2 import glGetInteger64v
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v, glQueryCounter
+
+from profiler import RollingHistogram
+
+
+MODES = ['vsync', 'fixed', 'uncapped']
+
+# glClientWaitSync timeout while a frame has to finish (waited again if it expires)
+BLOCK_NS = 1000000000
+
+# Seconds between two measurements of the GPU clock against the CPU clock (they drift apart)
+CALIBRATE_S = 1.0
+
+# Timestamp queries in flight at most (frames beyond go without a render time)
+QUERIES = 8
+
+
+def display_rate(default=60.0):
+    """
+        return -> Refresh rate of the desktop in Hz ('default' if SDL doesn't know it)
+    """
+    import pygame
+    try:
+        rates = pygame.display.get_desktop_refresh_rates()
+    except (AttributeError, pygame.error):
+        # pygame < 2.2
+        return default
+    return float(rates[0]) if rates and rates[0] > 0 else default
+
+
+class FramePacer(object):
+    def __init__(self, mode='vsync', rate=None, frames_in_flight=2, margin_ms=2.0, history=600):
+        """
+            mode -> 'vsync', 'fixed' or 'uncapped' (see above)
+            rate -> Frames per second of 'fixed' (Default: 60), display refresh rate for
+                    'vsync' (Default: the desktop's, filled in by the Renderer)
+            frames_in_flight -> Frames queued ahead of the GPU at most (always 1 with vsync)
+            margin_ms -> Safety margin of the late input sampling with vsync
+            history -> Frames kept for the statistics
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown pacing mode '{}' (one of {})".format(mode, ', '.join(MODES)))
+        self.mode = mode
+        self.rate = rate if rate is not None or mode != 'fixed' else 60.0
+        self.frames_in_flight = 1 if mode == 'vsync' else max(1, frames_in_flight)
+        self.margin = margin_ms / 1000.0
+
+        # Fences of the frames in flight, oldest first: [fence, input time]
+        self.pending = deque()
+        self.in_flight = 0
+
+        # Timestamp queries of the drawn frames: [query, input time], and the unused ones
+        self.stamps = deque()
+        self.queries = None
+        self._clock = ct.c_int64()
+        self._result = ct.c_uint64()
+
+        # CPU clock (perf_counter seconds) minus GPU clock (seconds), measured when 'calibrated'
+        self.offset = None
+        self.calibrated = None
+
+        # Input time of the current frame, when it was due and when the last one was presented
+        self.input_time = None
+        self.due = None
+        self.last_present = None
+
+        # Milliseconds: input to presented/rendered, input to input
+        self.latency = RollingHistogram(history)
+        self.render = RollingHistogram(history)
+        self.interval = RollingHistogram(history)
+
+        # Seconds spent sleeping or blocked on the GPU since the first frame
+        self.started = None
+        self.waited = 0.0
+        self.frames = 0
+
+    def swap_interval(self):
+        """
+            return -> Swap interval the window should be created with
+        """
+        return 1 if self.mode == 'vsync' else 0
+
+    def _calibrate(self):
+        now = time.perf_counter()
+        if self.calibrated is None or now - self.calibrated >= CALIBRATE_S:
+            glGetInteger64v(GL_TIMESTAMP, ct.byref(self._clock))
+            self.calibrated = time.perf_counter()
+            # The middle of the call is when the GPU clock was read
+            self.offset = (now + self.calibrated) / 2.0 - self._clock.value / 1e9
+
+    def _stamps(self):
+        """
+            Read the render times whose timestamps are back (never waits)
+        """
+        while self.stamps and glGetQueryObjectiv(self.stamps[0][0], GL_QUERY_RESULT_AVAILABLE):
+            query, input_time = self.stamps.popleft()
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ct.byref(self._result))
+            self.queries.append(query)
+            drawn = self._result.value / 1e9 + self.offset
+            self.render.add(max(0.0, drawn - input_time) * 1000.0)
+
+    def _collect(self, deadline=None):
+        """
+            Retire finished fences. Waits for the oldest frames while more than
+            'frames_in_flight - 1' are queued and for the rest until 'deadline'
+            (perf_counter seconds, None: don't wait)
+        """
+        if self.stamps:
+            self._stamps()
+        while self.pending:
+            fence, input_time = self.pending[0]
+            blocking = self.in_flight >= self.frames_in_flight
+            if blocking:
+                timeout = BLOCK_NS
+            elif deadline is None:
+                timeout = 0
+            else:
+                timeout = int(max(0.0, deadline - time.perf_counter()) * 1e9)
+
+            start = time.perf_counter()
+            status = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, timeout)
+            now = time.perf_counter()
+            if timeout:
+                self.waited += now - start
+            if status == GL_WAIT_FAILED:
+                raise RuntimeError("glClientWaitSync failed")
+            if status == GL_TIMEOUT_EXPIRED:
+                if blocking:
+                    continue
+                return
+
+            self.pending.popleft()
+            glDeleteSync(fence)
+            self.latency.add((now - input_time) * 1000.0)
+            self.last_present = now
+            self.in_flight -= 1
+
+        # Frames which went through have their timestamps back too
+        if self.stamps:
+            self._stamps()
+
+    def _sleep(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+            self.waited += remaining
+
+    def wait(self):
+        """
+            Block until the next frame should start (call before handling the inputs)
+        """
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+
+        if self.mode == 'uncapped':
+            self._collect()
+        elif self.mode == 'fixed':
+            period = 1.0 / self.rate
+            if self.due is None or now - self.due > period:
+                # First frame or fell behind, don't try to catch up with a burst
+                self.due = now
+            self._collect(self.due)
+            self._sleep(self.due)
+            self.due += period
+        else:
+            # Wait for the last frame to be presented (the vblank when the swap
+            # is synced), then sleep until the next one's input has to be read
+            self._collect()
+            if self.last_present is not None and self.rate:
+                expected = self.render.stats().get('p90', 0.0) / 1000.0
+                self._sleep(self.last_present + 1.0 / self.rate - expected - self.margin)
+
+    def sample(self):
+        """
+            Mark the time the inputs of this frame are read
+        """
+        now = time.perf_counter()
+        if self.input_time is not None:
+            self.interval.add((now - self.input_time) * 1000.0)
+        self.input_time = now
+
+    def rendered(self):
+        """
+            All the frame's draw calls were issued (call right before the swap)
+        """
+        if self.queries is None:
+            self.queries = [int(q) for q in glGenQueries(QUERIES)]
+        self._calibrate()
+        if self.queries:
+            query = self.queries.pop()
+            glQueryCounter(query, GL_TIMESTAMP)
+            self.stamps.append([query, self.input_time])
+
+    def presented(self):
+        """
+            The frame was swapped (call right after the swap)
+        """
+        self.pending.append([glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0), self.input_time])
+        self.in_flight += 1
+        self.frames += 1
+        # Poll now as well, the sooner a fence is seen done the closer its time is
+        self._collect()
+
+    def skip(self):
+        """
+            Nothing was drawn this frame (idle), its input time doesn't count
+        """
+        self.input_time = None
+
+    def latency_ms(self):
+        """
+            return -> Median input-to-photon latency of the recent frames (None before the first)
+        """
+        return self.latency.stats().get('p50')
+
+    def stats(self):
+        """
+            return -> {'latency'|'render'|'interval': stats (see RollingHistogram.stats),
+                       'frames': presented frames, 'waiting': fraction of the time slept/blocked}
+        """
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        return {'latency': self.latency.stats(),
+                'render': self.render.stats(),
+                'interval': self.interval.stats(),
+                'frames': self.frames,
+                'waiting': self.waited / elapsed if elapsed > 0 else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        rate = " {:.1f} Hz".format(self.rate) if self.mode != 'uncapped' and self.rate else ''
+        lines = ["pacing {}{}, {} frame(s) in flight, {} frames, waiting {:.0%} of the time".format(
+                 self.mode, rate, self.frames_in_flight, stats['frames'], stats['waiting']),
+                 "{:<10} {:>8} {:>8} {:>8} {:>8} {:>8}".format('ms', 'mean', 'p50', 'p90', 'p99', 'max')]
+        for name in ('latency', 'render', 'interval'):
+            s = stats[name]
+            lines.append("{:<10} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+                         name, *["{:.2f}".format(s[p]) if p in s else '-' for p in ('mean', 'p50', 'p90', 'p99', 'max')]))
+        return "\n".join(lines)
+
+    def destroy(self):
+        while self.pending:
+            glDeleteSync(self.pending.popleft()[0])
+        self.in_flight = 0
+        if self.queries is not None:
+            queries = self.queries + [query for query, input_time in self.stamps]
+            glDeleteQueries(len(queries), queries)
+            self.queries = None
+            self.stamps.clear()
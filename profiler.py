@@ -0,0 +1,190 @@
+# Per-pass frame profiler
+#
+# Every section of a frame (each pass, the upscale, the capture readback) is
+# wrapped in its own GL_TIME_ELAPSED query and timed on the CPU side too (the
+# time Python takes to issue the calls). GPU results are only collected once
+# they are available, a section whose queries are all still in flight simply
+# goes untimed that frame, so nothing ever waits for the GPU.
+#
+# The latest samples are kept in rolling windows which can be queried for
+# percentiles/histograms while running or dumped as CSV/JSON.
+#
+# Usage:
+#       profiler = FrameProfiler()
+#       profiler.begin_frame()
+#       profiler.begin('pass0') ... profiler.end('pass0')
+#       profiler.end_frame()
+#       profiler.stats()['pass0']['gpu']['p50']
+
+
+from __future__ import division
+import csv
+import json
+import time
+
+import numpy as np
+
+from gputimer import GpuTimer
+
+
+class RollingHistogram(object):
+    def __init__(self, size=240):
+        """
+            size -> Number of latest samples kept
+        """
+        self.samples = np.zeros(size)
+        self.count = 0              # Samples added in total
+
+    def add(self, value):
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+
+    def values(self):
+        """
+            return -> samples in the window, oldest first
+        """
+        n = len(self.samples)
+        if self.count <= n:
+            return self.samples[:self.count].copy()
+        i = self.count % n
+        return np.concatenate((self.samples[i:], self.samples[:i]))
+
+    def histogram(self, bins=20, range=None):
+        """
+            return -> counts, bin edges (numpy.histogram of the window)
+        """
+        return np.histogram(self.values(), bins, range)
+
+    def stats(self):
+        values = self.values()
+        if not len(values):
+            return {'count': 0}
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {'count': len(values),
+                'last': float(values[-1]),
+                'mean': float(values.mean()),
+                'min': float(values.min()),
+                'max': float(values.max()),
+                'p50': float(p50),
+                'p90': float(p90),
+                'p99': float(p99)}
+
+
+class FrameProfiler(object):
+    def __init__(self, history=240, depth=2):
+        """
+            history -> Samples kept per section
+            depth -> Queries per section in flight (2: double buffered)
+        """
+        self.history = history
+        self.depth = depth
+
+        self.sections = []          # In first seen order
+        self.timers = {}
+        self.gpu = {}
+        self.cpu = {}
+        self.started = {}
+
+        self.frame_start = None
+        self.frames = 0
+
+    def _section(self, name):
+        if name not in self.timers:
+            self.sections.append(name)
+            self.timers[name] = GpuTimer(self.depth)
+            self.gpu[name] = RollingHistogram(self.history)
+            self.cpu[name] = RollingHistogram(self.history)
+        return self.timers[name]
+
+    def begin_frame(self):
+        # Results of earlier frames which are ready by now
+        for name in self.sections:
+            for ms in self.timers[name].poll():
+                self.gpu[name].add(ms)
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if 'frame' not in self.cpu:
+            self.cpu['frame'] = RollingHistogram(self.history)
+        self.cpu['frame'].add((time.perf_counter() - self.frame_start) * 1000.0)
+        self.frames += 1
+
+    def begin(self, name):
+        """
+            Start timing section 'name' (sections can't be nested, only one GL_TIME_ELAPSED query can be active)
+        """
+        self._section(name).begin()
+        self.started[name] = time.perf_counter()
+
+    def end(self, name):
+        self.cpu[name].add((time.perf_counter() - self.started.pop(name)) * 1000.0)
+        self.timers[name].end()
+
+    def add_cpu(self, name, ms):
+        """
+            Record a CPU only measurement (e.g. the buffer swap in the main loop)
+        """
+        if name not in self.cpu:
+            self.cpu[name] = RollingHistogram(self.history)
+        self.cpu[name].add(ms)
+
+    def gpu_frame_ms(self):
+        """
+            return -> sum of the latest GPU times of all sections (None until every section has one)
+        """
+        latest = [self.timers[name].last_ms for name in self.sections]
+        if not latest or None in latest:
+            return None
+        return sum(latest)
+
+    def stats(self):
+        """
+            return -> {section: {'gpu': stats, 'cpu': stats}} (see RollingHistogram.stats)
+        """
+        result = {}
+        for name, histogram in self.cpu.items():
+            result[name] = {'cpu': histogram.stats()}
+            if name in self.gpu:
+                result[name]['gpu'] = self.gpu[name].stats()
+        return result
+
+    def report(self):
+        lines = ["{:<10} {:>10} {:>10} {:>10} {:>10}".format('section', 'gpu p50', 'gpu p99', 'cpu p50', 'cpu p99')]
+        stats = self.stats()
+        for name in self.sections + sorted(set(stats) - set(self.sections)):
+            gpu = stats[name].get('gpu', {})
+            cpu = stats[name]['cpu']
+            lines.append("{:<10} {:>10} {:>10} {:>10} {:>10}".format(
+                         name, *["{:.3f}".format(s[p]) if p in s else '-'
+                                 for s, p in ((gpu, 'p50'), (gpu, 'p99'), (cpu, 'p50'), (cpu, 'p99'))]))
+        return "\n".join(lines)
+
+    def dump_csv(self, path):
+        """
+            Every sample in the windows: section, clock (gpu/cpu), sample index, ms
+        """
+        with open(path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['section', 'clock', 'index', 'ms'])
+            for clock, histograms in (('gpu', self.gpu), ('cpu', self.cpu)):
+                for name, histogram in histograms.items():
+                    for i, ms in enumerate(histogram.values()):
+                        writer.writerow([name, clock, i, '{:.4f}'.format(ms)])
+
+    def dump_json(self, path):
+        """
+            Stats and samples per section
+        """
+        result = self.stats()
+        for clock, histograms in (('gpu', self.gpu), ('cpu', self.cpu)):
+            for name, histogram in histograms.items():
+                result[name][clock]['samples'] = [round(ms, 4) for ms in histogram.values()]
+        with open(path, 'w') as f:
+            json.dump({'frames': self.frames, 'sections': result}, f, indent=2, sort_keys=True)
+
+    def dump(self, path):
+        (self.dump_json if path.endswith('.json') else self.dump_csv)(path)
+
+    def destroy(self):
+        for timer in self.timers.values():
+            timer.destroy()
@@ -0,0 +1,169 @@
+# On-disk cache of linked shader programs (glGetProgramBinary blobs)
+#
+# Driver compilation dominates startup for the raymarch shaders. Linked
+# programs are stored as binaries keyed by a hash of the GLSL sources, defines
+# and the GL renderer/version strings (a driver update changes the key).
+# Entries are evicted least recently used first once the cache grows over
+# its size cap. A binary the driver rejects is removed and the caller simply
+# compiles from source again.
+
+
+from __future__ import division
+import ctypes as ct
+import hashlib
+import os
+import struct
+
+from OpenGL.GL import (glCreateProgram, glDeleteProgram, glProgramBinary, glGetProgramiv, glGetProgramBinary,
+                       glGetString, GL_LINK_STATUS, GL_PROGRAM_BINARY_LENGTH, GL_RENDERER, GL_VENDOR, GL_VERSION,
+                       GL_SHADING_LANGUAGE_VERSION)
+
+
+DEFAULT_DIRECTORY = os.environ.get('GLSL_PYTHON_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'glsl_python', 'programs'))
+
+# Binary format (GLenum) stored in front of the blob
+HEADER = struct.Struct('<I')
+
+
+class ProgramCache(object):
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=64 * 1024 * 1024):
+        """
+            directory -> Where the binaries are stored
+            max_bytes -> Size cap, least recently used entries are removed above this
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # Stats for the current run
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def key(self, sources, defines=()):
+        """
+            Cache key for the program built from 'sources' (in stage order) and 'defines'
+
+            return -> hex digest
+        """
+        digest = hashlib.sha256()
+        for name in (GL_VENDOR, GL_RENDERER, GL_VERSION, GL_SHADING_LANGUAGE_VERSION):
+            digest.update(glGetString(name) or b'')
+            digest.update(b'\0')
+
+        for source in sources:
+            digest.update(source.encode('utf-8'))
+            digest.update(b'\0')
+
+        for define in sorted(defines):
+            digest.update(str(define).encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def load(self, key):
+        """
+            Create program from the cached binary
+
+            return -> linked program or None (miss or the driver rejected the binary)
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+        if len(data) <= HEADER.size:
+            self.discard(key)
+            return None
+
+        binary_format, = HEADER.unpack_from(data)
+        blob = data[HEADER.size:]
+
+        program = glCreateProgram()
+        glProgramBinary(program, binary_format, blob, len(blob))
+
+        # Drivers are allowed to reject binaries at any time (updates, different hardware...)
+        if glGetProgramiv(program, GL_LINK_STATUS) != 1:
+            glDeleteProgram(program)
+            self.discard(key)
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return program
+
+    def store(self, key, program):
+        """
+            Save the binary of a linked 'program'
+            (Link with GL_PROGRAM_BINARY_RETRIEVABLE_HINT set for best results)
+        """
+        length = int(glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH))
+        if length <= 0:
+            return
+
+        blob = ct.create_string_buffer(length)
+        written = ct.c_int()
+        binary_format = ct.c_uint()
+        glGetProgramBinary(program, length, ct.byref(written), ct.byref(binary_format), blob)
+        if written.value <= 0:
+            return
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            # Write to a temporary file first so a crash can't leave half written entries
+            path = self.path(key)
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary, 'wb') as f:
+                f.write(HEADER.pack(binary_format.value))
+                f.write(blob.raw[:written.value])
+            os.replace(temporary, path)
+        except (IOError, OSError):
+            # Read only home, full disk... the cache is only an optimization
+            return
+
+        self.evict()
+
+    def discard(self, key):
+        self.rejected += 1
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+            Remove least recently used entries until the cache fits under max_bytes
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bin'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        while total > self.max_bytes and entries:
+            mtime, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
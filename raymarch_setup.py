@@ -8,16 +8,10 @@
 
 
 from __future__ import division
-import pygame
-from pygame.locals import *
+import functools
 
-from OpenGL.GL import *
-from OpenGL.GL import shaders
-from OpenGL.GLU import *
-
-from sys import exit as exitsystem
-
-from numpy import array
+from renderer import Renderer, run
+from variants import VariantPass
 
 
 VERTEX_SHADER = """
@@ -29,23 +23,129 @@ void main()
 }
 """
 
+# Cone march prepass: one fragment per CONE_TILE x CONE_TILE pixel tile, drawn into the
+# bottom left corner of its (full size) framebuffer, so iResolution stays the full resolution
+PREPASS_VERTEX_SHADER = """
+#version 330 core
+#ifndef CONE_TILE
+#define CONE_TILE 8
+#endif
+layout(location = 0) in vec3 vPos;
+uniform vec2 iResolution;
+void main()
+{
+    vec2 tiles = ceil(iResolution / float(CONE_TILE));
+    gl_Position = vec4((vPos.xy + 1.0) * tiles / iResolution - 1.0, 0.0, 1.0);
+}
+"""
+
 # https://www.iquilezles.org/www/articles/distfunctions/distfunctions.htm
 # https://github.com/PistonDevelopers/shaders/wiki/Some-useful-GLSL-functions
 
+# Template shared with raymarch_setup_mod.py, specialized with the defines below
 FRAGMENT_SHADER = """
 #version 330 core
-#define fragCoord gl_FragCoord.xy
+#ifndef NUMBER_OF_STEPS
+#define NUMBER_OF_STEPS 128
+#endif
+#ifndef MINIMUM_HIT_DISTANCE
+#define MINIMUM_HIT_DISTANCE 0.001
+#endif
+#ifndef MAXIMUM_TRACE_DISTANCE
+#define MAXIMUM_TRACE_DISTANCE 512.0
+#endif
+#ifndef AMBIENT
+#define AMBIENT 0.0
+#endif
+#ifndef DISPLACEMENT
+#define DISPLACEMENT 0
+#endif
+// ACCELERATE: march only inside the bounding sphere, with over-relaxed steps
+#ifndef ACCELERATE
+#define ACCELERATE 0
+#endif
+// Bounding sphere radius (the displacement adds up to 0.2) and step scale, the
+// displaced distance (divided by its Lipschitz bound) fails more over-relaxed steps
+#ifndef BOUND_RADIUS
+#define BOUND_RADIUS (DISPLACEMENT != 0 ? 2.75 : 2.55)
+#endif
+#ifndef RELAXATION
+#define RELAXATION (DISPLACEMENT != 0 ? 1.2 : 1.6)
+#endif
+// STEP_HEATMAP: color by march steps instead of shading, alpha = steps / 255
+#ifndef STEP_HEATMAP
+#define STEP_HEATMAP 0
+#endif
+// CONE_MARCH: rays start at the depth the prepass (CONE_PREPASS) found for their
+// CONE_TILE x CONE_TILE pixel tile, read from iChannel0
+#ifndef CONE_MARCH
+#define CONE_MARCH 0
+#endif
+#ifndef CONE_PREPASS
+#define CONE_PREPASS 0
+#endif
+#ifndef CONE_TILE
+#define CONE_TILE 8
+#endif
+// COMPUTE: compute shader backend (compute.py), a work group per CONE_TILE x CONE_TILE
+// tile, every invocation cone marches its pixel and the rays of the tile start at the
+// smallest depth. PERSISTENT: a fixed number of work groups take the tiles from a queue
+#ifndef COMPUTE
+#define COMPUTE 0
+#endif
+#ifndef PERSISTENT
+#define PERSISTENT 0
+#endif
+#if COMPUTE
+#undef CONE_MARCH
+#define CONE_MARCH 0
+#endif
 uniform vec2  iMouse;
 uniform float iTime;
 uniform vec2  iResolution;
+uniform vec2  iJitter;
+#if CONE_MARCH
+uniform sampler2D iChannel0;
+#endif
+// iJitter: sub pixel offset for accumulated anti-aliasing (zero otherwise)
+#if COMPUTE
+layout(local_size_x = CONE_TILE, local_size_y = CONE_TILE) in;
+layout(rgba8, binding = 0) uniform writeonly image2D iImage;
+#if PERSISTENT
+layout(std430, binding = 0) buffer WorkQueue
+{
+    uint next_tile;
+};
+#endif
+// Bits of the smallest depth of the tile (non-negative floats order like their bits)
+shared uint tile_depth;
+shared uint tile_index;
+vec2 pixel_center;
+#define fragCoord (pixel_center + iJitter)
+#else
+#define fragCoord (gl_FragCoord.xy + iJitter)
 out vec4 fragColor;
+#endif
+int steps = 0;
+// Scene begin (sdf.py puts compiled scenes here)
 float sdSphere(vec3 p, float r)
 {
     return length(p) - r;
 }
 float map_the_world(in vec3 pos)
 {
+#if DISPLACEMENT
+    vec3 frequency = vec3(abs(4.0 * cos(iTime)), abs(4.0 * sin(iTime)), 4.0);
+    float amplitude = 0.1 + abs(0.1 * sin(iTime * 2.0));
+    float displacement = sin(frequency.x * pos.x) *
+                         sin(frequency.y * pos.y) *
+                         sin(frequency.z * pos.z) * amplitude;
+    // Its gradient is at most amplitude * |frequency| long: divided by the Lipschitz bound
+    // the distance never overestimates, no step (relaxed, cone or not) crosses the surface
+    float sphere_0 = (sdSphere(pos, 2.5) + displacement) / (1.0 + amplitude * length(frequency));
+#else
     float sphere_0 = sdSphere(pos, 2.5);
+#endif
     return sphere_0;
 }
 vec3 calculate_normal(in vec3 pos)
@@ -57,17 +157,114 @@ vec3 calculate_normal(in vec3 pos)
     vec3 normal = vec3(gradient_x, gradient_y, gradient_z);
     return normalize(normal);
 }
+// Scene end
+// Ray through the pixel coordinate 'coord' (rd isn't normalized, its z is 1)
+void camera_ray(in vec2 coord, out vec3 ro, out vec3 rd)
+{
+    vec2 uv = coord / iResolution.xy * 2.0 - 1.0;
+    uv.x *= iResolution.x / iResolution.y;
+    vec3 camera_position = vec3(0.0, 0.0, -5.0);
+    ro = camera_position;
+    rd = vec3(uv, 1.0);
+}
+#if CONE_MARCH
+// Where the ray along 'rd' starts: the prepass depth (distance from the camera) of the pixel's tile
+float cone_start(in vec3 rd)
+{
+    // Tiles are in full resolution pixels, this pass may be drawn smaller (dynamic resolution)
+    vec2 pixel = fragCoord / iResolution.xy * vec2(textureSize(iChannel0, 0));
+    return texelFetch(iChannel0, ivec2(pixel) / CONE_TILE, 0).r / length(rd);
+}
+#endif
+#if CONE_PREPASS || COMPUTE
+// Distance from the camera every ray through the pixels between 'low' and
+// 'high' can start at. The rays lie in a cone around the center one, marching
+// the center ray with the distances shrunk by the cone radius keeps the whole
+// cone clear of the surface
+float cone_march(in vec2 low, in vec2 high)
+{
+    vec3 ro, rd, corner_origin, corner_direction;
+    camera_ray(0.5 * (low + high), ro, rd);
+    rd = normalize(rd);
+    float cos_aperture = 1.0;
+    float reach = 0.0;
+    for (int i = 0; i < 4; ++i)
+    {
+        camera_ray(vec2(i % 2 == 0 ? low.x : high.x, i < 2 ? low.y : high.y), corner_origin, corner_direction);
+        cos_aperture = min(cos_aperture, dot(rd, normalize(corner_direction)));
+        reach = max(reach, length(corner_direction));
+    }
+    // Cone radius per distance along the center ray
+    float slope = sqrt(1.0 - cos_aperture * cos_aperture) / cos_aperture;
+    float t = 0.0;
+    for (int i = 0; i < NUMBER_OF_STEPS; ++i)
+    {
+        steps = i + 1;
+        float clearance = map_the_world(ro + t * rd) - t * slope;
+        // Past the trace distance every ray of the tile misses anyway
+        if (clearance < MINIMUM_HIT_DISTANCE || t > MAXIMUM_TRACE_DISTANCE * reach)
+            break;
+        // The unbounding sphere around the center point covers the cone up to the new point
+        t += clearance / (1.0 + slope);
+    }
+    return t;
+}
+#endif
+// Distances along the ray to where it enters and leaves the bounding sphere (y < 0: misses it)
+vec2 intersect_bounds(in vec3 ro, in vec3 rd)
+{
+    float a = dot(rd, rd);
+    float b = dot(ro, rd);
+    float c = dot(ro, ro) - BOUND_RADIUS * BOUND_RADIUS;
+    float h = b * b - a * c;
+    if (h < 0.0)
+        return vec2(-1.0);
+    h = sqrt(h);
+    return vec2(-b - h, -b + h) / a;
+}
 vec3 ray_march(in vec3 ro, in vec3 rd)
 {
     float total_distance_traveled = 0.0;
-    const int NUMBER_OF_STEPS = 128;
-    const float MINIMUM_HIT_DISTANCE = 0.001;
-    const float MAXIMUM_TRACE_DISTANCE = 512.0;
-    const float AMBIENT = 0.0;
+    float maximum_distance = MAXIMUM_TRACE_DISTANCE;
+#if CONE_MARCH
+    total_distance_traveled = cone_start(rd);
+#elif COMPUTE
+    total_distance_traveled = uintBitsToFloat(tile_depth) / length(rd);
+#endif
+#if ACCELERATE
+    vec2 bounds = intersect_bounds(ro, rd);
+    if (bounds.y < 0.0)
+        return vec3(0.0);
+    total_distance_traveled = max(bounds.x, total_distance_traveled);
+    maximum_distance = min(bounds.y, MAXIMUM_TRACE_DISTANCE);
+    // rd isn't normalized, steps are scaled by its length in world space
+    float ray_scale = length(rd);
+    float omega = RELAXATION;
+    float previous_radius = 0.0;
+    float step_length = 0.0;
+#endif
+#if COMPUTE
+    // The whole tile misses, not even one step
+    if (total_distance_traveled > maximum_distance)
+        return vec3(0.0);
+#endif
     for (int i = 0; i < NUMBER_OF_STEPS; ++i)
     {
+        steps = i + 1;
         vec3 current_position = ro + total_distance_traveled * rd;
         float distance_to_closest = map_the_world(current_position);
+#if ACCELERATE
+        // The unbounding spheres of this and the last point don't overlap: the
+        // relaxed step may have skipped the surface. Go back to a plain step
+        // from the last point and stay unrelaxed
+        if (omega > 1.0 && distance_to_closest + previous_radius < step_length * ray_scale)
+        {
+            total_distance_traveled -= step_length - previous_radius;
+            step_length = previous_radius;
+            omega = 1.0;
+            continue;
+        }
+#endif
         if (distance_to_closest < MINIMUM_HIT_DISTANCE) 
         {
             vec3 normal = calculate_normal(current_position);
@@ -76,101 +273,163 @@ vec3 ray_march(in vec3 ro, in vec3 rd)
             float diffuse_intensity = max(AMBIENT, pow(dot(normal, direction_to_light), 16.0));
             return vec3(1.0, 0.0, 0.0) * diffuse_intensity;
         }
-        if (total_distance_traveled > MAXIMUM_TRACE_DISTANCE){
+        if (total_distance_traveled > maximum_distance){
             break;
         }
+#if ACCELERATE
+        previous_radius = distance_to_closest;
+        step_length = omega * distance_to_closest;
+        total_distance_traveled += step_length;
+#else
         total_distance_traveled += distance_to_closest;
+#endif
     }
     return vec3(0.0);
 }
-void main()
+// Blue (few steps) over green to red (NUMBER_OF_STEPS)
+vec3 heat_color(float heat)
 {
-    vec2 uv = fragCoord / iResolution.xy * 2.0 - 1.0;
-    uv.x *= iResolution.x / iResolution.y;
-    vec3 camera_position = vec3(0.0, 0.0, -5.0);
-    vec3 ray_origin = camera_position;
-    vec3 ray_direction = vec3(uv, 1.0);
+    return clamp(vec3(heat * 2.0 - 1.0, 1.0 - abs(heat * 2.0 - 1.0), 1.0 - heat * 2.0), 0.0, 1.0);
+}
+vec4 pixel_color()
+{
+    vec3 ray_origin, ray_direction;
+    camera_ray(fragCoord, ray_origin, ray_direction);
     vec3 result = ray_march(ray_origin, ray_direction);
-    fragColor = vec4(result, 1.0);
+#if STEP_HEATMAP
+    return vec4(heat_color(float(steps) / float(NUMBER_OF_STEPS)), float(steps) / 255.0);
+#else
+    return vec4(result, 1.0);
+#endif
 }
-"""
-
-
-
-class Main(object):
-    def __init__(self):
-        pygame.init()
-        self.resolution = 800, 600  
-        pygame.display.set_mode(self.resolution, DOUBLEBUF | OPENGL)
-        pygame.display.set_caption('PyShadeToy')        
+#if COMPUTE
+void march_tile(in uvec2 tile)
+{
+    if (gl_LocalInvocationIndex == 0u)
+        tile_depth = 0x7F7FFFFFu;      // Largest float
+    memoryBarrierShared();
+    barrier();
 
-        # Shaders
-        self.vertex_shader = shaders.compileShader(VERTEX_SHADER, GL_VERTEX_SHADER)
-        self.fragment_shader = shaders.compileShader(FRAGMENT_SHADER, GL_FRAGMENT_SHADER)
-        self.shader = shaders.compileProgram(self.vertex_shader, self.fragment_shader)
+    // Every invocation cone marches its own pixel (one pixel margin for iJitter),
+    // the smallest depth is safe for every ray of the tile
+    ivec2 pixel = ivec2(tile * uvec2(CONE_TILE) + gl_LocalInvocationID.xy);
+    bool inside = all(lessThan(vec2(pixel), iResolution));
+    if (inside)
+        atomicMin(tile_depth, floatBitsToUint(cone_march(vec2(pixel) - 1.0, vec2(pixel) + 2.0)));
+    memoryBarrierShared();
+    barrier();
 
-        # Uniform variables
-        self.uni_mouse = glGetUniformLocation(self.shader, 'iMouse')
-        self.uni_ticks = glGetUniformLocation(self.shader, 'iTime')
+    if (inside)
+    {
+        pixel_center = vec2(pixel) + 0.5;
+        steps = 0;
+        imageStore(iImage, pixel, pixel_color());
+    }
+}
+void main()
+{
+#if PERSISTENT
+    // Work groups which got tiles with few steps take the next one instead of
+    // idling until the slowest tile of a dispatch is done
+    uvec2 tiles = uvec2(ceil(iResolution / float(CONE_TILE)));
+    while (true)
+    {
+        if (gl_LocalInvocationIndex == 0u)
+            tile_index = atomicAdd(next_tile, 1u);
+        memoryBarrierShared();
+        barrier();
+        uint index = tile_index;
+        if (index >= tiles.x * tiles.y)
+            break;
+        march_tile(uvec2(index % tiles.x, index / tiles.x));
+        // Everyone is done with tile_index and tile_depth
+        barrier();
+    }
+#else
+    march_tile(gl_WorkGroupID.xy);
+#endif
+}
+#else
+void main()
+{
+#if CONE_PREPASS
+    // The fullscreen triangle shrunk to the tiles covers some more
+    if (any(greaterThanEqual(gl_FragCoord.xy, ceil(iResolution / float(CONE_TILE)))))
+        discard;
+    // Start depth of the tile, its march steps in green (kept by 'rg32f' framebuffers only).
+    // One pixel margin for iJitter
+    vec2 low = floor(gl_FragCoord.xy) * float(CONE_TILE) - 1.0;
+    float depth = cone_march(low, low + float(CONE_TILE) + 2.0);
+    fragColor = vec4(depth, float(steps), 0.0, 1.0);
+#else
+    fragColor = pixel_color();
+#endif
+}
+#endif
+"""
 
-        glUseProgram(self.shader)   # Shader program needs to be active if you send uniform variables
-        # Resolution doesn't change. Send it once
-        self.uni_resolution = glGetUniformLocation(self.shader, 'iResolution')
-        glUniform2f(self.uni_resolution, *self.resolution)
-        
-        # Create the fullscreen quad for drawing
-        self.vertices = array([-1.0, -1.0, 0.0,
-                                1.0, -1.0, 0.0,
-                                1.0,  1.0, 0.0,
-                               -1.0,  1.0, 0.0], dtype='float32')
+# Quality tiers (keys 1-3 while running), the ray march gives up sooner on the lower ones
+QUALITY = [('high',   {'NUMBER_OF_STEPS': 128, 'MINIMUM_HIT_DISTANCE': 0.001, 'MAXIMUM_TRACE_DISTANCE': 512.0}),
+           ('medium', {'NUMBER_OF_STEPS': 64,  'MINIMUM_HIT_DISTANCE': 0.003, 'MAXIMUM_TRACE_DISTANCE': 64.0}),
+           ('low',    {'NUMBER_OF_STEPS': 32,  'MINIMUM_HIT_DISTANCE': 0.01,  'MAXIMUM_TRACE_DISTANCE': 16.0})]
 
-        # Generate VAO
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
+# Backends (F1-F4 while running): name, defines picking it
+BACKENDS = [('fragment', {'COMPUTE': 0, 'CONE_MARCH': 0}), ('fragment+cone', {'COMPUTE': 0, 'CONE_MARCH': 1}),
+            ('compute', {'COMPUTE': 1}), ('persistent', {'COMPUTE': 2})]
 
-        # Generate VBO which is stored in the VAO state
-        self.vbo = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, self.vertices, GL_STATIC_DRAW)
 
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+def raymarch_passes(options, defines=None, fragment=FRAGMENT_SHADER, backend=None):
+    """
+        Passes of the ray marcher, with the cone march prepass in front when CONE_MARCH is
+        defined (by the setup or in the renderer options, e.g. --define CONE_MARCH), or the
+        compute shader pass with COMPUTE (1: a work group per tile, 2: persistent work groups)
 
-        self.clock = pygame.time.Clock()
+        options -> Renderer options
+        defines -> Defines of the setup
+        fragment -> Template (e.g. with a scene put in by sdf.insert)
+        backend -> Defines of one of the BACKENDS, over the setup's and the renderer's
 
-    def mainloop(self):
-        while 1:
-            delta = self.clock.tick(8192)
+        return -> list of VariantPasses
+    """
+    defines = dict(defines or {})
+    everything = dict(defines, **options.get('defines') or {})
+    everything.update(backend or {})
+    compute = int(everything.get('COMPUTE', 0))
+    if compute:
+        # Compute shader backend, cone marches the tiles itself
+        from compute import ComputePass, GROUPS
+        return [ComputePass(fragment, QUALITY, defines=defines, groups=GROUPS if compute == 2 else None)]
+    # The renderer's defines go over the setup's, the variants' over both
+    quality = [(name, dict(tier, **backend)) for name, tier in QUALITY] if backend else QUALITY
+    if not int(everything.get('CONE_MARCH', 0)):
+        return [VariantPass(VERTEX_SHADER, fragment, quality, defines=defines)]
 
-            glClearColor(0.0, 0.0, 0.0, 1.0)
-            glClear(GL_COLOR_BUFFER_BIT)
+    # The prepass step counts need a second channel
+    prepass = VariantPass(PREPASS_VERTEX_SHADER, fragment, quality, defines=dict(defines, CONE_PREPASS=1),
+                          offscreen=True, format='rg32f' if int(everything.get('STEP_HEATMAP', 0)) else 'r32f')
+    return [prepass, VariantPass(VERTEX_SHADER, fragment, quality, defines=defines, inputs=[prepass])]
 
-            for event in pygame.event.get():
-                if (event.type == QUIT) or (event.type == KEYUP and event.key == K_ESCAPE):
-                    pygame.quit()
-                    exitsystem()
 
-                elif event.type == MOUSEBUTTONDOWN:
-                    if event.button == 4:
-                        pass
-            
-            glUseProgram(self.shader)
+def raymarch_backends(options, defines=None, fragment=FRAGMENT_SHADER):
+    """
+        options, defines, fragment -> see raymarch_passes()
 
-            # Map mouse coordinates between -1 and 1 range
-            mx, my = pygame.mouse.get_pos()
-            mx = (1.0 / self.resolution[0] * mx) * 2.0 - 1.0
-            my = (1.0 / self.resolution[1] * my) * 2.0 - 1.0
-            
-            glUniform2f(self.uni_mouse, mx, my)
-            glUniform1f(self.uni_ticks, pygame.time.get_ticks() / 1000.0)
+        return -> Renderer alternatives: name of the backend raymarch_passes() picks, the BACKENDS
+    """
+    everything = dict(defines or {}, **options.get('defines') or {})
+    compute = int(everything.get('COMPUTE', 0))
+    current = {0: 'fragment+cone' if int(everything.get('CONE_MARCH', 0)) else 'fragment', 1: 'compute'}
+    return current.get(compute, 'persistent'), [
+           (name, functools.partial(raymarch_passes, options, defines, fragment, backend))
+           for name, backend in BACKENDS]
 
-            # Bind the vao (which stores the VBO with all the vertices)
-            glBindVertexArray(self.vao)
-            glDrawArrays(GL_QUADS, 0, 4)
 
-            pygame.display.set_caption("FPS: {}".format(self.clock.get_fps()))
-            pygame.display.flip()
+class Main(Renderer):
+    def __init__(self, **options):
+        # Light follows the mouse, mapped between -1 and 1 range (unless the caller says otherwise)
+        options.setdefault('normalize_mouse', True)
+        Renderer.__init__(self, raymarch_passes(options), alternatives=raymarch_backends(options), **options)
 
 
 if __name__ == '__main__':
-    Main().mainloop()
+    run(Main)
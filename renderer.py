@@ -0,0 +1,1146 @@
+# Shared renderer used by all the setups
+#
+# A Renderer owns the window (or headless context), the fullscreen geometry and
+# the event loop. It draws a list of Passes in order every frame. A Pass is a
+# shader program drawing a fullscreen triangle (see fullscreen.py) either to the
+# screen or into its own framebuffer texture which later passes can read as input.
+# The window can be resized, the framebuffers come from a pool (see targets.py).
+# Keys 1-9 select the variants of the passes, F1-F9 alternative pass lists (e.g. the
+# ray marcher's fragment and compute backends) a setup gives.
+#
+# Usage:
+#       Renderer([Pass(VERTEX_SHADER, FRAGMENT_SHADER)]).mainloop()
+
+
+from __future__ import division
+import argparse
+import ctypes
+import sys
+import time
+import pygame
+from pygame.locals import *
+
+import fastgl               # PyOpenGL's checks ($GLSL_PYTHON_GL), has to come before OpenGL.GL
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+from sys import exit as exitsystem
+
+from numpy import array
+
+from glstate import GLState, Throttle
+from program_cache import ProgramCache
+from gputimer import GpuTimer
+from adaptive import DynamicResolution, frame_clock
+from capture import FrameCapture, open_sink
+from hotreload import ShaderWatcher, watch_passes
+from profiler import FrameProfiler
+from pacing import FramePacer, display_rate, MODES as PACING_MODES
+from targets import TargetPool, FORMATS
+from uniforms import UniformBlock, rewrite, used
+import fullscreen
+
+
+# Fullscreen quad: vec3 position + vec2 texture coordinates (geometry='quad')
+QUAD = array([-1.0, -1.0, 0.0,  0.0, 0.0,
+               1.0, -1.0, 0.0,  1.0, 0.0,
+               1.0,  1.0, 0.0,  1.0, 1.0,
+              -1.0,  1.0, 0.0,  0.0, 1.0], dtype='float32')
+
+
+# Event polling interval while nothing changes (idle modes)
+IDLE_WAIT_MS = 30
+
+# Seconds a status line (e.g. a shader reload) stays in the caption
+STATUS_SECONDS = 3.0
+
+# Pass attribute -> shader type
+SHADER_TYPES = {'vertex': GL_VERTEX_SHADER, 'fragment': GL_FRAGMENT_SHADER}
+
+
+def link_stages(stages):
+    """
+        Link compiled shader stages into a program, the stages stay attached
+
+        return -> shader program
+    """
+    program = glCreateProgram()
+    for shader in stages:
+        glAttachShader(program, shader)
+
+    # Let the driver know we will ask for the binary (program cache)
+    glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+    glLinkProgram(program)
+
+    if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+        log = glGetProgramInfoLog(program)
+        glDeleteProgram(program)
+        raise RuntimeError("Link failure: {}".format(log))
+
+    return program
+
+
+def link_program(*stages):
+    """
+        Link compiled shader stages into a program
+
+        return -> shader program
+    """
+    program = link_stages(stages)
+
+    # The program keeps the compiled code, stages are not needed anymore
+    for shader in stages:
+        glDetachShader(program, shader)
+        glDeleteShader(shader)
+
+    return program
+
+
+def compile_program(vertex, fragment, cache=None):
+    """
+        Compile and link the vertex and fragment shader sources
+
+        cache -> ProgramCache to load the program binary from (and store it to on a miss)
+
+        return -> shader program
+    """
+    if cache is not None:
+        key = cache.key([vertex, fragment])
+        program = cache.load(key)
+        if program is not None:
+            return program
+
+    vertex_shader = shaders.compileShader(vertex, GL_VERTEX_SHADER)
+    fragment_shader = shaders.compileShader(fragment, GL_FRAGMENT_SHADER)
+    program = link_program(vertex_shader, fragment_shader)
+
+    if cache is not None:
+        cache.store(key, program)
+
+    return program
+
+
+class Pass(object):
+    def __init__(self, vertex, fragment, offscreen=False, inputs=(), format='rgb8', feedback=False, tiles=(1, 1)):
+        """
+            vertex, fragment -> GLSL sources
+            offscreen -> Render into a framebuffer texture instead of the screen
+            inputs -> Passes whose textures are bound to texture units 0..n
+                      (available as iChannel0..n, or any sampler2D for unit 0)
+            format -> Framebuffer texture format (see FORMATS), float formats for simulations
+            feedback -> Read its own previous frame (last iChannel unless the pass is in 'inputs' already)
+            tiles -> Columns, rows of copies drawn side by side in one instanced call (texcoords 0..1 in each)
+        """
+        self.vertex = vertex
+        self.fragment = fragment
+        self.offscreen = offscreen or feedback
+        self.inputs = list(inputs)
+        self.format = format
+
+        # Two framebuffers swapped every frame: one is drawn while the other (previous frame) is read
+        self.feedback = feedback
+        if feedback and self not in self.inputs:
+            self.inputs.append(self)
+        self.pair = None
+        self.current = 0
+
+        self.program = None
+        self.frame = None
+        self.texture = None
+
+        # Compiled stages kept around after a hot reload (only changed stages get recompiled)
+        self.shaders = {}
+
+        # Size rendered at (Smaller than the framebuffer with dynamic resolution)
+        self.size = None
+        self.uploaded_size = None
+
+        # Shared uniform block (UniformBlock) and the record of it this pass reads
+        self.block = None
+        self.record = None
+
+        # Renderer's fullscreen geometry and the draw call for it
+        self.tiles = tuple(tiles)
+        self.viewports = False      # Instance i draws into viewport i (multiview.py)
+        self.geometry = None
+        self.vertices = None
+
+        # Sources being compiled by the renderer's CompileScheduler (None: program is ready)
+        self.scheduler = None
+        self.job = None
+
+        # Hot reload compiling there: sources by stage and the (vertex, fragment) as compiled
+        self.reloading = None
+
+    def prepare(self, source, stage='fragment'):
+        """
+            return -> 'source' of 'stage' as compiled (per frame uniforms moved into the uniform block,
+                      vertex attributes computed without a vertex buffer)
+        """
+        if self.block is not None:
+            source = rewrite(source)
+        if stage == 'vertex' and (self.geometry == 'triangle' or self.tiles != (1, 1) or self.viewports):
+            source = fullscreen.rewrite(source, self.tiles, self.viewports)
+        return source
+
+    def compile(self, renderer):
+        """
+            Compile the program now, or submit it to the renderer's scheduler (see ready())
+        """
+        vertex, fragment = self.prepare(self.vertex, 'vertex'), self.prepare(self.fragment)
+        self.scheduler = renderer.scheduler
+        if self.scheduler is None:
+            self.set_program(compile_program(vertex, fragment, renderer.program_cache))
+        else:
+            self.scheduler.request(vertex, fragment)
+            self.job = vertex, fragment
+
+    def ready(self):
+        """
+            return -> True once the program is linked (doesn't block)
+
+            Raises RuntimeError if it failed to compile or link
+        """
+        if self.job is None:
+            return True
+        program = self.scheduler.result(*self.job)
+        if program is None:
+            return False
+        self.job = None
+        self.set_program(program)
+        return True
+
+    def build(self, renderer):
+        self.block = renderer.uniforms
+        self.geometry = renderer.geometry
+        self.vertices = fullscreen.vertices(self.geometry, self.tiles)
+        self.compile(renderer)
+        self.size = renderer.resolution
+
+        if self.feedback:
+            self.pair = [renderer.genFrameBuffer(self.format), renderer.genFrameBuffer(self.format)]
+            self.frame, self.texture = self.pair[self.current]
+        elif self.offscreen:
+            self.frame, self.texture = renderer.genFrameBuffer(self.format)
+        else:
+            self.frame = renderer.screen
+
+    def resize(self, renderer):
+        """
+            Follow a change of renderer.resolution, the framebuffers are swapped for ones of the new size
+        """
+        self.size = renderer.resolution
+        if self.feedback:
+            # The previous frame carries over (stretched), simulations go on
+            self.pair = [renderer.targets.resize(target, self.size, keep=i == self.current)
+                         for i, target in enumerate(self.pair)]
+            self.frame, self.texture = self.pair[self.current]
+        elif self.offscreen:
+            self.frame, self.texture = renderer.targets.resize((self.frame, self.texture), self.size)
+
+    def set_program(self, program):
+        self.program = program
+
+        # Get the uniform locations (-1 if the shader doesn't use them)
+        self.uni_mouse = glGetUniformLocation(self.program, 'iMouse')
+        self.uni_ticks = glGetUniformLocation(self.program, 'iTime')
+        self.uni_resolution = glGetUniformLocation(self.program, 'iResolution')
+        self.uni_jitter = glGetUniformLocation(self.program, 'iJitter')
+        self.uploaded_size = None
+
+        # Which per frame uniforms the pass depends on (block members have no location)
+        self.in_block = self.block is not None and self.block.attach(self.program)
+        if self.in_block:
+            self.uses = self.block_uses()
+        else:
+            self.uses = set(name for name, location in (('iMouse', self.uni_mouse), ('iTime', self.uni_ticks),
+                                                        ('iResolution', self.uni_resolution),
+                                                        ('iJitter', self.uni_jitter)) if location != -1)
+
+        glUseProgram(self.program)   # Need to be enabled before sending uniform variables
+
+        for unit in range(len(self.inputs)):
+            glUniform1i(glGetUniformLocation(self.program, 'iChannel{}'.format(unit)), unit)
+
+    def block_uses(self):
+        """
+            return -> names of the uniform block fields the sources refer to
+        """
+        return used(self.prepare(self.vertex, 'vertex')) | used(self.prepare(self.fragment))
+
+    def reload(self, stage, source):
+        """
+            Recompile the 'stage' ('vertex' or 'fragment') from 'source' and swap the program.
+            With the renderer's CompileScheduler the current program keeps drawing until the
+            new one is linked (see reloaded())
+
+            Raises RuntimeError and keeps the current program if it fails to compile or link
+        """
+        if self.scheduler is not None:
+            # On top of a reload still compiling (both stages changed at once)
+            sources = dict(self.reloading[0]) if self.reloading is not None else \
+                {'vertex': self.vertex, 'fragment': self.fragment}
+            sources[stage] = source
+            job = self.prepare(sources['vertex'], 'vertex'), self.prepare(sources['fragment'])
+            self.scheduler.request(*job)
+            self.reloading = sources, job
+            return
+
+        shader = shaders.compileShader(self.prepare(source, stage), SHADER_TYPES[stage])
+
+        # The other stage is compiled once, then reused on every reload
+        stages = dict(self.shaders)
+        stages[stage] = shader
+        for other in SHADER_TYPES:
+            if other not in stages:
+                stages[other] = self.shaders[other] = shaders.compileShader(self.prepare(getattr(self, other), other),
+                                                                           SHADER_TYPES[other])
+        try:
+            program = link_stages(stages.values())
+        except RuntimeError:
+            glDeleteShader(shader)
+            raise
+
+        if stage in self.shaders:
+            glDeleteShader(self.shaders[stage])
+        self.shaders[stage] = shader
+        setattr(self, stage, source)
+        self.replace(program)
+
+    def reloaded(self):
+        """
+            Swap in the program of the reload compiling if it is linked (doesn't block)
+
+            return -> True once no reload is compiling any more
+
+            Raises RuntimeError and keeps the current program if it failed to compile or link
+        """
+        if self.reloading is None:
+            return True
+        sources, job = self.reloading
+        try:
+            program = self.scheduler.result(*job)
+        except RuntimeError:
+            self.reloading = None
+            raise
+        if program is None:
+            return False
+        self.reloading = None
+
+        for stage, source in sources.items():
+            if source != getattr(self, stage):
+                # Stages kept for the synchronous reload are of the old source
+                if stage in self.shaders:
+                    glDeleteShader(self.shaders.pop(stage))
+                setattr(self, stage, source)
+        self.replace(program)
+        return True
+
+    def replace(self, program):
+        """
+            Delete the current program and draw with 'program' instead
+        """
+        if self.scheduler is not None:
+            # Its sources may come back (undo), they have to be compiled again
+            self.scheduler.forget(self.program)
+        glDeleteProgram(self.program)
+        self.set_program(program)
+
+    def draw(self, renderer, mouse, ticks):
+        state = renderer.state
+
+        if self.feedback:
+            # Draw into the other one, self.texture (read as input) still is the previous frame
+            self.frame = self.pair[1 - self.current][0]
+
+        state.bind_framebuffer(self.frame)
+        state.clear_color(0.0, 0.0, 0.0, 1.0)
+        state.clear(GL_COLOR_BUFFER_BIT)
+
+        state.viewport(0, 0, *self.size)
+        self.bind(renderer, mouse, ticks)
+
+        # Bind the vao (empty, or the quad's VBO with geometry='quad')
+        state.bind_vertex_array(renderer.vao)
+        mode, count, instances = self.vertices
+        if instances > 1:
+            state.draw_arrays_instanced(mode, 0, count, instances)
+        else:
+            state.draw_arrays(mode, 0, count)
+
+        if self.feedback:
+            # Swap, no copy: what was just drawn is the output and next frame's input
+            self.current = 1 - self.current
+            self.frame, self.texture = self.pair[self.current]
+
+    def bind(self, renderer, mouse, ticks):
+        """
+            Use the program with this frame's uniforms and the input textures
+        """
+        state = renderer.state
+        state.use_program(self.program)
+
+        # Per frame uniforms are in the buffer already, select the record of this size
+        if self.in_block:
+            self.block.bind(state, self.record)
+
+        # Resolution only changes with dynamic resolution. Send it when it does
+        if self.uni_resolution != -1 and self.size != self.uploaded_size:
+            state.uniform2f(self.uni_resolution, *self.size)
+            self.uploaded_size = self.size
+
+        # Bind the textures rendered by the previous passes
+        for unit, source in enumerate(self.inputs):
+            state.bind_texture(source.texture, unit)
+
+        # Send uniform values
+        if self.uni_mouse != -1:
+            state.uniform2f(self.uni_mouse, *mouse)
+        if self.uni_ticks != -1:
+            state.uniform1f(self.uni_ticks, ticks)
+        if self.uni_jitter != -1:
+            state.uniform2f(self.uni_jitter, *renderer.jitter)
+
+
+class Renderer(object):
+    def __init__(self, passes, resolution=(800, 600), headless=False, normalize_mouse=False,
+                 program_cache=None, dynamic_resolution=None, capture=None, shader_dir=None, profiler=None,
+                 idle=None, max_samples=64, uniform_block=True, geometry='triangle', async_compile=None,
+                 defines=None, pacing=None, resizable=True, targets=None, alternatives=None):
+        """
+            passes -> Passes drawn in order every frame
+            resolution -> Window (or offscreen framebuffer) size
+            headless -> Draw into an offscreen framebuffer, no display needed
+            normalize_mouse -> Send iMouse in -1..1 range instead of pixels
+            program_cache -> ProgramCache for linked programs (Default: ~/.cache/glsl_python, False: disabled)
+            dynamic_resolution -> DynamicResolution which scales the last pass to hold a GPU frame time
+            capture -> Sink (or open_sink() spec) every finished frame is streamed to
+            shader_dir -> Load the shaders from .glsl files in this directory and reload them on change
+            profiler -> FrameProfiler timing every pass (GPU and CPU)
+            idle -> While the inputs don't change: None (draw anyway), 'pause' (keep the last frame)
+                    or 'accumulate' (average 'max_samples' jittered frames, then keep it)
+            uniform_block -> Per frame uniforms in a uniform buffer shared by the passes (else glUniform per pass)
+            geometry -> 'triangle': attribute-less fullscreen triangle in a core profile context,
+                        'quad': GL_QUADS from a vertex buffer (compatibility profile)
+            async_compile -> Compile the passes without waiting, showing a placeholder until they are ready
+                             (Default: in a window, not headless)
+            defines -> Extra #defines for every VariantPass, e.g. {'ACCELERATE': 1} for the raymarch setups
+            pacing -> FramePacer of the mainloop (Default: vsync with late input sampling)
+            resizable -> The window can be resized (not with capture, the frames keep their size)
+            targets -> TargetPool the framebuffers come from (Default: 0.25 s resize settle time)
+            alternatives -> Name of 'passes' and a list of (name, function returning passes): pass lists
+                            F1-F9 switch to while running (see select_alternative())
+        """
+        self.resolution = tuple(resolution)
+        self.window = self.resolution       # Render size follows once it held still (see resize())
+        self.resized = None
+        self.normalize_mouse = normalize_mouse
+        if geometry not in fullscreen.GEOMETRIES:
+            raise ValueError("Unknown geometry '{}' (one of {})".format(geometry, ', '.join(fullscreen.GEOMETRIES)))
+        self.geometry = geometry
+        self.pacing = pacing if pacing is not None else FramePacer()
+        if headless:
+            # No display available. Draw into an offscreen framebuffer instead
+            from headless import HeadlessContext
+            self.context = HeadlessContext(self.resolution, core=geometry == 'triangle')
+            self.screen = self.context.frame
+        else:
+            pygame.init()
+            if geometry == 'triangle':
+                # Nothing deprecated is used without GL_QUADS
+                pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MAJOR_VERSION, 3)
+                pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 3)
+                pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_CORE)
+            flags = DOUBLEBUF | OPENGL | (RESIZABLE if resizable and capture is None else 0)
+            try:
+                pygame.display.set_mode(self.resolution, flags, vsync=self.pacing.swap_interval())
+            except pygame.error as error:
+                # No swap control, the pacer still holds the display's rate (just not in sync with it)
+                sys.stderr.write("vsync not available ({}), pacing without it\n".format(error))
+                pygame.display.set_mode(self.resolution, flags)
+            if self.pacing.rate is None:
+                self.pacing.rate = display_rate()
+            pygame.display.set_caption('PyShadeToy')
+            self.screen = 0     # Default framebuffer
+
+        # Per frame calls straight to the function pointers now that there is a context
+        fastgl.resolve()
+
+        self.targets = targets if targets is not None else TargetPool()
+        self.targets.screen = self.screen
+
+        if program_cache is None:
+            program_cache = ProgramCache()
+        self.program_cache = program_cache or None
+
+        if geometry == 'quad':
+            self.vao, self.vbo = self.genQuad()
+        else:
+            # Core profiles still need a vao bound to draw, an empty one is enough
+            self.vao, self.vbo = glGenVertexArrays(1), None
+        self.uniforms = UniformBlock() if uniform_block else None
+
+        # Compiles shader variants (created by the first VariantPass). Defaults
+        # which depend on the context come first, the option overrides them
+        self.compiler = None
+        self.defines = self.context_defines()
+        self.defines.update(defines or {})
+
+        # Programs of the passes compiled without waiting (variants go through it too)
+        self.scheduler = None
+        self.placeholder = None
+        if async_compile is None:
+            async_compile = not headless
+        if async_compile:
+            from scheduler import CompileScheduler, parallel_extension, PLACEHOLDER_VERTEX_SHADER, \
+                PLACEHOLDER_FRAGMENT_SHADER
+
+            # Drawn until they are ready, compiled right away (it is tiny)
+            self.placeholder = Pass(PLACEHOLDER_VERTEX_SHADER, PLACEHOLDER_FRAGMENT_SHADER)
+            self.placeholder.build(self)
+
+            # The worker thread fallback needs a shared context
+            context = self.share_context() if parallel_extension() is None else None
+            self.scheduler = self.compiler = CompileScheduler(context, self.program_cache)
+
+        self.passes = list(passes)
+
+        # With dynamic resolution the last pass renders into a framebuffer at a
+        # scaled size and gets stretched over the screen
+        self.dynamic_resolution = dynamic_resolution
+        if dynamic_resolution is not None:
+            self.passes[-1].offscreen = True
+            if dynamic_resolution.clock is None:
+                dynamic_resolution.clock = frame_clock()
+            self.frame_timer = GpuTimer() if dynamic_resolution.clock == 'gpu' else None
+
+        # Sources come from the files, edits get picked up between frames. Reloads
+        # compiling: pass -> file, start time
+        self.watcher = None
+        self.reloads = {}
+
+        # Line shown in the caption for STATUS_SECONDS: text, perf_counter time
+        self.status = None
+        if shader_dir is not None:
+            self.watcher = ShaderWatcher()
+            watch_passes(self.watcher, self.passes, shader_dir)
+
+        # Inputs of the last drawn frame and how many samples of them have been drawn
+        self.idle = idle
+        self.max_samples = max_samples if idle == 'accumulate' else 1
+        self.last_inputs = None
+        self.samples = 0
+        self.jitter = (0.0, 0.0)
+
+        # Accumulation averages the last pass (rendered offscreen) and copies the result to the screen
+        self.accumulator = None
+        if idle == 'accumulate':
+            if dynamic_resolution is not None:
+                raise ValueError("Accumulation and dynamic resolution can't be used together")
+            from accumulate import AccumulatePass
+            self.passes[-1].offscreen = True
+            self.accumulator = AccumulatePass(self.passes[-1])
+            self.passes.append(self.accumulator)
+
+        for p in self.passes:
+            p.build(self)
+        self.loading = self.scheduler is not None
+
+        # Pass lists F1-F9 switch between: name -> passes and the resolution they were drawn at last,
+        # the variant picked with keys 1-9 and the passes waiting for their programs to be drawn
+        self.alternative = None
+        self.alternatives = []
+        self.built = {}
+        if alternatives is not None:
+            self.alternative, self.alternatives = alternatives[0], list(alternatives[1])
+            self.built[self.alternative] = self.passes, self.resolution
+        self.variant_index = None
+        self.switching = None
+
+        self.clock = pygame.time.Clock()
+
+        # Profiler sections, one per pass
+        self.profiler = profiler
+        self.sections = [getattr(p, 'name', 'pass{}'.format(i)) for i, p in enumerate(self.passes)]
+
+        # All the per frame GL calls go through this (counts them, skips redundant ones in lean mode)
+        self.state = GLState()
+
+        # Frames are read back asynchronously and written on a separate thread
+        if isinstance(capture, str):
+            capture = open_sink(capture, self.resolution)
+        self.capture = FrameCapture(self.resolution, capture) if capture is not None else None
+
+    def context_defines(self):
+        """
+            return -> default #defines of the VariantPasses picked for the current context
+                      (called once it exists, before the passes are built)
+        """
+        return {}
+
+    def variant_compiler(self):
+        """
+            return -> VariantCompiler shared by the passes (on a worker thread if the context can be shared)
+        """
+        if self.compiler is None:
+            from variants import VariantCompiler
+            self.compiler = VariantCompiler(self.share_context(), self.program_cache)
+        return self.compiler
+
+    def share_context(self):
+        """
+            return -> context sharing programs with the renderer's for a worker thread, None if there can't be one
+        """
+        if hasattr(self, 'context'):
+            return self.context.share()
+        from sdlcontext import WindowSharedContext
+        try:
+            return WindowSharedContext()
+        except RuntimeError as error:
+            # Everything still works, compiling blocks the render thread
+            sys.stderr.write("No shared GL context, compiling on the render thread: {}\n".format(error))
+            return None
+
+    def select_variant(self, index, passes=None):
+        """
+            Switch every VariantPass to its variant number 'index' (if it has that many)
+
+            passes -> Passes to switch (Default: the ones drawn)
+        """
+        self.variant_index = index
+        for p in self.passes if passes is None else passes:
+            names = p.names() if hasattr(p, 'names') else []
+            if index < len(names):
+                p.select(names[index])
+
+    def select_alternative(self, index):
+        """
+            Switch to the pass list number 'index' of 'alternatives' (if there are that many). It is
+            built the first time, the current passes are drawn until its programs are linked
+        """
+        if index >= len(self.alternatives):
+            return
+        name, make = self.alternatives[index]
+        if name == self.alternative:
+            # Stays, a switch still compiling is dropped
+            self.switching = None
+            return
+        if self.accumulator is not None or self.watcher is not None:
+            # The accumulator holds the last pass, the shader files are numbered by pass
+            self.set_status("Can't switch to {} with accumulation or shader files".format(name))
+            return
+
+        if name in self.built:
+            passes, resolution = self.built[name]
+            if resolution != self.resolution:
+                for p in passes:
+                    p.resize(self)
+            if self.variant_index is not None:
+                self.select_variant(self.variant_index, passes)
+        else:
+            try:
+                passes = make()
+                if self.dynamic_resolution is not None:
+                    passes[-1].offscreen = True
+                # Before the build: only the variant picked with keys 1-9 gets compiled
+                if self.variant_index is not None:
+                    self.select_variant(self.variant_index, passes)
+                for p in passes:
+                    p.build(self)
+            except RuntimeError as error:
+                # E.g. compute shaders on a GL 3.3 context
+                sys.stderr.write("{}: {}\n".format(name, error))
+                self.set_status("{} failed".format(name))
+                return
+            self.built[name] = passes, self.resolution
+        self.switching = name, passes
+        self.set_status("Switching to {}".format(name))
+
+    def switch(self):
+        """
+            Draw the passes select_alternative() switches to once their programs are ready
+        """
+        name, passes = self.switching
+        if not all([p.ready() for p in passes]):
+            return
+        self.built[self.alternative] = self.passes, self.resolution
+        self.alternative, self.passes = name, passes
+        self.switching = None
+        self.sections = [getattr(p, 'name', 'pass{}'.format(i)) for i, p in enumerate(self.passes)]
+        self.last_inputs = None
+        # Programs were set outside of GLState
+        self.state.invalidate()
+        self.set_status(name)
+
+    def genQuad(self):
+        """
+            Generate the fullscreen quad shared by all passes
+
+            return -> vao and vbo
+        """
+        # Generate VAO
+        vao = glGenVertexArrays(1)
+        glBindVertexArray(vao)
+
+        # Generate VBO which is stored in the VAO state
+        vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glBufferData(GL_ARRAY_BUFFER, QUAD, GL_STATIC_DRAW)
+
+        # Note: offsets are calculated with float assumed to be 4 bytes long and stride consist of
+        # stride = vec3 position + vec2 texture coordinates
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 4 * 5, None)
+
+        glEnableVertexAttribArray(1)
+        # The last is the offset which tells the OpenGL where the texture coordinates begin
+        # from the stride
+        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 4 * 5, ctypes.c_void_p(4 * 3))
+
+        return vao, vbo
+
+    def genFrameBuffer(self, format='rgb8', size=None):
+        """
+            Get a framebuffer with a color texture attached from the pool
+
+            format -> Texture format (see FORMATS)
+            size -> (width, height) (Default: the render size)
+
+            return -> complete framebuffer and texture
+        """
+        return self.targets.acquire(size or self.resolution, format)
+
+    def resize(self, resolution, immediate=False):
+        """
+            The window (or the headless framebuffer) changed size. The render size
+            and the offscreen framebuffers follow once it held still for the pool's
+            settle time, until then frames are drawn at the old size and stretched
+
+            immediate -> Follow right away (programmatic resizes, no drag going on)
+        """
+        resolution = tuple(resolution)
+        if self.capture is not None:
+            raise ValueError("Captured frames keep their size, the renderer can't be resized")
+        if resolution != self.window and hasattr(self, 'context'):
+            self.context.resize(resolution)
+        self.window = resolution
+        self.resized = time.perf_counter()
+
+        # Draw even if nothing else changed (idle modes)
+        self.last_inputs = None
+        if immediate or self.targets.settle <= 0:
+            self.settle()
+
+    def settle(self):
+        """
+            Switch the render size to the window size: every pass follows, the uniforms get the new iResolution
+        """
+        self.resized = None
+        if self.window == self.resolution:
+            return
+        self.resolution = self.window
+        for p in self.passes:
+            p.resize(self)
+        if self.placeholder is not None:
+            self.placeholder.resize(self)
+        if self.uniforms is not None:
+            # Records of sizes nobody renders at anymore get reused
+            self.uniforms.retain([p.size for p in self.passes])
+        self.last_inputs = None
+        self.state.invalidate()
+
+    def redirect(self, frame):
+        """
+            Point whatever draws to the screen at 'frame' instead
+
+            return -> the screen framebuffer before
+        """
+        previous = self.screen
+        for p in self.passes:
+            if p.frame == previous:
+                p.frame = frame
+        self.screen = frame
+        return previous
+
+    def map_mouse(self, mouse, size=None):
+        """
+            Convert the mouse position (pixels) to what the shaders expect
+
+            size -> Size of what the position is in (Default: the window)
+        """
+        if not self.normalize_mouse:
+            return mouse
+
+        # Map mouse coordinates between -1 and 1 range
+        w, h = size or self.resolution
+        mx, my = mouse
+        mx = (1.0 / w * mx) * 2.0 - 1.0
+        my = (1.0 / h * my) * 2.0 - 1.0
+        return mx, my
+
+    def render(self, mouse, ticks):
+        """
+            Draw a single frame
+
+            mouse -> mouse position in pixels
+            ticks -> time in seconds
+
+            return -> False if nothing was drawn (idle)
+        """
+        self.state.begin_frame()
+
+        if self.resized is not None and time.perf_counter() - self.resized >= self.targets.settle:
+            self.settle()
+
+        if self.loading and not self.load():
+            self.placeholder.draw(self, mouse, ticks)
+            return True
+        if self.switching is not None:
+            self.switch()
+
+        # The window is being resized: draw at the render size and stretch it over the window
+        stretch = None
+        if self.window != self.resolution:
+            stretch = self.targets.acquire(self.resolution, 'rgba8')
+            window = self.redirect(stretch[0])
+            mouse = (mouse[0] * self.resolution[0] / self.window[0], mouse[1] * self.resolution[1] / self.window[1])
+        drawn = False
+        try:
+            drawn = self.draw_frame(mouse, ticks)
+        finally:
+            if stretch is not None:
+                self.redirect(window)
+                if drawn:
+                    w, h = self.resolution
+                    self.state.blit(stretch[0], window, (0, 0, w, h), (0, 0) + self.window, GL_LINEAR)
+                self.targets.release(stretch)
+        return drawn
+
+    def draw_frame(self, mouse, ticks):
+        """
+            Draw the passes at the render size (see render())
+        """
+        reloaded = self.watcher is not None and self.reload_shaders()
+        if self.idle is not None and self.idle_frame(mouse, ticks, reloaded):
+            return False
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_frame()
+
+        # Timer queries can't be nested. The profiler times every section, the
+        # frame timer is only needed without it
+        scaler = self.dynamic_resolution
+        finish = scaler is not None and scaler.clock == 'finish'
+        if scaler is not None:
+            if finish:
+                # Software rasterizer: nothing else may be in flight while the passes are timed
+                glFinish()
+                passes_start = time.perf_counter()
+            elif profiler is None:
+                # Only new results, a frame whose query isn't back yet doesn't count twice
+                for gpu_ms in self.frame_timer.poll():
+                    scaler.update(gpu_ms)
+            else:
+                gpu_ms = profiler.gpu_frame_ms()
+                if gpu_ms is not None:
+                    scaler.update(gpu_ms)
+
+            self.passes[-1].size = scaler.size(self.resolution)
+            if self.frame_timer is not None and profiler is None:
+                self.frame_timer.begin()
+
+        mouse = self.map_mouse(mouse)
+
+        uniforms = self.uniforms
+        if uniforms is not None:
+            # Only what changed gets uploaded, in one go for all the passes
+            uniforms.set('iMouse', mouse)
+            uniforms.set('iTime', ticks)
+            uniforms.set('iJitter', self.jitter)
+            for p in self.passes:
+                p.record = uniforms.record(p.size)
+            uniforms.upload(self.state)
+
+        for name, p in zip(self.sections, self.passes):
+            if profiler is not None:
+                profiler.begin(name)
+            p.draw(self, mouse, ticks)
+            if profiler is not None:
+                profiler.end(name)
+
+        if self.accumulator is not None:
+            w, h = self.resolution
+            self.state.blit(self.accumulator.frame, self.screen, (0, 0, w, h), (0, 0, w, h), GL_NEAREST)
+
+        if scaler is not None:
+            if profiler is not None:
+                profiler.begin('upscale')
+            self.upscale(self.passes[-1])
+            if profiler is not None:
+                profiler.end('upscale')
+            elif self.frame_timer is not None:
+                self.frame_timer.end()
+            if finish:
+                glFinish()
+                scaler.update((time.perf_counter() - passes_start) * 1000.0)
+
+        if self.capture is not None:
+            if profiler is not None:
+                profiler.begin('capture')
+            self.state.bind_read_framebuffer(self.screen)
+            self.capture.capture()
+            if profiler is not None:
+                profiler.end('capture')
+
+        if profiler is not None:
+            profiler.end_frame()
+        return True
+
+    def load(self):
+        """
+            Pick up the programs compiled so far
+
+            return -> True once every pass has its program
+        """
+        # Every pass gets polled, not only up to the first one which isn't ready
+        ready = [p.ready() for p in self.passes]
+        if not all(ready):
+            return False
+        self.loading = False
+
+        # Programs were set outside of GLState
+        self.state.invalidate()
+        return True
+
+    def idle_frame(self, mouse, ticks, changed=False):
+        """
+            Compare the inputs the shaders use against the last frame
+
+            changed -> Something else changed (shaders reloaded), draw anyway
+
+            return -> True if there is nothing new to draw
+        """
+        inputs = (any('iMouse' in p.uses for p in self.passes) and tuple(mouse),
+                  any('iTime' in p.uses for p in self.passes) and ticks)
+        if changed or inputs != self.last_inputs:
+            self.last_inputs = inputs
+            self.samples = 0
+        elif self.samples >= self.max_samples:
+            return True
+
+        if self.accumulator is not None:
+            self.accumulator.samples = self.samples
+            self.jitter = self.accumulator.jitter()
+        self.samples += 1
+        return False
+
+    def reload_shaders(self):
+        """
+            Compile the shader files changed since the last frame, swap in the programs
+            which are linked (with the CompileScheduler the old ones draw until then)
+
+            return -> True if any program was swapped
+        """
+        for (p, stage), path, source in self.watcher.changes():
+            start = time.perf_counter()
+            try:
+                p.reload(stage, source)
+            except RuntimeError as error:
+                self.reload_failed(path, error)
+                continue
+            # A later change of the same pass takes over the one compiling
+            start = self.reloads.get(p, (path, start))[1]
+            self.reloads[p] = path, start
+
+        swapped = False
+        for p, (path, start) in list(self.reloads.items()):
+            try:
+                if not p.reloaded():
+                    continue
+            except RuntimeError as error:
+                del self.reloads[p]
+                self.reload_failed(path, error)
+                continue
+            del self.reloads[p]
+            swapped = True
+            self.set_status("{}: reloaded in {:.1f} ms".format(path, (time.perf_counter() - start) * 1000.0))
+
+        if swapped:
+            # Programs were replaced, the cached bindings/uniforms can't be trusted
+            self.state.invalidate()
+        return swapped
+
+    def reload_failed(self, path, error):
+        # Keep drawing with the last program which worked (first arg is the log, not the source)
+        sys.stderr.write("{}: {}\n".format(path, error.args[0] if error.args else error))
+        self.set_status("{}: failed to compile (log on stderr)".format(path))
+
+    def set_status(self, text):
+        """
+            Show 'text' in the caption for STATUS_SECONDS
+        """
+        self.status = text, time.perf_counter()
+
+    def upscale(self, source):
+        """
+            Stretch the (scaled) image of the pass 'source' over the screen
+        """
+        w, h = source.size
+        self.state.blit(source.frame, self.screen, (0, 0, w, h), (0, 0) + tuple(self.resolution), GL_LINEAR)
+
+    def handle_event(self, event):
+        if (event.type == QUIT) or (event.type == KEYUP and event.key == K_ESCAPE):
+            if self.capture is not None:
+                # Write out the frames still in flight
+                self.capture.close()
+            if self.watcher is not None:
+                self.watcher.stop()
+            if self.compiler is not None:
+                self.compiler.stop()
+            pygame.quit()
+            exitsystem()
+        elif event.type == VIDEORESIZE:
+            # pygame 2 resizes the GL drawable by itself, no set_mode (which could recreate the context)
+            self.resize(event.size)
+        elif event.type == KEYDOWN and K_1 <= event.key <= K_9:
+            self.select_variant(event.key - K_1)
+        elif event.type == KEYDOWN and K_F1 <= event.key <= K_F9:
+            self.select_alternative(event.key - K_F1)
+
+    def mainloop(self, lean=False, caption_interval=0.5):
+        """
+            Run until closed
+
+            lean -> Skip GL calls which don't change state and only update the
+                    caption every 'caption_interval' seconds
+        """
+        self.state.cache = lean
+        self.state.invalidate()
+        caption = Throttle(caption_interval if lean else 0.0)
+
+        pacing = self.pacing
+        while 1:
+            # Sleeps until the frame is due (and for the GPU when too many frames are queued)
+            pacing.wait()
+            self.clock.tick()
+
+            for event in pygame.event.get():
+                self.handle_event(event)
+
+            # Inputs read as late as possible, right before render() uploads them
+            pacing.sample()
+            drawn = self.render(pygame.mouse.get_pos(), pygame.time.get_ticks() / 1000.0)
+
+            if caption.ready():
+                text = "FPS: {:.1f}  GL calls: {}".format(self.clock.get_fps(), self.state.calls)
+                if self.dynamic_resolution is not None:
+                    text += "  Scale: {:.2f}".format(self.dynamic_resolution.scale)
+                latency = pacing.latency_ms()
+                if latency is not None:
+                    text += "  Latency: {:.1f} ms".format(latency)
+                if self.status is not None and time.perf_counter() - self.status[1] < STATUS_SECONDS:
+                    text += "  " + self.status[0]
+                pygame.display.set_caption(text)
+
+            if not drawn:
+                # Nothing new, the window keeps showing the last frame. Don't spin
+                pacing.skip()
+                pygame.time.wait(IDLE_WAIT_MS)
+                continue
+
+            pacing.rendered()
+            if self.profiler is not None:
+                start = time.perf_counter()
+                pygame.display.flip()
+                self.profiler.add_cpu('swap', (time.perf_counter() - start) * 1000.0)
+            else:
+                pygame.display.flip()
+            pacing.presented()
+
+
+def run(cls, argv=None):
+    """
+        Command line entry point shared by the setups
+
+        cls -> Renderer (sub)class to run
+    """
+    parser = argparse.ArgumentParser(description="PyShadeToy")
+    parser.add_argument('--lean', action='store_true',
+                        help="Skip GL calls which don't change state, throttle the caption")
+    parser.add_argument('--adaptive', type=float, nargs='?', const=16.6, metavar='MS',
+                        help="Dynamic resolution holding a GPU frame time budget (Default: 16.6 ms)")
+    parser.add_argument('--capture', metavar='SPEC',
+                        help="Stream frames to a directory (PNG), a .raw file or '|command' (raw RGBA on stdin)")
+    parser.add_argument('--shaders', metavar='DIR',
+                        help="Load the shaders from DIR/pass<N>.<vert|frag>.glsl (written out if missing) "
+                             "and reload them on change")
+    parser.add_argument('--idle', choices=['pause', 'accumulate'],
+                        help="While the inputs don't change keep the last frame (pause) or refine it with "
+                             "jittered samples (accumulate)")
+    parser.add_argument('--samples', type=int, default=64, help="Samples averaged with --idle accumulate")
+    parser.add_argument('--no-ubo', action='store_true',
+                        help="Send the per frame uniforms with glUniform per pass instead of a uniform buffer")
+    parser.add_argument('--geometry', choices=fullscreen.GEOMETRIES, default='triangle',
+                        help="Fullscreen triangle from gl_VertexID (core profile) or the GL_QUADS quad")
+    parser.add_argument('--sync-compile', action='store_true',
+                        help="Compile the shaders before opening the window instead of showing a placeholder")
+    parser.add_argument('--define', action='append', default=[], metavar='NAME[=VALUE]',
+                        help="#define for the shader templates, e.g. ACCELERATE=1 or STEP_HEATMAP=1 "
+                             "(raymarch setups), can be repeated")
+    parser.add_argument('--profile', nargs='?', const='', metavar='PATH',
+                        help="Time every pass (GPU and CPU), print the summary on exit and dump the samples "
+                             "to PATH (.csv or .json)")
+    parser.add_argument('--resolution', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                        help="Initial window size (Default: 800x600, the window can be resized)")
+    parser.add_argument('--pacing', choices=PACING_MODES, default='vsync',
+                        help="vsync with late input sampling, a fixed frame rate (sleeping in between) or "
+                             "uncapped (benchmarking)")
+    parser.add_argument('--fps', type=float, metavar='RATE',
+                        help="Frame rate of --pacing fixed (Default: 60), refresh rate assumed by vsync "
+                             "(Default: the display's)")
+    parser.add_argument('--in-flight', type=int, default=2, metavar='N',
+                        help="Frames queued ahead of the GPU at most (fixed/uncapped pacing)")
+    parser.add_argument('--latency', action='store_true',
+                        help="Print the input-to-photon latency distribution on exit")
+    args = parser.parse_args(argv)
+
+    options = {'pacing': FramePacer(args.pacing, args.fps, args.in_flight)}
+    if args.resolution:
+        options['resolution'] = tuple(args.resolution)
+    if args.adaptive:
+        options['dynamic_resolution'] = DynamicResolution(args.adaptive)
+    if args.capture:
+        options['capture'] = args.capture
+    if args.shaders:
+        options['shader_dir'] = args.shaders
+    if args.profile is not None:
+        options['profiler'] = FrameProfiler()
+    if args.no_ubo:
+        options['uniform_block'] = False
+    if args.geometry != 'triangle':
+        options['geometry'] = args.geometry
+    if args.sync_compile:
+        options['async_compile'] = False
+    if args.define:
+        # NAME alone defines it as 1
+        options['defines'] = {}
+        for define in args.define:
+            name, _, value = define.partition('=')
+            options['defines'][name] = value or 1
+    if args.idle:
+        options['idle'] = args.idle
+        options['max_samples'] = args.samples
+
+    # Raw function pointers for the per frame calls (unless $GLSL_PYTHON_GL says otherwise)
+    fastgl.prefer('fast')
+    try:
+        cls(**options).mainloop(lean=args.lean)
+    finally:
+        if args.latency:
+            print(options['pacing'].report())
+        profiler = options.get('profiler')
+        if profiler is not None:
+            print(profiler.report())
+            if args.profile:
+                profiler.dump(args.profile)
@@ -0,0 +1,235 @@
+# Declarative render graph for N-pass pipelines
+#
+# Passes are declared by name with the names of the passes they read. The
+# graph puts them in dependency order (passes nothing on screen depends on are
+# dropped) and hands out the framebuffers: a texture is only alive from the
+# pass writing it until its last reader, after that the same framebuffer is
+# reused by a later pass (aliasing). A chain of 10 post-processing passes
+# needs 2-3 textures instead of 10.
+#
+# Offscreen passes whose uniforms and inputs didn't change since they last drew
+# are skipped (unless their framebuffer has been reused by another pass in the
+# meantime, mark static passes with keep=True to give them their own). The
+# screen pass always draws, the back buffer isn't kept between frames.
+#
+# A pass listing its own name as an input reads its previous frame (feedback),
+# it gets a framebuffer pair of its own.
+#
+# Usage:
+#       graph = RenderGraph([GraphPass('scene', VS, SCENE_FS),
+#                            GraphPass('blur', VS, BLUR_FS, inputs=['scene']),
+#                            GraphPass('screen', VS, COMPOSITE_FS, inputs=['scene', 'blur'], screen=True)])
+#       Renderer(graph.passes)
+
+
+from __future__ import division
+
+import fullscreen
+from renderer import Pass
+
+
+class Target(object):
+    def __init__(self, index, format):
+        """
+            Framebuffer shared by passes whose outputs don't live at the same time
+        """
+        self.index = index
+        self.format = format
+        self.frame = None
+        self.texture = None
+        self.owner = None           # Pass whose output it holds right now
+        self.last_use = -1          # Schedule index of the last reader of the current output
+
+    def allocate(self, renderer):
+        if self.frame is None:
+            self.frame, self.texture = renderer.genFrameBuffer(self.format)
+        elif renderer.targets.size((self.frame, self.texture)) != renderer.resolution:
+            # Window resized, the first of the passes sharing it swaps it (output is redrawn anyway)
+            self.frame, self.texture = renderer.targets.resize((self.frame, self.texture), renderer.resolution)
+            self.owner = None
+        return self.frame, self.texture
+
+
+class GraphPass(Pass):
+    def __init__(self, name, vertex, fragment, inputs=(), screen=False, keep=False, format='rgb8', tiles=(1, 1)):
+        """
+            name -> Name other passes refer to this pass's output by
+            inputs -> Names of the passes read as iChannel0..n (its own name: previous frame)
+            screen -> Draw to the screen (exactly one pass in a graph)
+            keep -> Own framebuffer (never aliased) so the output survives while the pass is skipped
+            format -> Framebuffer texture format (see renderer.FORMATS)
+            tiles -> Columns, rows of copies drawn in one instanced call (see Pass)
+        """
+        Pass.__init__(self, vertex, fragment, offscreen=not screen, format=format,
+                      feedback=name in inputs, tiles=tiles)
+        self.name = name
+        self.input_names = list(inputs)
+        self.screen = screen
+        self.keep = keep
+        self.target = None
+
+        # Skip tracking: bumped on every draw, compared by the readers
+        self.version = 0
+        self.drawn = None
+        self.skipped = 0
+
+    def build(self, renderer):
+        if self.target is None:
+            # Screen pass (offscreen only with dynamic resolution, then with its own framebuffer)
+            # or feedback pass (framebuffer pair)
+            Pass.build(self, renderer)
+            return
+
+        self.block = renderer.uniforms
+        self.geometry = renderer.geometry
+        self.vertices = fullscreen.vertices(self.geometry, self.tiles)
+        self.compile(renderer)
+        self.size = renderer.resolution
+        self.frame, self.texture = self.target.allocate(renderer)
+
+    def resize(self, renderer):
+        if self.target is None:
+            Pass.resize(self, renderer)
+            return
+        self.size = renderer.resolution
+        self.frame, self.texture = self.target.allocate(renderer)
+
+    def set_program(self, program):
+        Pass.set_program(self, program)
+        # New program (hot reload), draw again
+        self.drawn = None
+
+    def draw(self, renderer, mouse, ticks):
+        # Everything the output depends on: every per frame uniform the sources read, the inputs
+        values = {'iMouse': tuple(mouse), 'iTime': ticks, 'iResolution': tuple(self.size),
+                  'iJitter': tuple(renderer.jitter)}
+        inputs = (tuple((name, values.get(name)) for name in sorted(self.uses)),
+                  self.size,
+                  tuple(p.version for p in self.inputs))
+
+        # A uniform nothing here knows the value of can't be compared, always draw then
+        skippable = all(name in values for name in self.uses)
+        if skippable and self.target is not None and self.target.owner is self and inputs == self.drawn:
+            self.skipped += 1
+            return
+
+        Pass.draw(self, renderer, mouse, ticks)
+        self.version += 1
+        self.drawn = inputs
+        if self.target is not None:
+            self.target.owner = self
+
+
+class RenderGraph(object):
+    def __init__(self, passes):
+        """
+            passes -> GraphPasses in any order
+
+            Raises ValueError for unknown inputs, cycles or not exactly one screen pass
+        """
+        self.declared = list(passes)
+        self.passes = self.schedule(self.declared)
+        self.targets = self.alias(self.passes)
+
+    @staticmethod
+    def schedule(passes):
+        """
+            Dependency order of the passes the screen pass needs (declaration order among equals)
+
+            return -> list of passes
+        """
+        by_name = {}
+        for p in passes:
+            if p.name in by_name:
+                raise ValueError("Duplicate pass name '{}'".format(p.name))
+            by_name[p.name] = p
+
+        screens = [p for p in passes if p.screen]
+        if len(screens) != 1:
+            raise ValueError("A render graph needs exactly one screen pass, got {}".format(len(screens)))
+
+        for p in passes:
+            for name in p.input_names:
+                if name not in by_name:
+                    raise ValueError("Pass '{}' reads unknown pass '{}'".format(p.name, name))
+                if by_name[name].screen:
+                    raise ValueError("Pass '{}' can't read the screen pass '{}'".format(p.name, name))
+            if p.screen and p.feedback:
+                raise ValueError("The screen pass '{}' can't read itself".format(p.name))
+            p.inputs = [by_name[name] for name in p.input_names]
+
+        # Only what the screen pass (indirectly) reads
+        needed = set()
+        stack = [screens[0]]
+        while stack:
+            p = stack.pop()
+            if p.name not in needed:
+                needed.add(p.name)
+                stack.extend(p.inputs)
+
+        # Depth first post order visiting inputs in declaration order
+        order = []
+        state = {}
+        for root in [p for p in passes if p.name in needed]:
+            stack = [(root, False)]
+            while stack:
+                p, done = stack.pop()
+                if done:
+                    state[p.name] = 'done'
+                    order.append(p)
+                    continue
+                if state.get(p.name) == 'done':
+                    continue
+                if state.get(p.name) == 'visiting':
+                    raise ValueError("Cycle in the render graph at pass '{}'".format(p.name))
+                state[p.name] = 'visiting'
+                stack.append((p, True))
+                for source in reversed(p.inputs):
+                    if source is p:
+                        # Feedback reads the previous frame, not a dependency
+                        continue
+                    if state.get(source.name) == 'visiting':
+                        raise ValueError("Cycle in the render graph at pass '{}'".format(source.name))
+                    if state.get(source.name) != 'done':
+                        stack.append((source, False))
+        return order
+
+    @staticmethod
+    def alias(passes):
+        """
+            Give every offscreen pass a Target, reusing the ones whose output was read for the last time
+
+            return -> list of targets
+        """
+        last_use = {}
+        for index, p in enumerate(passes):
+            for source in p.inputs:
+                last_use[source.name] = index
+
+        targets = []
+        for index, p in enumerate(passes):
+            if p.screen or p.feedback:
+                continue
+            # A pass can't write to what it reads, free means the last reader came before it
+            free = [t for t in targets if t.last_use < index and t.format == p.format and not p.keep]
+            if free:
+                target = free[0]
+            else:
+                target = Target(len(targets), p.format)
+                targets.append(target)
+            # Kept targets are never free again
+            target.last_use = len(passes) if p.keep else last_use.get(p.name, index)
+            p.target = target
+        return targets
+
+    def describe(self):
+        """
+            return -> schedule and framebuffer of every pass as text
+        """
+        lines = ["{} passes, {} framebuffers".format(len(self.passes), len(self.targets))]
+        for p in self.passes:
+            lines.append("  {:<16} <- {:<30} {}".format(
+                         p.name, ', '.join(p.input_names) or '-',
+                         'screen' if p.screen else 'feedback pair' if p.feedback else
+                         'framebuffer {} ({})'.format(p.target.index, p.format)))
+        return "\n".join(lines)
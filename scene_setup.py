@@ -0,0 +1,65 @@
+# Ray marched scene built with sdf.py
+#
+# 210 primitives: a displaced sphere blended into a torus, a spinning ring of
+# boxes and a wall of spheres behind, compiled into the raymarch template. All
+# of raymarch_setup.py's defines work (ACCELERATE, CONE_MARCH, COMPUTE ...).
+#
+# Usage:
+#       python scene_setup.py
+#       python scene_setup.py --define ACCELERATE
+#       python scene_setup.py --define PRUNE=0      (no bounding volume tests)
+#
+# Both builds of the scene are in the shader, PRUNE picks one. It defaults to
+# the pruned one on GPUs and to the flat one on software rasterizers: llvmpipe
+# runs both sides of an if, the bounding volume tests only add work there
+# (about 3x slower).
+#       python sdf.py scene_setup                   (compile statistics)
+
+
+from __future__ import division
+import math
+
+from renderer import Renderer, run
+from adaptive import software_renderer
+from raymarch_setup import FRAGMENT_SHADER, raymarch_passes, raymarch_backends
+from sdf import Sphere, Box, Torus, Union, SmoothUnion, compile_scene, insert, sin, cos
+
+
+def ripple(p, t):
+    # raymarch_setup_mod.py's displacement
+    return (sin(abs(4.0 * cos(t)) * p.x) * sin(abs(4.0 * sin(t)) * p.y) * sin(4.0 * p.z) *
+            (0.1 + abs(0.1 * sin(t * 2.0))))
+
+
+def ring(count, radius):
+    boxes = [Box((0.12, 0.25, 0.12)).rotate('z', 0.3).translate(radius, 0.0, 0.0).rotate('z', 2.0 * math.pi * i / count)
+             for i in range(count)]
+    return Union(*boxes).rotate('z', lambda t: t * 0.3)
+
+
+def wall(columns, rows, spacing, depth):
+    return Union(*[Sphere(0.2).translate((i - (columns - 1) / 2.0) * spacing, (j - (rows - 1) / 2.0) * spacing, depth)
+                   for i in range(columns) for j in range(rows)])
+
+
+SCENE = Union(SmoothUnion(Sphere(1.0).displace(ripple, 0.2), Torus(1.4, 0.12).rotate('x', 1.2), 0.3),
+              ring(48, 2.4),
+              wall(16, 10, 0.6, 3.0))
+
+
+class Main(Renderer):
+    def __init__(self, **options):
+        pruned, flat = compile_scene(SCENE, prune=True), compile_scene(SCENE, prune=False)
+        glsl = "#if PRUNE\n" + pruned.glsl + "#else\n" + flat.glsl + "#endif\n"
+        # Light follows the mouse, mapped between -1 and 1 range (unless the caller says otherwise)
+        options.setdefault('normalize_mouse', True)
+        defines, fragment = dict(pruned.defines, AMBIENT=0.2), insert(FRAGMENT_SHADER, glsl)
+        Renderer.__init__(self, raymarch_passes(options, defines, fragment),
+                          alternatives=raymarch_backends(options, defines, fragment), **options)
+
+    def context_defines(self):
+        return {'PRUNE': 0 if software_renderer() else 1}
+
+
+if __name__ == '__main__':
+    run(Main)
@@ -0,0 +1,164 @@
+# Asynchronous shader compilation at startup
+#
+# Compiling the passes one after the other (compile, wait, link, wait) keeps
+# the window empty until the last program is linked. The scheduler submits
+# every stage and program up front and never waits on them: with
+# GL_KHR_parallel_shader_compile (or the ARB version) the driver compiles on
+# its own threads and GL_COMPLETION_STATUS_KHR tells when a program is done
+# without blocking. Without the extension it falls back to a worker thread with
+# a shared context (see variants.VariantCompiler, headless.SharedContext and
+# sdlcontext.WindowSharedContext for windows), or compiles right away if there
+# is no shared context either.
+#
+# Until every pass has its program the renderer draws a placeholder pass to
+# the screen, so the first frame shows up after one tiny shader compiles.
+#
+# Usage:
+#       python multipass_setup.py                   (windows compile asynchronously)
+#       python bench.py --async-compile             (headless, reports the time to the first real frame)
+
+
+from __future__ import division
+import ctypes as ct
+
+from OpenGL.GL import (glCreateShader, glShaderSource, glCompileShader, glCreateProgram, glAttachShader,
+                       glDetachShader, glDeleteShader, glDeleteProgram, glLinkProgram, glProgramParameteri,
+                       glGetProgramiv, glGetShaderiv, glGetProgramInfoLog, glGetShaderInfoLog,
+                       glGetIntegerv, glGetStringi, GL_NUM_EXTENSIONS, GL_EXTENSIONS, GL_VERTEX_SHADER,
+                       GL_FRAGMENT_SHADER, GL_COMPILE_STATUS, GL_LINK_STATUS, GL_TRUE,
+                       GL_PROGRAM_BINARY_RETRIEVABLE_HINT)
+# The wrapped version doesn't know the size of GL_COMPLETION_STATUS_KHR, use the raw one
+from OpenGL.raw.GL.VERSION.GL_2_0 import glGetProgramiv as glGetProgramivRaw
+
+from variants import VariantCompiler
+
+
+# Same values in the KHR and ARB versions of the extension
+GL_COMPLETION_STATUS_KHR = 0x91B1
+EXTENSIONS = ['GL_KHR_parallel_shader_compile', 'GL_ARB_parallel_shader_compile']
+
+PLACEHOLDER_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec3 vPos;
+layout(location = 1) in vec2 texCoords;
+
+out vec2 texcoords;
+
+void main()
+{
+    gl_Position = vec4(vPos, 1.0);
+    texcoords = texCoords;
+}
+"""
+
+# Dark vertical gradient while the real passes compile
+PLACEHOLDER_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 texcoords;
+out vec4 fragColor;
+void main()
+{
+    fragColor = vec4(vec3(0.08 + 0.06 * texcoords.y), 1.0);
+}
+"""
+
+
+def parallel_extension():
+    """
+        return -> name of the parallel shader compile extension the context has, None if neither
+    """
+    names = set(glGetStringi(GL_EXTENSIONS, i).decode() for i in range(int(glGetIntegerv(GL_NUM_EXTENSIONS))))
+    for name in EXTENSIONS:
+        if name in names:
+            return name
+    return None
+
+
+class CompileScheduler(VariantCompiler):
+    def __init__(self, context=None, cache=None, parallel=None):
+        """
+            context -> SharedContext for the worker thread (used without the extension)
+            cache -> ProgramCache for the linked programs
+            parallel -> Use the parallel shader compile extension (Default: if the context has it)
+        """
+        self.extension = parallel_extension() if parallel is not False else None
+        if parallel and self.extension is None:
+            raise RuntimeError("The context has no parallel shader compile extension")
+        self.parallel = self.extension is not None
+
+        VariantCompiler.__init__(self, None if self.parallel else context, cache)
+        if self.parallel:
+            self.background = True
+            # Let the driver pick the number of compiler threads
+            if self.extension.startswith('GL_KHR'):
+                from OpenGL.GL.KHR.parallel_shader_compile import glMaxShaderCompilerThreadsKHR as threads
+            else:
+                from OpenGL.GL.ARB.parallel_shader_compile import glMaxShaderCompilerThreadsARB as threads
+            threads(0xFFFFFFFF)
+
+        self.jobs = {}              # (vertex, fragment) -> program, stages (linking, in the driver)
+
+    def request(self, vertex, fragment):
+        if not self.parallel:
+            VariantCompiler.request(self, vertex, fragment)
+            return
+
+        key = vertex, fragment
+        if key in self.results or key in self.jobs:
+            return
+
+        if self.cache is not None:
+            program = self.cache.load(self.cache.key([vertex, fragment]))
+            if program is not None:
+                self.results[key] = program
+                return
+
+        # Nothing here waits, the status queries come later in poll()
+        stages = []
+        for source, kind in ((vertex, GL_VERTEX_SHADER), (fragment, GL_FRAGMENT_SHADER)):
+            shader = glCreateShader(kind)
+            glShaderSource(shader, source)
+            glCompileShader(shader)
+            stages.append(shader)
+
+        program = glCreateProgram()
+        for shader in stages:
+            glAttachShader(program, shader)
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program)
+        self.jobs[key] = program, stages
+
+    def poll(self):
+        """
+            Collect the programs the driver finished (doesn't block)
+        """
+        status = ct.c_int()
+        for key, (program, stages) in list(self.jobs.items()):
+            glGetProgramivRaw(program, GL_COMPLETION_STATUS_KHR, ct.byref(status))
+            if not status.value:
+                continue
+            del self.jobs[key]
+
+            if glGetProgramiv(program, GL_LINK_STATUS) == GL_TRUE:
+                result = program
+                if self.cache is not None:
+                    self.cache.store(self.cache.key(list(key)), program)
+            else:
+                # Same messages as compiling synchronously
+                result = RuntimeError("Link failure: {}".format(glGetProgramInfoLog(program)))
+                for shader in stages:
+                    if glGetShaderiv(shader, GL_COMPILE_STATUS) != GL_TRUE:
+                        result = RuntimeError("Shader compile failure: {}".format(glGetShaderInfoLog(shader)))
+                        break
+                glDeleteProgram(program)
+
+            for shader in stages:
+                if result is program:
+                    glDetachShader(program, shader)
+                glDeleteShader(shader)
+            self.results[key] = result
+
+    def result(self, vertex, fragment):
+        if self.parallel:
+            self.poll()
+        return VariantCompiler.result(self, vertex, fragment)
@@ -0,0 +1,821 @@
+# SDF scene description compiled to GLSL
+#
+# Scenes are built in Python from primitives (Sphere, Box, Torus, Plane), CSG
+# (Union, Subtract, Intersect, SmoothUnion), transforms (translate, rotate,
+# scale) and displacement, and compiled to the map_the_world()/calculate_normal()
+# of the raymarch template.
+#
+# The compiler turns the graph into scalar expressions built through one table:
+#       - Constant folding: transforms, rotation matrices etc. collapse into the
+#         numbers they come to, x * 1.0, x + 0.0 and such disappear
+#       - Common subexpressions: the same operation on the same operands is one
+#         node (e.g. pos.x - 0.8 for every primitive in that column)
+#       - Bounding volumes: large unions are split into a hierarchy of groups,
+#         every group is skipped (its bounding sphere distance used instead)
+#         while the point is farther than 'margin' from it
+# The normal is the tetrahedral 4 tap gradient instead of 6 central differences.
+#
+# The same compiled scene evaluates with NumPy (cpu_reference.py can render it).
+#
+# Usage:
+#       scene = Union(Sphere(0.5).translate(1.0, 0.0, 0.0), Box((0.3, 0.3, 0.3)).rotate('y', 0.5))
+#       compiled = compile_scene(scene)
+#       fragment = insert(raymarch_setup.FRAGMENT_SHADER, compiled)
+#       compiled.distance(positions, ticks)                  (NumPy)
+#       python sdf.py scene_setup                            (compile stats, GLSL vs NumPy check)
+
+
+from __future__ import division
+import math
+import re
+
+import numpy as np
+
+
+# Union children per group of the bounding hierarchy
+LEAF_SIZE = 4
+
+# Replaced by insert()
+SCENE_BEGIN = '// Scene begin'
+SCENE_END = '// Scene end'
+
+INPUTS = {'x': 'pos.x', 'y': 'pos.y', 'z': 'pos.z', 'time': 'iTime'}
+
+# Constant folding and NumPy evaluation of every operation
+FOLD = {'add': lambda a, b: a + b, 'sub': lambda a, b: a - b, 'mul': lambda a, b: a * b,
+        'div': lambda a, b: a / b, 'min': min, 'max': max, 'neg': lambda a: -a, 'abs': abs,
+        'sqrt': math.sqrt, 'sin': math.sin, 'cos': math.cos}
+NUMPY = {'add': np.add, 'sub': np.subtract, 'mul': np.multiply, 'div': np.divide, 'min': np.minimum,
+         'max': np.maximum, 'neg': np.negative, 'abs': np.abs, 'sqrt': np.sqrt, 'sin': np.sin, 'cos': np.cos}
+INFIX = {'add': '+', 'sub': '-', 'mul': '*', 'div': '/'}
+COMMUTATIVE = set(['add', 'mul', 'min', 'max'])
+
+
+class Expr(object):
+    """
+        Scalar expression node (shared, the builder hands out one per distinct operation)
+
+        Arithmetic operators and abs() work on it, sin()/cos()/sqrt() are in this module
+    """
+    def __init__(self, builder, index, op, args, value):
+        self.builder = builder
+        self.index = index
+        self.op = op
+        self.args = args
+        self.value = value
+
+    def __add__(self, other):
+        return self.builder.op('add', self, other)
+
+    def __radd__(self, other):
+        return self.builder.op('add', other, self)
+
+    def __sub__(self, other):
+        return self.builder.op('sub', self, other)
+
+    def __rsub__(self, other):
+        return self.builder.op('sub', other, self)
+
+    def __mul__(self, other):
+        return self.builder.op('mul', self, other)
+
+    def __rmul__(self, other):
+        return self.builder.op('mul', other, self)
+
+    def __truediv__(self, other):
+        return self.builder.op('div', self, other)
+
+    def __rtruediv__(self, other):
+        return self.builder.op('div', other, self)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __neg__(self):
+        return self.builder.op('neg', self)
+
+    def __abs__(self):
+        return self.builder.op('abs', self)
+
+
+def sin(x):
+    return x.builder.op('sin', x) if isinstance(x, Expr) else math.sin(x)
+
+
+def cos(x):
+    return x.builder.op('cos', x) if isinstance(x, Expr) else math.cos(x)
+
+
+def sqrt(x):
+    return x.builder.op('sqrt', x) if isinstance(x, Expr) else math.sqrt(x)
+
+
+def minimum(a, b):
+    return _builder(a, b).op('min', a, b)
+
+
+def maximum(a, b):
+    return _builder(a, b).op('max', a, b)
+
+
+def clamp(x, low, high):
+    return minimum(maximum(x, low), high)
+
+
+def _builder(*values):
+    for value in values:
+        if isinstance(value, Expr):
+            return value.builder
+    raise TypeError("No expression among the arguments")
+
+
+class Builder(object):
+    def __init__(self):
+        """
+            Expression table: every distinct operation exists once (common subexpression
+            elimination), operations on constants are computed right away (constant folding)
+        """
+        self.nodes = []
+        self.table = {}
+        self.requests = 0           # Operations asked for
+        self.folded = 0             # Of which folded or simplified away
+        self.shared = 0             # Of which already in the table
+
+    def _node(self, op, args=(), value=None):
+        key = op, tuple(a.index for a in args), value
+        node = self.table.get(key)
+        if node is None:
+            node = Expr(self, len(self.nodes), op, tuple(args), value)
+            self.nodes.append(node)
+            self.table[key] = node
+        elif op not in ('const', 'input'):
+            self.shared += 1
+        return node
+
+    def const(self, value):
+        # -0.0 and 0.0 are the same for the scene, one node
+        return self._node('const', value=float(value) + 0.0)
+
+    def input(self, name):
+        return self._node('input', value=INPUTS[name])
+
+    def wrap(self, value):
+        return value if isinstance(value, Expr) else self.const(value)
+
+    def bound(self, distance, exact, margin):
+        """
+            return -> 'distance' (to a bounding volume) while it is over 'margin', else 'exact'
+        """
+        self.requests += 1
+        return self._node('bound', (distance, exact), float(margin))
+
+    def op(self, op, *args):
+        self.requests += 1
+        args = [self.wrap(a) for a in args]
+        result = self._simplify(op, args)
+        if result is not None:
+            self.folded += 1
+            return result
+        if op in COMMUTATIVE and args[0].index > args[1].index:
+            args.reverse()
+        return self._node(op, args)
+
+    def _simplify(self, op, args):
+        values = [a.value if a.op == 'const' else None for a in args]
+        if None not in values:
+            try:
+                return self.const(FOLD[op](*values))
+            except (ValueError, ZeroDivisionError):
+                return None
+
+        a = args[0]
+        if len(args) == 1:
+            if op == 'neg' and a.op == 'neg':
+                return a.args[0]
+            if op == 'abs' and a.op in ('abs', 'sqrt'):
+                return a
+            return None
+
+        b = args[1]
+        if op == 'add':
+            if values[0] == 0.0:
+                return b
+            if values[1] == 0.0:
+                return a
+        elif op == 'sub':
+            if values[1] == 0.0:
+                return a
+            if values[0] == 0.0:
+                return self.op('neg', b)
+            if a is b:
+                return self.const(0.0)
+        elif op == 'mul':
+            if 0.0 in values:
+                return self.const(0.0)
+            if values[0] == 1.0:
+                return b
+            if values[1] == 1.0:
+                return a
+            if values[0] == -1.0:
+                return self.op('neg', b)
+            if values[1] == -1.0:
+                return self.op('neg', a)
+        elif op == 'div':
+            if values[1] is not None:
+                return self.op('mul', a, 1.0 / values[1])
+        elif op in ('min', 'max') and a is b:
+            return a
+        return None
+
+
+class Point(object):
+    """
+        Position the distance is taken at, 3 scalar expressions
+    """
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+    def length(self):
+        return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+
+class Options(object):
+    def __init__(self, builder, time, prune, margin, tests=frozenset()):
+        self.builder = builder
+        self.time = time
+        self.prune = prune
+        self.margin = margin
+        self.tests = tests          # Bounding volume distances tested by the enclosing groups
+
+    def widen(self, extra):
+        """
+            return -> Options with the bounding volume margin raised by 'extra' (for children whose
+                      parent still changes while they are that far off, e.g. smooth blends)
+        """
+        return Options(self.builder, self.time, self.prune, self.margin + extra, self.tests)
+
+
+def build(node, p, options, prunable=True):
+    """
+        return -> distance expression of 'node' at 'p', behind a bounding volume test if it is
+                  worth one ('prunable': a lower bound can stand in for it, false for subtracted shapes)
+    """
+    bound = node.bound()
+    if not (prunable and options.prune and bound is not None and node.grouping and node.cost() > 1):
+        return node.distance(p, options)
+    center, radius = bound
+    sphere = Point(*[c - o for c, o in zip(p, center)]).length() - radius
+    if sphere.index in options.tests:
+        # Same sphere as an enclosing group, already tested
+        return node.distance(p, options)
+
+    inner = Options(options.builder, options.time, options.prune, options.margin, options.tests | set([sphere.index]))
+    return options.builder.bound(sphere, node.distance(p, inner), options.margin)
+
+
+def _enclose(bounds):
+    """
+        return -> center, radius of a sphere around the spheres 'bounds' (None if any is unbounded)
+    """
+    if not bounds or any(b is None for b in bounds):
+        return None
+    low = [min(c[axis] - r for c, r in bounds) for axis in range(3)]
+    high = [max(c[axis] + r for c, r in bounds) for axis in range(3)]
+    center = tuple((l + h) / 2.0 for l, h in zip(low, high))
+    radius = max(math.sqrt(sum((a - b) ** 2 for a, b in zip(c, center))) + r for c, r in bounds)
+    return center, radius
+
+
+class SDF(object):
+    # Groups of shapes get bounding volumes, single primitives and transforms don't
+    grouping = False
+
+    def translate(self, x, y, z):
+        return Translate(self, (x, y, z))
+
+    def rotate(self, axis, angle):
+        return Rotate(self, axis, angle)
+
+    def scale(self, factor):
+        return Scale(self, factor)
+
+    def displace(self, function, amplitude):
+        return Displace(self, function, amplitude)
+
+    def __or__(self, other):
+        return Union(self, other)
+
+    def __sub__(self, other):
+        return Subtract(self, other)
+
+    def __and__(self, other):
+        return Intersect(self, other)
+
+    def primitives(self):
+        return sum(child.primitives() for child in self.children)
+
+    def cost(self):
+        return sum(child.cost() for child in self.children)
+
+    def bound(self):
+        """
+            return -> center, radius of a sphere the surface is in (None: unbounded)
+        """
+        raise NotImplementedError
+
+    def distance(self, p, options):
+        raise NotImplementedError
+
+
+class Primitive(SDF):
+    children = ()
+
+    def primitives(self):
+        return 1
+
+    def cost(self):
+        return 1
+
+
+class Sphere(Primitive):
+    def __init__(self, radius):
+        self.radius = radius
+
+    def bound(self):
+        return (0.0, 0.0, 0.0), self.radius
+
+    def distance(self, p, options):
+        return p.length() - self.radius
+
+
+class Box(Primitive):
+    def __init__(self, size):
+        """
+            size -> Half extents along x, y, z
+        """
+        self.size = tuple(size)
+
+    def bound(self):
+        return (0.0, 0.0, 0.0), math.sqrt(sum(s * s for s in self.size))
+
+    def distance(self, p, options):
+        q = [abs(c) - s for c, s in zip(p, self.size)]
+        outside = Point(*[maximum(c, 0.0) for c in q]).length()
+        inside = minimum(maximum(q[0], maximum(q[1], q[2])), 0.0)
+        return outside + inside
+
+
+class Torus(Primitive):
+    def __init__(self, major, minor):
+        """
+            Ring around the y axis
+        """
+        self.major = major
+        self.minor = minor
+
+    def bound(self):
+        return (0.0, 0.0, 0.0), self.major + self.minor
+
+    def distance(self, p, options):
+        ring = sqrt(p.x * p.x + p.z * p.z) - self.major
+        return sqrt(ring * ring + p.y * p.y) - self.minor
+
+
+class Plane(Primitive):
+    def __init__(self, normal, offset=0.0):
+        """
+            Points p with dot(p, normal) + offset = 0 ('normal' gets normalized)
+        """
+        length = math.sqrt(sum(n * n for n in normal))
+        self.normal = tuple(n / length for n in normal)
+        self.offset = offset
+
+    def bound(self):
+        return None
+
+    def distance(self, p, options):
+        return p.x * self.normal[0] + p.y * self.normal[1] + p.z * self.normal[2] + self.offset
+
+
+class Union(SDF):
+    grouping = True
+
+    def __init__(self, *children):
+        self.children = list(children)
+
+    def bound(self):
+        return _enclose([child.bound() for child in self.children])
+
+    def groups(self):
+        """
+            return -> children split into a hierarchy of nested Unions along the longest axis
+                      (unbounded children stay at the top)
+        """
+        bounded = [child for child in self.children if child.bound() is not None]
+        unbounded = [child for child in self.children if child.bound() is None]
+        if len(bounded) <= LEAF_SIZE:
+            return self.children
+
+        centers = [child.bound()[0] for child in bounded]
+        axis = max(range(3), key=lambda a: max(c[a] for c in centers) - min(c[a] for c in centers))
+        bounded = [child for center, child in sorted(zip(centers, bounded), key=lambda item: item[0][axis])]
+        half = len(bounded) // 2
+        return [Union(*bounded[:half]), Union(*bounded[half:])] + unbounded
+
+    def distance(self, p, options):
+        children = self.groups() if options.prune else self.children
+        result = None
+        for child in children:
+            d = build(child, p, options)
+            result = d if result is None else minimum(result, d)
+        return result
+
+
+class SmoothUnion(SDF):
+    grouping = True
+
+    def __init__(self, a, b, k):
+        """
+            k -> Blend distance (polynomial smooth minimum)
+        """
+        self.children = [a, b]
+        self.k = k
+
+    def bound(self):
+        bound = _enclose([child.bound() for child in self.children])
+        if bound is None:
+            return None
+        # The blend only pulls the surface out by up to k / 4
+        return bound[0], bound[1] + self.k / 4.0
+
+    def distance(self, p, options):
+        # The blend reaches k past the surface of either
+        a, b = [build(child, p, options.widen(self.k)) for child in self.children]
+        h = clamp(0.5 + 0.5 * (b - a) / self.k, 0.0, 1.0)
+        return b + (a - b) * h - self.k * h * (1.0 - h)
+
+
+class Subtract(SDF):
+    grouping = True
+
+    def __init__(self, a, b):
+        """
+            'a' with 'b' cut out
+        """
+        self.children = [a, b]
+
+    def bound(self):
+        return self.children[0].bound()
+
+    def distance(self, p, options):
+        # A lower bound of 'b' isn't one of the result
+        a = build(self.children[0], p, options)
+        b = build(self.children[1], p, options, prunable=False)
+        return maximum(a, -b)
+
+
+class Intersect(SDF):
+    grouping = True
+
+    def __init__(self, a, b):
+        self.children = [a, b]
+
+    def bound(self):
+        bounds = [b for b in (child.bound() for child in self.children) if b is not None]
+        return min(bounds, key=lambda b: b[1]) if bounds else None
+
+    def distance(self, p, options):
+        return maximum(*[build(child, p, options) for child in self.children])
+
+
+class Translate(SDF):
+    def __init__(self, child, offset):
+        self.children = [child]
+        self.offset = tuple(offset)
+
+    def bound(self):
+        bound = self.children[0].bound()
+        if bound is None:
+            return None
+        return tuple(c + o for c, o in zip(bound[0], self.offset)), bound[1]
+
+    def distance(self, p, options):
+        return build(self.children[0], Point(*[c - o for c, o in zip(p, self.offset)]), options)
+
+
+class Rotate(SDF):
+    AXES = {'x': (1.0, 0.0, 0.0), 'y': (0.0, 1.0, 0.0), 'z': (0.0, 0.0, 1.0)}
+
+    def __init__(self, child, axis, angle):
+        """
+            axis -> 'x', 'y', 'z' or a direction
+            angle -> Radians, or a function of iTime returning them (e.g. lambda t: t * 0.5)
+        """
+        self.children = [child]
+        axis = self.AXES[axis] if isinstance(axis, str) else axis
+        length = math.sqrt(sum(a * a for a in axis))
+        self.axis = tuple(a / length for a in axis)
+        self.angle = angle
+
+    def matrix(self, c, s):
+        """
+            return -> rows of the rotation matrix for cos/sin of the angle (Rodrigues)
+        """
+        x, y, z = self.axis
+        t = 1.0 - c
+        return [(t * x * x + c,     t * x * y - s * z, t * x * z + s * y),
+                (t * x * y + s * z, t * y * y + c,     t * y * z - s * x),
+                (t * x * z - s * y, t * y * z + s * x, t * z * z + c)]
+
+    def bound(self):
+        bound = self.children[0].bound()
+        if bound is None:
+            return None
+        center, radius = bound
+        if callable(self.angle):
+            # Turns over time, anywhere on its circle around the origin
+            return (0.0, 0.0, 0.0), math.sqrt(sum(c * c for c in center)) + radius
+        rows = self.matrix(math.cos(self.angle), math.sin(self.angle))
+        return tuple(sum(r * c for r, c in zip(row, center)) for row in rows), radius
+
+    def distance(self, p, options):
+        angle = self.angle(options.time) if callable(self.angle) else self.angle
+        rows = self.matrix(cos(angle), sin(angle))
+        # The inverse (transpose) takes the point into the child's space
+        local = Point(*[rows[0][i] * p.x + rows[1][i] * p.y + rows[2][i] * p.z for i in range(3)])
+        return build(self.children[0], local, options)
+
+
+class Scale(SDF):
+    def __init__(self, child, factor):
+        self.children = [child]
+        self.factor = factor
+
+    def bound(self):
+        bound = self.children[0].bound()
+        if bound is None:
+            return None
+        return tuple(c * self.factor for c in bound[0]), bound[1] * self.factor
+
+    def distance(self, p, options):
+        local = Point(*[c / self.factor for c in p])
+        options = Options(options.builder, options.time, options.prune, options.margin / self.factor, options.tests)
+        return build(self.children[0], local, options) * self.factor
+
+
+class Displace(SDF):
+    grouping = True
+
+    def __init__(self, child, function, amplitude):
+        """
+            function -> f(p, time) adding to the distance, built from Point coordinates, numbers
+                        and sin/cos/sqrt/abs (e.g. lambda p, t: 0.1 * sin(4.0 * p.x) * cos(t))
+            amplitude -> Largest absolute value f returns (for the bounding volume)
+        """
+        self.children = [child]
+        self.function = function
+        self.amplitude = amplitude
+
+    def cost(self):
+        return self.children[0].cost() + 1
+
+    def bound(self):
+        bound = self.children[0].bound()
+        if bound is None:
+            return None
+        return bound[0], bound[1] + self.amplitude
+
+    def distance(self, p, options):
+        return build(self.children[0], p, options.widen(self.amplitude)) + self.function(p, options.time)
+
+
+def schedule(root, visible=frozenset()):
+    """
+        Operations 'root' needs which aren't computed already ('visible' node indices), in
+        dependency order. The subtree of a bounding volume test becomes a nested block
+
+        return -> list of (node, block or None)
+    """
+    needed = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.index in needed or node.index in visible or node.op in ('const', 'input'):
+            continue
+        needed.add(node.index)
+        # Only the bounding volume distance is needed up front
+        stack.extend(node.args[:1] if node.op == 'bound' else node.args)
+
+    nodes = root.builder.nodes
+    inner = visible | needed
+    return [(nodes[index], schedule(nodes[index].args[1], inner) if nodes[index].op == 'bound' else None)
+            for index in sorted(needed)]
+
+
+def _operand(node):
+    if node.op == 'const':
+        text = repr(node.value)
+        return '(' + text + ')' if node.value < 0.0 else text
+    if node.op == 'input':
+        return node.value
+    return 'v{}'.format(node.index)
+
+
+def emit(block, indent='    '):
+    """
+        return -> GLSL statements computing the nodes of 'block'
+    """
+    lines = []
+    for node, inner in block:
+        name = _operand(node)
+        args = [_operand(a) for a in node.args]
+        if node.op == 'bound':
+            lines.append("{}float {} = {};".format(indent, name, args[0]))
+            lines.append("{}if ({} < {})".format(indent, name, _operand(node.builder.const(node.value))))
+            lines.append(indent + "{")
+            lines.extend(emit(inner, indent + '    '))
+            lines.append("{}    {} = {};".format(indent, name, args[1]))
+            lines.append(indent + "}")
+        elif node.op in INFIX:
+            lines.append("{}float {} = {} {} {};".format(indent, name, args[0], INFIX[node.op], args[1]))
+        elif node.op == 'neg':
+            lines.append("{}float {} = -{};".format(indent, name, args[0]))
+        else:
+            lines.append("{}float {} = {}({});".format(indent, name, node.op, ', '.join(args)))
+    return lines
+
+
+class _Values(dict):
+    # Values of the enclosing block for the rows of 'mask', taken on first use
+    def __init__(self, parent, mask):
+        dict.__init__(self)
+        self.parent = parent
+        self.mask = mask
+
+    def __missing__(self, index):
+        value = self.parent[index]
+        value = value[self.mask] if isinstance(value, np.ndarray) and value.ndim else value
+        self[index] = value
+        return value
+
+
+def evaluate(block, values):
+    """
+        Run 'block' with NumPy, 'values' has the inputs and gets every node computed
+    """
+    for node, inner in block:
+        if node.op == 'bound':
+            distance = values[node.args[0].index]
+            result = np.array(distance, copy=True)
+            near = distance < node.value
+            if near.any():
+                sub = _Values(values, near)
+                evaluate(inner, sub)
+                result[near] = _value(sub, node.args[1])
+            values[node.index] = result
+        else:
+            values[node.index] = NUMPY[node.op](*[_value(values, a) for a in node.args])
+
+
+def _value(values, node):
+    if node.op == 'const':
+        return np.float32(node.value)
+    return values[node.index]
+
+
+class CompiledScene(object):
+    def __init__(self, scene, prune=True, margin=0.1):
+        """
+            scene -> SDF to compile
+            prune -> Skip groups while farther than 'margin' from their bounding sphere
+        """
+        builder = Builder()
+        self.inputs = dict((name, builder.input(name)) for name in INPUTS)
+        options = Options(builder, self.inputs['time'], prune, margin)
+        self.root = builder.wrap(build(scene, Point(self.inputs['x'], self.inputs['y'], self.inputs['z']), options))
+        self.block = schedule(self.root)
+
+        # Rays only need to be marched inside the scene's bounding sphere (see ACCELERATE)
+        self.defines = {}
+        bound = scene.bound()
+        if bound is not None:
+            center, radius = bound
+            self.defines['BOUND_RADIUS'] = math.sqrt(sum(c * c for c in center)) + radius
+
+        body = emit(self.block)
+        self.glsl = "\n".join(
+            ["// {} primitives compiled by sdf.py".format(scene.primitives()),
+             "float map_the_world(in vec3 pos)",
+             "{"] + body +
+            ["    return {};".format(_operand(self.root)),
+             "}",
+             "// Tetrahedral 4 tap gradient",
+             "vec3 calculate_normal(in vec3 pos)",
+             "{",
+             "    const vec2 k = vec2(1.0, -1.0);",
+             "    const float h = 0.000577;",
+             "    return normalize(k.xyy * map_the_world(pos + k.xyy * h) + k.yyx * map_the_world(pos + k.yyx * h) +",
+             "                     k.yxy * map_the_world(pos + k.yxy * h) + k.xxx * map_the_world(pos + k.xxx * h));",
+             "}"]) + "\n"
+
+        self.stats = {'primitives': scene.primitives(),
+                      'requested': builder.requests,
+                      'folded': builder.folded,
+                      'shared': builder.shared,
+                      'operations': sum(1 for node in builder.nodes if node.op not in ('const', 'input')),
+                      'bounds': sum(1 for node in builder.nodes if node.op == 'bound'),
+                      'lines': len(body)}
+
+    def distance(self, pos, ticks=0.0):
+        """
+            Distance to the scene for positions 'pos' (N, 3), same as the GLSL map_the_world
+        """
+        pos = np.asarray(pos, dtype=np.float32)
+        values = {self.inputs['x'].index: pos[:, 0], self.inputs['y'].index: pos[:, 1],
+                  self.inputs['z'].index: pos[:, 2], self.inputs['time'].index: np.float32(ticks)}
+        evaluate(self.block, values)
+        result = _value(values, self.root)
+        return np.broadcast_to(result, len(pos)).astype(np.float32)
+
+    def normal(self, pos, ticks=0.0):
+        """
+            Normalized tetrahedral gradient at 'pos' (N, 3), same as the GLSL calculate_normal
+        """
+        pos = np.asarray(pos, dtype=np.float32)
+        normal = np.zeros_like(pos)
+        for k in ((1.0, -1.0, -1.0), (-1.0, -1.0, 1.0), (-1.0, 1.0, -1.0), (1.0, 1.0, 1.0)):
+            k = np.array(k, dtype=np.float32)
+            normal += k * self.distance(pos + k * np.float32(0.000577), ticks)[:, None]
+        return normal / np.sqrt(np.einsum('ij,ij->i', normal, normal))[:, None]
+
+
+def compile_scene(scene, prune=True, margin=0.1):
+    """
+        return -> CompiledScene (GLSL, NumPy evaluation and compile statistics)
+    """
+    return CompiledScene(scene, prune, margin)
+
+
+def insert(template, compiled):
+    """
+        compiled -> CompiledScene, or its GLSL
+
+        return -> 'template' with the scene between its SCENE_BEGIN and SCENE_END lines replaced
+    """
+    glsl = compiled if isinstance(compiled, str) else compiled.glsl
+    pattern = re.compile(re.escape(SCENE_BEGIN) + r'.*?' + re.escape(SCENE_END) + r'[^\n]*\n', re.DOTALL)
+    if not pattern.search(template):
+        raise ValueError("The template has no '{}' ... '{}' section".format(SCENE_BEGIN, SCENE_END))
+    return pattern.sub(lambda match: glsl, template, count=1)
+
+
+def main(argv=None):
+    import argparse
+    import importlib
+    import time
+    # The setup builds its scene with the sdf module, not this __main__ one
+    from sdf import compile_scene
+
+    parser = argparse.ArgumentParser(description="Compile a setup's scene and check it")
+    parser.add_argument('setup', nargs='?', default='scene_setup', help="Module with a SCENE")
+    parser.add_argument('--points', type=int, default=100000, help="Random points for the NumPy timing")
+    parser.add_argument('--glsl', action='store_true', help="Print the generated GLSL")
+    args = parser.parse_args(argv)
+
+    scene = importlib.import_module(args.setup).SCENE
+    rng = np.random.RandomState(0)
+    points = rng.uniform(-3.0, 3.0, (args.points, 3)).astype(np.float32)
+
+    exact = None
+    for prune in (False, True):
+        start = time.perf_counter()
+        compiled = compile_scene(scene, prune=prune)
+        compile_ms = (time.perf_counter() - start) * 1000.0
+        start = time.perf_counter()
+        distance = compiled.distance(points, 1.0)
+        numpy_ms = (time.perf_counter() - start) * 1000.0
+
+        stats = compiled.stats
+        print("{:<8} {} primitives: {} operations requested, {} folded, {} shared -> {} operations, "
+              "{} bounds, {} lines ({:.1f} ms to compile, {:.1f} ms for {} points in NumPy)".format(
+              'pruned' if prune else 'flat', stats['primitives'], stats['requested'], stats['folded'],
+              stats['shared'], stats['operations'], stats['bounds'], stats['lines'], compile_ms, numpy_ms,
+              args.points))
+        if exact is None:
+            exact = distance
+        else:
+            # Pruned groups give a lower bound far away, the exact distance near the surface
+            near = exact < 0.05
+            print("         pruned <= exact: {}   same near the surface: {:.2e}".format(
+                  bool((distance <= exact + 1e-5).all()), float(np.abs(distance - exact)[near].max())))
+    if args.glsl:
+        print(compiled.glsl)
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# Shared GL context for the pygame window
+#
+# pygame creates one GL context and has no API for a second. The worker
+# threads (variants.VariantCompiler, scheduler.CompileScheduler without the
+# parallel shader compile extension) need a context of their own which shares
+# programs with the window's, so this goes around pygame to the SDL it loaded:
+# SDL_GL_SHARE_WITH_CURRENT_CONTEXT set, a hidden 1x1 window, SDL_GL_CreateContext.
+# The context attributes set for the window (version, core profile) still
+# apply, so both contexts match.
+#
+# The hidden window (a drawable to make the context current with, EGL doesn't
+# allow one surface current on two threads) stays until pygame.quit(): SDL
+# windows must not be destroyed off the main thread and the worker destroys
+# its context when it stops.
+#
+# Usage:
+#       pygame.display.set_mode(resolution, OPENGL | DOUBLEBUF)
+#       context = WindowSharedContext()     (on the thread the window's context is current on)
+#       context.make_current()              (on the worker thread)
+#       ...
+#       context.release()
+#       context.destroy()
+
+
+from __future__ import division
+import os
+import glob
+import ctypes as ct
+import ctypes.util
+
+
+SDL_GL_SHARE_WITH_CURRENT_CONTEXT = 22
+SDL_WINDOW_OPENGL = 0x2
+SDL_WINDOW_HIDDEN = 0x8
+SDL_WINDOWPOS_UNDEFINED = 0x1FFF0000
+
+
+def sdl_library():
+    """
+        return -> ctypes handle of the SDL2 library pygame uses, None if it can't be found
+    """
+    import pygame
+
+    # Wheels bundle their own copy, a second SDL wouldn't know pygame's window.
+    # Loading the same file again gives the copy already loaded
+    paths = []
+    if os.path.exists('/proc/self/maps'):
+        with open('/proc/self/maps') as maps:
+            paths += sorted(set(line.split()[-1] for line in maps if '/libSDL2' in line))
+    package = os.path.dirname(pygame.__file__)
+    for directory in (package, package + '.libs', os.path.join(package, '.dylibs')):
+        paths += sorted(glob.glob(os.path.join(directory, 'libSDL2*'))) + glob.glob(os.path.join(directory, 'SDL2.dll'))
+    # Not SDL2_image, SDL2_ttf, ...
+    paths = [path for path in paths if not os.path.basename(path).startswith('libSDL2_')]
+    paths.append(ctypes.util.find_library('SDL2'))
+
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            sdl = ct.CDLL(path)
+        except OSError:
+            continue
+        if hasattr(sdl, 'SDL_GL_CreateContext'):
+            return sdl
+    return None
+
+
+class WindowSharedContext(object):
+    def __init__(self):
+        """
+            GL context sharing objects with the window's (current on the calling thread), current on no thread yet
+
+            Raises RuntimeError if SDL can't be found or doesn't create the context
+        """
+        sdl = self.sdl = sdl_library()
+        if sdl is None:
+            raise RuntimeError("SDL2 library of pygame not found")
+        sdl.SDL_GL_GetCurrentWindow.restype = ct.c_void_p
+        sdl.SDL_GL_GetCurrentContext.restype = ct.c_void_p
+        sdl.SDL_CreateWindow.restype = ct.c_void_p
+        sdl.SDL_CreateWindow.argtypes = [ct.c_char_p, ct.c_int, ct.c_int, ct.c_int, ct.c_int, ct.c_uint32]
+        sdl.SDL_GL_CreateContext.restype = ct.c_void_p
+        sdl.SDL_GL_CreateContext.argtypes = [ct.c_void_p]
+        sdl.SDL_GL_MakeCurrent.argtypes = [ct.c_void_p, ct.c_void_p]
+        sdl.SDL_GL_DeleteContext.argtypes = [ct.c_void_p]
+        sdl.SDL_GetError.restype = ct.c_char_p
+
+        window, parent = sdl.SDL_GL_GetCurrentWindow(), sdl.SDL_GL_GetCurrentContext()
+        if not window or not parent:
+            raise RuntimeError("No current SDL GL context to share with")
+
+        self.window = sdl.SDL_CreateWindow(b"", SDL_WINDOWPOS_UNDEFINED, SDL_WINDOWPOS_UNDEFINED, 1, 1,
+                                           SDL_WINDOW_OPENGL | SDL_WINDOW_HIDDEN)
+        if not self.window:
+            raise RuntimeError("Failed to create the shared context's window: {}".format(sdl.SDL_GetError().decode()))
+
+        sdl.SDL_GL_SetAttribute(SDL_GL_SHARE_WITH_CURRENT_CONTEXT, 1)
+        self.context = sdl.SDL_GL_CreateContext(self.window)
+        sdl.SDL_GL_SetAttribute(SDL_GL_SHARE_WITH_CURRENT_CONTEXT, 0)
+
+        # Creating it made it current, give the thread the window's context back
+        sdl.SDL_GL_MakeCurrent(window, parent)
+        if not self.context:
+            sdl.SDL_DestroyWindow(ct.c_void_p(self.window))
+            raise RuntimeError("Failed to create shared SDL GL context: {}".format(sdl.SDL_GetError().decode()))
+
+    def make_current(self):
+        if self.sdl.SDL_GL_MakeCurrent(self.window, self.context) != 0:
+            raise RuntimeError("Failed to make the shared context current: {}".format(self.sdl.SDL_GetError().decode()))
+
+    def release(self):
+        self.sdl.SDL_GL_MakeCurrent(self.window, None)
+
+    def destroy(self):
+        self.sdl.SDL_GL_DeleteContext(self.context)
+        self.context = None
@@ -0,0 +1,196 @@
+# Pooled render targets (framebuffer + color texture) for resizable windows
+#
+# Offscreen passes used to get a framebuffer at the window size once and keep
+# it forever. With a resizable window the sizes change, and reallocating on
+# every step of a drag-resize would allocate and free textures dozens of times
+# a second. So:
+#       - The Renderer only switches its render size once the window size held
+#         still for 'settle' seconds (hysteresis in time). In between the frame
+#         is drawn at the previous size and stretched over the window
+#       - Targets are taken from and given back to a pool keyed by size and
+#         format. A resize back to a size used before (maximize/restore,
+#         fullscreen toggle) gets its textures back without allocating
+#       - Given back targets are kept up to 'spare_bytes' (least recently used
+#         go first), the targets in use don't count
+#
+# Usage:
+#       pool = TargetPool(screen=0)
+#       frame, texture = pool.acquire((800, 600), 'rgba16f')
+#       frame, texture = pool.resize((frame, texture), (1024, 768), keep=True)
+#       pool.release((frame, texture))
+
+
+from __future__ import division
+from collections import OrderedDict
+
+from OpenGL.GL import (glGenFramebuffers, glDeleteFramebuffers, glBindFramebuffer, glGenTextures, glDeleteTextures,
+                       glBindTexture, glTexImage2D, glTexParameteri, glFramebufferTexture2D, glCheckFramebufferStatus,
+                       glClearColor, glClear, glBlitFramebuffer, GL_FRAMEBUFFER, GL_READ_FRAMEBUFFER,
+                       GL_DRAW_FRAMEBUFFER, GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_LINEAR,
+                       GL_COLOR_ATTACHMENT0, GL_FRAMEBUFFER_COMPLETE, GL_COLOR_BUFFER_BIT, GL_RGB, GL_RGBA, GL_RGBA8,
+                       GL_RGBA16F, GL_RGBA32F, GL_R32F, GL_RG32F, GL_RED, GL_RG, GL_UNSIGNED_BYTE, GL_FLOAT)
+
+
+# Framebuffer texture formats: internal format, pixel format, pixel type
+FORMATS = {'rgb8':    (GL_RGB, GL_RGB, GL_UNSIGNED_BYTE),
+           'rgba8':   (GL_RGBA8, GL_RGBA, GL_UNSIGNED_BYTE),
+           'rgba16f': (GL_RGBA16F, GL_RGBA, GL_FLOAT),
+           'rgba32f': (GL_RGBA32F, GL_RGBA, GL_FLOAT),
+           'r32f':    (GL_R32F, GL_RED, GL_FLOAT),
+           'rg32f':   (GL_RG32F, GL_RG, GL_FLOAT)}
+
+# Bytes per texel in video memory (drivers pad rgb8 to 4)
+TEXEL_BYTES = {'rgb8': 4, 'rgba8': 4, 'rgba16f': 8, 'rgba32f': 16, 'r32f': 4, 'rg32f': 8}
+
+
+def allocate(size, format, screen=0):
+    """
+        Generate a framebuffer with a color texture attached
+
+        size -> (width, height)
+        format -> Texture format (see FORMATS)
+        screen -> Framebuffer bound again afterwards
+
+        return -> complete framebuffer and texture
+    """
+    # Create framebuffer
+    frame = glGenFramebuffers(1)
+    glBindFramebuffer(GL_FRAMEBUFFER, frame)
+
+    # Create the texture and attach it
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+
+    # Set the texture parameters
+    w, h = size
+    internal, pixels, kind = FORMATS[format]
+    glTexImage2D(GL_TEXTURE_2D, 0, internal, w, h, 0, pixels, kind, None)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+
+    # Attach it to the framebuffer
+    glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
+
+    # Note: There would depth and stencil attachment here but since we are doing
+    # fullscreen quad without 3d models, depth texture is not needed
+
+    # Make sure the frame buffer is complete
+    if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+        raise RuntimeError("Framebuffer is not complete")
+
+    # Start from black, feedback passes read it before anything is drawn
+    glClearColor(0.0, 0.0, 0.0, 0.0)
+    glClear(GL_COLOR_BUFFER_BIT)
+
+    # Unbind it
+    glBindFramebuffer(GL_FRAMEBUFFER, screen)
+
+    return frame, texture
+
+
+class TargetPool(object):
+    def __init__(self, settle=0.25, spare_bytes=128 << 20):
+        """
+            settle -> Seconds the window size has to hold still before the render size follows
+            spare_bytes -> Video memory kept in given back targets for reuse
+        """
+        self.settle = settle
+        self.spare_bytes = spare_bytes
+        self.screen = 0
+
+        self.targets = {}               # Framebuffer -> (size, format, texture) of every target
+        self.spare = OrderedDict()      # Given back targets, least recently used first: frame -> bytes
+        self.held = 0                   # Bytes in 'spare'
+
+        self.allocations = 0
+        self.reuses = 0
+
+    @staticmethod
+    def bytes(size, format):
+        return size[0] * size[1] * TEXEL_BYTES[format]
+
+    def size(self, target):
+        """
+            return -> (width, height) 'target' was allocated at
+        """
+        return self.targets[target[0]][0]
+
+    def acquire(self, size, format='rgb8'):
+        """
+            return -> framebuffer and texture of 'size' and 'format', a spare one if there is
+        """
+        size = tuple(size)
+        for frame in self.spare:
+            if self.targets[frame][:2] == (size, format):
+                self.held -= self.spare.pop(frame)
+                self.reuses += 1
+                # Whatever the last user left in it
+                glBindFramebuffer(GL_FRAMEBUFFER, frame)
+                glClearColor(0.0, 0.0, 0.0, 0.0)
+                glClear(GL_COLOR_BUFFER_BIT)
+                glBindFramebuffer(GL_FRAMEBUFFER, self.screen)
+                return frame, self.targets[frame][2]
+
+        frame, texture = allocate(size, format, self.screen)
+        self.targets[frame] = size, format, texture
+        self.allocations += 1
+        return frame, texture
+
+    def release(self, target):
+        """
+            Give 'target' back, it stays allocated while there is room among the spares
+        """
+        frame = target[0]
+        size, format, texture = self.targets[frame]
+        self.spare[frame] = self.bytes(size, format)
+        self.held += self.spare[frame]
+        self.trim(self.spare_bytes)
+
+    def trim(self, limit=0):
+        """
+            Free spare targets (least recently given back first) until at most 'limit' bytes are left
+        """
+        while self.spare and self.held > limit:
+            frame, size = self.spare.popitem(last=False)
+            self.held -= size
+            self._delete(frame)
+
+    def _delete(self, frame):
+        texture = self.targets.pop(frame)[2]
+        glDeleteFramebuffers(1, [frame])
+        glDeleteTextures([texture])
+
+    def resize(self, target, size, keep=False):
+        """
+            Swap 'target' for one of 'size' (same format), nothing happens if it has that size already
+
+            keep -> Copy the content over, stretched (feedback passes keep their state)
+
+            return -> framebuffer and texture of the new size
+        """
+        size = tuple(size)
+        old_size, format, texture = self.targets[target[0]]
+        if old_size == size:
+            return target
+
+        frame, texture = self.acquire(size, format)
+        if keep:
+            glBindFramebuffer(GL_READ_FRAMEBUFFER, target[0])
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, frame)
+            glBlitFramebuffer(0, 0, old_size[0], old_size[1], 0, 0, size[0], size[1], GL_COLOR_BUFFER_BIT, GL_LINEAR)
+            glBindFramebuffer(GL_FRAMEBUFFER, self.screen)
+        self.release(target)
+        return frame, texture
+
+    def stats(self):
+        """
+            return -> {'targets': allocated, 'spare': of them given back, 'spare_bytes', 'allocations', 'reuses'}
+        """
+        return {'targets': len(self.targets), 'spare': len(self.spare), 'spare_bytes': self.held,
+                'allocations': self.allocations, 'reuses': self.reuses}
+
+    def destroy(self):
+        for frame in list(self.targets):
+            self._delete(frame)
+        self.spare.clear()
+        self.held = 0
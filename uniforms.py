@@ -0,0 +1,180 @@
+# Per frame uniforms in a uniform buffer shared by all programs
+#
+# iMouse, iTime, iResolution and iJitter are the same for every pass (except
+# iResolution with dynamic resolution), so instead of glUniform calls per pass
+# they live in one std140 uniform block. The shaders don't need to change:
+# their plain 'uniform vec2 iMouse;' declarations are rewritten into the block
+# before compiling.
+#
+# The CPU side copy is a NumPy structured array with one record per render
+# size (passes of the same size share it). Fields are compared on set and only
+# the changed byte range goes to the GPU, with one glBufferSubData per frame at
+# most.
+
+
+from __future__ import division
+import re
+
+import numpy as np
+
+from OpenGL.GL import (glGenBuffers, glDeleteBuffers, glBindBuffer, glBufferData, glGetIntegerv,
+                       glGetUniformBlockIndex, glUniformBlockBinding, GL_UNIFORM_BUFFER, GL_DYNAMIC_DRAW,
+                       GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT, GL_INVALID_INDEX)
+
+
+BLOCK_NAME = 'FrameUniforms'
+BINDING = 0
+
+# Field, GLSL type, std140 offset
+FIELDS = [('iMouse',      'vec2',  0),
+          ('iResolution', 'vec2',  8),
+          ('iJitter',     'vec2',  16),
+          ('iTime',       'float', 24)]
+BLOCK_SIZE = 32
+
+BLOCK = "layout(std140) uniform {}\n{{\n{}}};\n".format(
+        BLOCK_NAME, ''.join("    {:<5} {};\n".format(kind, name) for name, kind, offset in FIELDS))
+
+DECLARATION = re.compile(r'^[ \t]*uniform\s+(\w+)\s+(\w+)\s*;[ \t]*$', re.MULTILINE)
+VERSION = re.compile(r'^[ \t]*#version[^\n]*\n', re.MULTILINE)
+
+
+def rewrite(source):
+    """
+        Move the per frame uniform declarations of 'source' into the uniform block
+
+        return -> new source, or the source as it is if it doesn't declare any of them
+                  (or declares one with another type, e.g. ShaderToy's vec3 iResolution)
+    """
+    types = dict((name, kind) for name, kind, offset in FIELDS)
+    declared = [m for m in DECLARATION.finditer(source) if m.group(2) in types]
+    if not declared or any(types[m.group(2)] != m.group(1) for m in declared):
+        return source
+
+    source = DECLARATION.sub(lambda m: '' if m.group(2) in types else m.group(0), source)
+
+    version = VERSION.search(source)
+    end = version.end() if version else 0
+    return source[:end] + BLOCK + source[end:]
+
+
+def used(source):
+    """
+        return -> set of the block fields 'source' refers to (outside of the block declaration)
+    """
+    body = source.replace(BLOCK, '')
+    return set(name for name, kind, offset in FIELDS if re.search(r'\b{}\b'.format(name), body))
+
+
+class UniformBlock(object):
+    def __init__(self, records=4):
+        """
+            records -> Initial number of records (grows when more render sizes show up)
+        """
+        # Records are bound at offsets which are multiples of this
+        alignment = int(glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT))
+        self.stride = -(-BLOCK_SIZE // alignment) * alignment
+        self.dtype = np.dtype({'names': [name for name, kind, offset in FIELDS],
+                               'formats': [('<f4', 2) if kind == 'vec2' else '<f4' for name, kind, offset in FIELDS],
+                               'offsets': [offset for name, kind, offset in FIELDS],
+                               'itemsize': self.stride})
+
+        self.buffer = int(glGenBuffers(1))
+        self.data = np.zeros(0, dtype=self.dtype)
+        self.sizes = {}             # Render size -> record
+        self.free = []              # Records of sizes given up (see retain())
+
+        # Dirty byte range of 'data' not uploaded yet
+        self.low = self.high = 0
+
+        self.uploads = 0
+        self._grow(records)
+
+    def _grow(self, records):
+        data = np.zeros(records, dtype=self.dtype)
+        data[:len(self.data)] = self.data
+        data[len(self.data):] = self.data[0] if len(self.data) else 0
+        self.data = data
+
+        # Stays bound, GLState.buffer_sub_data expects GL_UNIFORM_BUFFER to be either this or unknown
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+
+        # New storage, everything goes up again
+        self.low, self.high = 0, self.data.nbytes
+
+    def record(self, size):
+        """
+            return -> record index holding iResolution = 'size'
+        """
+        record = self.sizes.get(size)
+        if record is None:
+            # Without free records the ones in use are exactly 0..len(sizes)-1
+            record = self.free.pop() if self.free else len(self.sizes)
+            if record == len(self.data):
+                self._grow(2 * len(self.data))
+            self.sizes[size] = record
+            self.set('iResolution', size, record)
+        return record
+
+    def retain(self, sizes):
+        """
+            Give up the records of all sizes but 'sizes' (window resized), record() reuses them
+        """
+        keep = set(tuple(size) for size in sizes)
+        for size in [size for size in self.sizes if size not in keep]:
+            self.free.append(self.sizes.pop(size))
+
+    def _dirty(self, low, high):
+        if self.low == self.high:
+            self.low, self.high = low, high
+        else:
+            self.low, self.high = min(self.low, low), max(self.high, high)
+
+    def set(self, name, value, record=None):
+        """
+            Set field 'name' of 'record' (None: every record) if it changed
+        """
+        field = self.data[name]
+        value = np.asarray(value, dtype=field.dtype)
+        if record is None:
+            if (field == value).all():
+                return
+            field[...] = value
+            first, last = 0, len(self.data) - 1
+        else:
+            if (field[record] == value).all():
+                return
+            field[record] = value
+            first = last = record
+
+        kind, offset = self.dtype.fields[name][:2]
+        self._dirty(first * self.stride + offset, last * self.stride + offset + kind.itemsize)
+
+    def upload(self, state):
+        """
+            Send the changed bytes (one glBufferSubData, nothing if nothing changed)
+        """
+        if self.low == self.high:
+            return
+        state.buffer_sub_data(GL_UNIFORM_BUFFER, self.buffer, self.low, self.data.view(np.uint8)[self.low:self.high])
+        self.low = self.high = 0
+        self.uploads += 1
+
+    def attach(self, program):
+        """
+            Connect the block of 'program' to the buffer
+
+            return -> True if the program uses the block
+        """
+        index = glGetUniformBlockIndex(program, BLOCK_NAME)
+        if index == GL_INVALID_INDEX:
+            return False
+        glUniformBlockBinding(program, index, BINDING)
+        return True
+
+    def bind(self, state, record):
+        state.bind_buffer_range(GL_UNIFORM_BUFFER, BINDING, self.buffer, record * self.stride, BLOCK_SIZE)
+
+    def destroy(self):
+        glDeleteBuffers(1, [self.buffer])
@@ -0,0 +1,236 @@
+# Shader variants: one template, programs specialized with #define sets
+#
+# A VariantPass compiles its sources with '#define NAME VALUE' lines put in
+# after #version. The defines shared by all variants (e.g. displacement on/off)
+# come from 'defines', the selectable ones (e.g. quality tiers) from 'variants'.
+#
+# Only the variant drawn first is compiled at startup, the others the first
+# time they are selected. That happens on a worker thread in a second context
+# sharing objects with the render one (headless.SharedContext, or
+# sdlcontext.WindowSharedContext in a window): the pass keeps drawing with the
+# current program until the new one is linked, so switching never stalls a
+# frame. Without a shared context the first switch to a variant compiles it
+# on the spot. Linked programs are kept by source, switching back is immediate.
+#
+# Usage:
+#       VariantPass(VS, FS, variants=[('low', {'STEPS': 32}), ('high', {'STEPS': 128})],
+#                   defines={'DISPLACEMENT': 1})
+#       Keys 1-9 select the variants of every VariantPass while running
+#       python raymarch_setup.py --define ACCELERATE=1     (extra defines for all of them)
+
+
+from __future__ import division
+import re
+import sys
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from OpenGL.GL import glDeleteShader, glFinish
+
+from renderer import Pass, compile_program
+
+
+VERSION = re.compile(r'^[ \t]*#version[^\n]*\n', re.MULTILINE)
+
+
+def specialize(source, defines):
+    """
+        return -> 'source' with a #define per item of 'defines' after #version (sorted by name)
+    """
+    if not defines:
+        return source
+    lines = ''.join("#define {} {}\n".format(name, _literal(value)) for name, value in sorted(defines.items()))
+    version = VERSION.search(source)
+    end = version.end() if version else 0
+    return source[:end] + lines + source[end:]
+
+
+def _literal(value):
+    # Python bools would come out as True/False
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class VariantCompiler(object):
+    def __init__(self, context=None, cache=None):
+        """
+            context -> SharedContext the worker thread compiles in (None: compile on the calling thread)
+            cache -> ProgramCache for the linked programs
+        """
+        self.context = context
+        self.cache = cache
+        self.background = context is not None
+
+        self.lock = threading.Lock()
+        self.results = {}           # (vertex, fragment) -> program or the compile error
+        self.pending = set()
+
+        self.thread = None
+        if self.background:
+            self.queue = Queue()
+            self.thread = threading.Thread(target=self._work, name='VariantCompiler')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _compile(self, key):
+        try:
+            result = compile_program(key[0], key[1], self.cache)
+        except RuntimeError as error:
+            result = error
+        with self.lock:
+            self.results[key] = result
+            self.pending.discard(key)
+
+    def _work(self):
+        self.context.make_current()
+        while 1:
+            key = self.queue.get()
+            if key is None:
+                break
+            self._compile(key)
+            # Done on the GPU side too before the render context uses it
+            glFinish()
+        self.context.release()
+        self.context.destroy()
+
+    def request(self, vertex, fragment):
+        """
+            Start compiling the program (nothing if it was requested before)
+        """
+        key = vertex, fragment
+        with self.lock:
+            if key in self.results or key in self.pending:
+                return
+            self.pending.add(key)
+        if self.background:
+            self.queue.put(key)
+        else:
+            self._compile(key)
+
+    def result(self, vertex, fragment):
+        """
+            return -> linked program, None while it is compiling
+
+            Raises RuntimeError if it failed to compile or link
+        """
+        with self.lock:
+            result = self.results.get((vertex, fragment))
+        if isinstance(result, RuntimeError):
+            raise result
+        return result
+
+    def add(self, vertex, fragment, program):
+        """
+            Keep a program linked elsewhere (build, hot reload)
+        """
+        with self.lock:
+            self.results[vertex, fragment] = program
+
+    def forget(self, program):
+        """
+            Drop a program which has been deleted
+        """
+        with self.lock:
+            for key in [key for key, result in self.results.items() if result == program]:
+                del self.results[key]
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+class VariantPass(Pass):
+    def __init__(self, vertex, fragment, variants, variant=None, defines=None, **options):
+        """
+            variants -> list of (name, defines) selectable while running
+            variant -> Name of the variant to start with (Default: the first)
+            defines -> Defines of every variant (overridden by the variant's own)
+            options -> Pass options
+        """
+        Pass.__init__(self, vertex, fragment, **options)
+        self.variants = list(variants)
+        self.common = dict(defines or {})
+        self.variant = variant or self.variants[0][0]
+        if self.variant not in self.names():
+            raise ValueError("Unknown variant '{}'".format(self.variant))
+        self.wanted = self.variant
+        self.compiler = None
+
+    def names(self):
+        return [name for name, defines in self.variants]
+
+    def defines(self, variant=None):
+        defines = dict(self.common)
+        defines.update(dict(self.variants)[variant or self.variant])
+        return defines
+
+    def prepare(self, source, stage='fragment', variant=None):
+        return Pass.prepare(self, specialize(source, self.defines(variant)), stage)
+
+    def sources(self, variant=None):
+        """
+            return -> vertex and fragment source of 'variant' as compiled
+        """
+        return self.prepare(self.vertex, 'vertex', variant), self.prepare(self.fragment, 'fragment', variant)
+
+    def build(self, renderer):
+        self.common.update(renderer.defines)
+        self.compiler = renderer.variant_compiler()
+        # Only the current variant, the others are requested by select()
+        Pass.build(self, renderer)
+
+    def select(self, variant):
+        """
+            Switch to 'variant' as soon as it is compiled (the current one is drawn until then),
+            before build() the variant to start with
+        """
+        if variant not in self.names():
+            raise ValueError("Unknown variant '{}'".format(variant))
+        self.wanted = variant
+        if self.compiler is None:
+            self.variant = variant
+        else:
+            self.compiler.request(*self.sources(variant))
+
+    def set_program(self, program):
+        Pass.set_program(self, program)
+        # Switching back to it needs no compile
+        if self.compiler is not None:
+            self.compiler.add(*(self.sources() + (program,)))
+
+    def replace(self, program):
+        # The current program gets deleted (hot reload), the other variants are compiled from the old source
+        old = self.program
+        Pass.replace(self, program)
+        self.compiler.forget(old)
+
+    def _swap(self, renderer):
+        try:
+            program = self.compiler.result(*self.sources(self.wanted))
+        except RuntimeError as error:
+            sys.stderr.write("Variant '{}': {}\n".format(self.wanted, error.args[0] if error.args else error))
+            self.wanted = self.variant
+            return
+        if program is None:
+            return
+
+        # Stages kept for hot reload belong to the old variant
+        for shader in self.shaders.values():
+            glDeleteShader(shader)
+        self.shaders = {}
+
+        self.variant = self.wanted
+        self.set_program(program)
+        renderer.state.invalidate()
+
+    def draw(self, renderer, mouse, ticks):
+        if self.wanted != self.variant:
+            self._swap(renderer)
+        Pass.draw(self, renderer, mouse, ticks)